@@ -91,7 +91,8 @@
   }
 
   const state = {
-    rows:[], filtered:[], asOf:'', interval:'', period:'', rf:0,
+    rows:[], filtered:[], asOf:'', interval:'', period:'', rf:0, histBust:'',
+    windows:{}, enrichedKey:'', histVersion:0,
     expanded:new Set(), ivHist:{},
     ui: { rsiWin:30, sharpeWin:120, ivWin:180 },
   };
@@ -102,17 +103,73 @@
     ivHigh:"High IV (Sell)", ivLow:"Low IV (Buy)", event:"Event Spike"
   };
 
+  // sharded snapshots (build_snapshot.py --format sharded): history lives in
+  // data/hist/<SYM>.json and is fetched on demand, once per symbol.
+  const HIST_FIRST = 60;          // rows hydrated eagerly after each render
+  const HIST_CONCURRENCY = 8;
+  const histMemo = new Map();     // symbol -> Promise<hist|null>
+
+  function loadHist(r){
+    if (r.hist || !r.hist_file) return Promise.resolve(r.hist || null);
+    if (!histMemo.has(r.symbol)){
+      histMemo.set(r.symbol, fetch(`data/${r.hist_file}?${state.histBust}`)
+        .then(res => res.ok ? res.json() : null)
+        .then(h => { if (h) r.hist = {t:h.t||[], c:h.c||[], v:h.v||[]}; return r.hist || null; })
+        .catch(() => null));
+    }
+    return histMemo.get(r.symbol);
+  }
+
+  // Hydrate the rows that need history right now: the top of the current view and
+  // expanded rows, or every filtered row when sorting by a history-derived column.
+  async function hydrateVisible(){
+    // Rows carrying precomputed grids for the selected windows never need a shard.
+    const all = ['rsi_ui','sharpe_ui'].includes($('sort').value);
+    const want = all ? state.filtered
+      : state.filtered.slice(0, HIST_FIRST).concat(state.filtered.filter(r => state.expanded.has(r.symbol)));
+    const need = want.filter(r => !r.hist && r.hist_file && !histMemo.has(r.symbol) && needsHist(r));
+    if (!need.length) return;
+    let next = 0;
+    const worker = async () => { while (next < need.length) await loadHist(need[next++]); };
+    await Promise.all(Array.from({length: Math.min(HIST_CONCURRENCY, need.length)}, worker));
+    state.histVersion++;
+    applyFilters(); render();
+  }
+
+  // Server-precomputed value for the selected window (rsi_w/sharpe_w/ivr_w/ivp_w),
+  // or undefined when the snapshot predates the grids or lacks that window.
+  function gridVal(row, field, wins, win){
+    const i = Array.isArray(wins) ? wins.indexOf(win) : -1;
+    return (i >= 0 && Array.isArray(row[field])) ? row[field][i] : undefined;
+  }
+
+  function needsHist(row){
+    const w = state.windows;
+    return gridVal(row, 'rsi_w', w.rsi, state.ui.rsiWin) === undefined
+        || gridVal(row, 'sharpe_w', w.sharpe, state.ui.sharpeWin) === undefined;
+  }
+
   function enrichForUI(row){
-    const c = (row.hist && Array.isArray(row.hist.c)) ? row.hist.c.map(Number) : [];
-    row.rsi_ui = (c.length >= state.ui.rsiWin + 1) ? rsi(c, state.ui.rsiWin) : null;
-    row.sharpe_ui = (c.length >= state.ui.sharpeWin) ? sharpeFromCloses(c, state.ui.sharpeWin, state.rf, state.interval) : null;
+    const w = state.windows;
+    let rsiV = gridVal(row, 'rsi_w', w.rsi, state.ui.rsiWin);
+    let shpV = gridVal(row, 'sharpe_w', w.sharpe, state.ui.sharpeWin);
+    if (rsiV === undefined || shpV === undefined){
+      const c = (row.hist && row.hist.c) ? Array.from(row.hist.c, Number) : [];
+      if (rsiV === undefined) rsiV = (c.length >= state.ui.rsiWin + 1) ? rsi(c, state.ui.rsiWin) : null;
+      if (shpV === undefined) shpV = (c.length >= state.ui.sharpeWin) ? sharpeFromCloses(c, state.ui.sharpeWin, state.rf, state.interval) : null;
+    }
+    row.rsi_ui = rsiV;
+    row.sharpe_ui = shpV;
 
     // IV rank/%ile using history
-    const ivSeries = (state.ivHist[row.symbol] || []).map(Number);
-    const curIV = Number.isFinite(+row.iv30) ? +row.iv30 : null;
     const win = state.ui.ivWin;
-    const enoughIV = ivSeries.length >= Math.max(2, win);
-    const {rank, pct} = enoughIV && curIV!=null ? ivRankPct(ivSeries, curIV, win) : {rank:null, pct:null};
+    let rank = gridVal(row, 'ivr_w', w.iv, win), pct = gridVal(row, 'ivp_w', w.iv, win);
+    if (rank === undefined || pct === undefined){
+      const ivSeries = (state.ivHist[row.symbol] || []).map(Number);
+      const curIV = Number.isFinite(+row.iv30) ? +row.iv30 : null;
+      const enoughIV = ivSeries.length >= Math.max(2, win);
+      ({rank, pct} = enoughIV && curIV!=null ? ivRankPct(ivSeries, curIV, win) : {rank:null, pct:null});
+    }
     row.iv_rank_ui = rank == null ? null : +rank;
     row.iv_pct_ui  = pct  == null ? null : +pct;
 
@@ -121,6 +178,15 @@
     return row;
   }
 
+  // Derived values only depend on the window selection (and on which history
+  // shards are loaded), so rows are re-enriched only when that key changes.
+  function enrichAll(){
+    const key = `${state.ui.rsiWin}|${state.ui.sharpeWin}|${state.ui.ivWin}|${state.histVersion}`;
+    if (key === state.enrichedKey) return;
+    state.rows.forEach(enrichForUI);
+    state.enrichedKey = key;
+  }
+
   function chip(a){
     const sev = a.sev || 'info';
     const lbl = a.label || ALERT_LABELS[a.code] || a.code;
@@ -136,7 +202,8 @@
     const dir = $('dir').value === 'asc' ? 1 : -1;
     const af = $('alertFilter').value;
 
-    let rows = state.rows.slice().map(enrichForUI);
+    enrichAll();
+    let rows = state.rows.slice();
     if (q) rows = rows.filter(r => r.symbol.toLowerCase().includes(q) || (r.name||'').toLowerCase().includes(q));
     if (sec) rows = rows.filter(r => r.sector === sec);
     if (af) rows = rows.filter(r => (Array.isArray(r.alerts) && r.alerts.some(a => a.code === af)));
@@ -210,7 +277,7 @@
 
   function updateStatus(){
     const haveIV = Object.keys(state.ivHist||{}).length;
-    const maxHist = Math.max(0, ...state.rows.map(r => (r.hist && r.hist.c ? r.hist.c.length : 0)));
+    const maxHist = Math.max(0, ...state.rows.map(r => (r.hist && r.hist.c ? r.hist.c.filter(Number.isFinite).length : (r.hist_n || 0))));
     $('meta').textContent =
       `${state.filtered.length} shown • ${state.interval} ${state.period} • maxHist=${maxHist} • ivHist=${haveIV} syms`;
     $('asof').textContent = `As of ${state.asOf || '—'}`;
@@ -271,17 +338,99 @@
     });
 
     updateStatus();
+    hydrateVisible();
+  }
+
+  // columnar snapshot (build_snapshot.py --format columnar)
+  function b64f32(s){
+    const bin = atob(s || '');
+    const u8 = new Uint8Array(bin.length);
+    for (let i=0;i<bin.length;i++) u8[i] = bin.charCodeAt(i);
+    return new Float32Array(u8.buffer);
+  }
+
+  function fromColumnar(js){
+    const n = js.count || 0, T = (js.t || []).length;
+    const C = b64f32(js.hist && js.hist.c), V = b64f32(js.hist && js.hist.v);
+    const L = (js.spark30 && js.spark30.shape) ? js.spark30.shape[1] : 0;
+    const SP = L ? b64f32(js.spark30.b64) : null;
+    const keys = Object.keys(js.cols || {});
+    const out = new Array(n);
+    for (let i=0;i<n;i++){
+      const x = {};
+      for (const k of keys) x[k] = js.cols[k][i];
+      // views on the shared axis; NaN = no bar (RSI/Sharpe already skip non-finite values)
+      x.hist = { t: js.t, c: C.subarray(i*T, (i+1)*T), v: V.subarray(i*T, (i+1)*T) };
+      if (SP){
+        const sp = Array.from(SP.subarray(i*L, (i+1)*L)).filter(Number.isFinite);
+        x.spark30 = sp.length >= 2 ? sp : null;
+      }
+      out[i] = x;
+    }
+    return out;
+  }
+
+  // delta snapshots (build_snapshot.py --delta): base snapshot.json + snapshot.delta.json
+  let baseMemo = null;
+
+  function applyDelta(base, d){
+    const by = new Map((base.data||[]).map(r => [r.symbol, r]));
+    for (const s of d.removed||[]) by.delete(s);
+    for (const r of d.replace||[]) by.set(r.symbol, r);
+    for (const [s, ch] of Object.entries(d.rows||{})){
+      const r = by.get(s); if (r) by.set(s, Object.assign({}, r, ch));
+    }
+    for (const [s, b] of Object.entries(d.bars||{})){
+      const r = by.get(s); if (!r) continue;
+      const h = r.hist || {};
+      const cut = k => (h[k]||[]).slice(b.drop||0, (h[k]||[]).length-(b.trim||0)).concat(b[k]||[]);
+      by.set(s, Object.assign({}, r, {hist:{t:cut('t'), c:cut('c'), v:cut('v')}}));
+    }
+    const order = d.order || (base.data||[]).map(r => r.symbol);
+    const data = order.map(s => by.get(s)).filter(Boolean);
+    return Object.assign({}, base, {
+      as_of_utc:d.as_of_utc, interval:d.interval, period:d.period, risk_free:d.risk_free,
+      windows:d.windows, count:data.length, data
+    });
+  }
+
+  async function getJson(url, opts){
+    try{
+      const r = await fetch(url, opts);
+      return r.ok ? await r.json() : null;
+    }catch(_){ return null; }
+  }
+
+  async function fetchSnapshot(ts){
+    // a delta only exists next to a base marked delta:true, so probe for it only then
+    let d = baseMemo ? await getJson(`data/snapshot.delta.json?${ts}`, {cache:'no-store'}) : null;
+    if (d && baseMemo.as_of_utc === d.base_as_of) return applyDelta(baseMemo, d);
+    // the base only changes on compaction, so let the browser cache it per base_as_of
+    let base = d ? await getJson(`data/snapshot.json?v=${encodeURIComponent(d.base_as_of)}`) : null;
+    if (!base || base.as_of_utc !== d.base_as_of){
+      base = await (await fetch(`data/snapshot.json?${ts}`, {cache:'no-store'})).json();
+    }
+    baseMemo = null;
+    if (!base.delta || base.format) return base;
+    if (!d || d.base_as_of !== base.as_of_utc) d = await getJson(`data/snapshot.delta.json?${ts}`, {cache:'no-store'});
+    if (d && d.base_as_of === base.as_of_utc){
+      baseMemo = base;
+      return applyDelta(base, d);
+    }
+    return base;
   }
 
   async function load(){
     const ts = bust();
     // snapshot
-    const snapRes = await fetch(`data/snapshot.json?${ts}`, {cache:'no-store'});
-    const js = await snapRes.json();
+    const js = await fetchSnapshot(ts);
+    if (String(js.format||'').startsWith('columnar')) js.data = fromColumnar(js);
     state.asOf = js.as_of_utc || '';
     state.interval = js.interval || '';
     state.period = js.period || '';
     state.rf = Number(js.risk_free || 0);
+    state.windows = js.windows || {};
+    state.histBust = `v=${encodeURIComponent(state.asOf)}`;   // shards change once per build
 
     state.rows = (js.data||[]).map(x => ({
       symbol:x.symbol, name:x.name??x.symbol, sector:x.sector??'—',
@@ -289,7 +438,9 @@
       vol_z:x.vol_z, iv30:x.iv30, iv_rank:x.iv_rank, iv_percentile:x.iv_percentile,
       mcap:x.mcap, pe_ttm:x.pe_ttm, pb:x.pb, div_yield:x.div_yield, beta:x.beta,
       news_24h:x.news_24h, spark30:(Array.isArray(x.spark30)?x.spark30:null),
-      hist:(x.hist||null), alerts:(Array.isArray(x.alerts)?x.alerts:[]),
+      rsi_w:x.rsi_w, sharpe_w:x.sharpe_w, ivr_w:x.ivr_w, ivp_w:x.ivp_w,
+      hist:(x.hist||null), hist_file:(x.hist_file||null), hist_n:(x.hist_n||0),
+      alerts:(Array.isArray(x.alerts)?x.alerts:[]),
       // UI-calculated
       rsi_ui:null, sharpe_ui:null, iv_rank_ui:null, iv_pct_ui:null, alertCount:0
     }));
@@ -0,0 +1,570 @@
+# scripts/bench_snapshot.py
+#!/usr/bin/env python3
+"""
+Offline benchmark for build_snapshot.py.
+
+  record  capture chart JSON (the _chart_to_df input), option chains, get_info
+          payloads and the Wikipedia universe pages once (needs network)
+  run     replay those captures with synthetic latency / failure rates and
+          report per-stage timings at several universe sizes as JSON
+
+Replayed symbols cycle through the recorded ones (AAPL, MSFT, …, AAPL_1, …), so
+5000 symbols need only a few dozen fixtures. Without recorded fixtures, `run`
+synthesizes a deterministic set (random-walk bars, Black-Scholes chains).
+Uploads go to an in-process stand-in for the GitHub git data API.
+
+  python scripts/bench_snapshot.py record --symbols AAPL,MSFT,SPY
+  python scripts/bench_snapshot.py run --sizes 50,500,5000 --latency-ms 30 --fail-rate 0.02 --out bench.json
+"""
+
+import os, re, sys, json, time, math, random, hashlib, argparse, logging, tempfile, threading, shutil
+from collections import namedtuple
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+# hermetic builder: no local caches, IV history in a scratch folder (read at import)
+_SCRATCH = tempfile.mkdtemp(prefix="vtrac-bench-")
+for _k in ("BAR_STORE_PATH", "FUND_CACHE_PATH", "OPTION_CACHE_DIR", "JOURNAL_DIR", "NEWS_CACHE_PATH"):
+    os.environ[_k] = ""
+os.environ["IV_STORE_PATH"] = os.path.join(_SCRATCH, "iv", "iv_history.npz")
+os.environ["UNIVERSE_CACHE_PATH"] = os.path.join(_SCRATCH, "universe.json")
+os.environ["IV_HISTORY_PATH"] = os.path.join(_SCRATCH, "iv", "iv_history.json")
+os.environ["ANALYTICS_PATH"] = os.path.join(_SCRATCH, "analytics.json")
+os.environ.setdefault("HTTP_RATE_GITHUB", "1000")   # the stand-in is local; don't pace it like api.github.com
+
+import numpy as np
+import pandas as pd
+import requests
+import build_snapshot as bs
+
+FIXTURES_DIR = os.getenv("BENCH_FIXTURES", ".cache/bench")
+WIKI_PAGES = {"sp500": "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies",
+              "nas100": "https://en.wikipedia.org/wiki/NASDAQ-100",
+              "dow30": "https://en.wikipedia.org/wiki/Dow_Jones_Industrial_Average"}
+OptionChain = namedtuple("OptionChain", "calls puts")
+
+# ───────────────────── Fixtures ─────────────────────
+class Fixtures:
+    """chart/<SYM>.json, info/<SYM>.json, chain/<SYM>.json, wiki/<page>.html + meta.json under root."""
+    def __init__(self, root: str = FIXTURES_DIR):
+        self.root = root
+        try:
+            with open(os.path.join(root, "meta.json")) as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {}
+        self._mem = {}
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return bool(self.meta.get("symbols"))
+
+    def _path(self, kind, name, ext="json"):
+        return os.path.join(self.root, kind, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.{ext}")
+
+    def put(self, kind, name, obj, ext="json"):
+        path = self._path(kind, name, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            if ext == "json": json.dump(obj, f, default=str)
+            else: f.write(obj)
+
+    def get(self, kind, name, ext="json"):
+        key = (kind, name)
+        with self._lock:
+            if key in self._mem: return self._mem[key]
+        try:
+            with open(self._path(kind, name, ext), encoding="utf-8") as f:
+                obj = json.load(f) if ext == "json" else f.read()
+        except (OSError, ValueError):
+            obj = None
+        with self._lock:
+            self._mem[key] = obj
+        return obj
+
+    def save_meta(self, **meta):
+        self.meta = meta
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+def record(fx: Fixtures, symbols, period: str, interval: str):
+    """Capture live payloads for `symbols` (one pass, sequential)."""
+    http = bs.get_http()
+    ok = []
+    for sym in symbols:
+        r = http.get(f"https://query2.finance.yahoo.com/v8/finance/chart/{sym}", timeout=20,
+                     params={"range": period, "interval": interval, "includeAdjustedClose": "true",
+                             "events": "div,splits,capitalGains"})
+        if r.status_code != 200:
+            logging.warning("record %s: chart %s", sym, r.status_code); continue
+        fx.put("chart", sym, r.json())
+        tk = bs.yf.Ticker(sym)
+        try: fx.put("info", sym, tk.get_info())
+        except Exception as e: logging.warning("record %s: info %s", sym, e)
+        try:
+            exps = list(tk.options or [])
+            keep = {e for e in (bs._choose_30d_expirations(exps), *bs._bracket_30d_expirations(exps)) if e}
+            chains = {}
+            for e in sorted(keep):
+                ch = tk.option_chain(e)
+                chains[e] = {"calls": ch.calls.to_dict("records"), "puts": ch.puts.to_dict("records")}
+            fx.put("chain", sym, {"expirations": exps, "chains": chains})
+        except Exception as e:
+            logging.warning("record %s: options %s", sym, e)
+        ok.append(sym)
+        logging.info("recorded %s", sym)
+    for name, url in WIKI_PAGES.items():
+        r = http.get(url, headers=bs.HDR, timeout=30)
+        if r.status_code == 200: fx.put("wiki", name, r.text, ext="html")
+    fx.save_meta(source="live", recorded_on=datetime.utcnow().strftime("%Y-%m-%d"),
+                 period=period, interval=interval, symbols=ok)
+    return ok
+
+def synthesize(fx: Fixtures, n: int = 50, bars: int = 400, seed: int = 7):
+    """Deterministic stand-in fixtures: random-walk daily bars, fundamentals, BS-priced chains."""
+    rng = np.random.default_rng(seed)
+    today = datetime.utcnow().date()
+    days = pd.bdate_range(end=pd.Timestamp(today), periods=bars)
+    ts = [int(d.timestamp()) + 20*3600 for d in days]
+    symbols = [f"SYN{i:03d}" for i in range(n)]
+    for sym in symbols:
+        p0, vol = rng.uniform(20, 500), rng.uniform(0.15, 0.6)
+        close = p0 * np.exp(np.cumsum(rng.normal(0, vol/math.sqrt(252), bars)))
+        volume = np.round(rng.lognormal(14, 0.4, bars))
+        q = {"open": close.tolist(), "high": (close*1.01).tolist(), "low": (close*0.99).tolist(),
+             "close": close.tolist(), "volume": volume.tolist()}
+        fx.put("chart", sym, {"chart": {"result": [{"timestamp": ts, "indicators": {
+            "quote": [q], "adjclose": [{"adjclose": close.tolist()}]}}], "error": None}})
+        eps = close[-1] / rng.uniform(8, 40)
+        fx.put("info", sym, {"sharesOutstanding": float(rng.uniform(1e8, 5e9)), "trailingEps": eps,
+                             "bookValue": close[-1] / rng.uniform(1, 10), "dividendYield": float(rng.uniform(0, 3)),
+                             "beta": float(rng.uniform(0.5, 1.8))})
+        exps = [(today + timedelta(days=d)).strftime("%Y-%m-%d") for d in (7, 14, 21, 28, 35, 49, 63, 91)]
+        spot, chains = float(close[-1]), {}
+        K = spot * np.arange(0.8, 1.2001, 0.025)
+        for e in exps[2:6]:
+            T = bs._years_to(e)
+            sides = {}
+            for side, is_call in (("calls", True), ("puts", False)):
+                px, _ = bs._bs_price_vec(spot, K, T, 0.0, 0.0, vol, np.full(len(K), is_call))
+                sides[side] = [{"strike": float(k), "bid": round(float(p)*0.98, 2), "ask": round(float(p)*1.02 + 0.01, 2),
+                                "lastPrice": round(float(p), 2), "impliedVolatility": vol,
+                                "volume": 10, "openInterest": 100} for k, p in zip(K, px)]
+            chains[e] = sides
+        fx.put("chain", sym, {"expirations": exps, "chains": chains})
+    rows = "".join(f"<tr><td>{s}</td><td>{s} Inc</td></tr>" for s in symbols)
+    for name in WIKI_PAGES:
+        fx.put("wiki", name, f"<table><tr><th>Symbol</th><th>Security</th></tr>{rows}</table>", ext="html")
+    fx.save_meta(source="synthetic", recorded_on=today.strftime("%Y-%m-%d"), period="2y", interval="1d",
+                 symbols=symbols)
+    return symbols
+
+# ───────────────────── Replay ─────────────────────
+def _response(url: str, status: int, body: bytes, ctype: str = "application/json") -> requests.Response:
+    r = requests.Response()
+    r.status_code, r._content, r.url, r.encoding = status, body, url, "utf-8"
+    r.headers["Content-Type"] = ctype
+    return r
+
+class Replay:
+    """
+    Serves fixtures in place of Yahoo (yf.download, yf.Ticker, chart JSON), Wikipedia
+    and NewsAPI, sleeping latency_ms ± jitter_ms per call and failing fail_rate of
+    them (HTTP 503, missing download columns or a raised Ticker call). Everything
+    else (the GitHub stand-in) goes through the real session.
+    """
+    def __init__(self, fx: Fixtures, latency_ms=0.0, jitter_ms=0.0, fail_rate=0.0, seed=0):
+        self.fx, self.latency, self.jitter, self.fail_rate = fx, latency_ms, jitter_ms, fail_rate
+        self.base = list(fx.meta.get("symbols") or [])
+        self.shift = (datetime.utcnow().date() - datetime.strptime(fx.meta.get("recorded_on"), "%Y-%m-%d").date()).days
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {}
+        self._saved = None
+
+    def universe(self, n: int) -> list:
+        return [b if k == 0 else f"{b}_{k}" for k in range(n // len(self.base) + 1) for b in self.base][:n]
+
+    def base_of(self, sym: str) -> str:
+        head, _, tail = sym.rpartition("_")
+        return head if head and tail.isdigit() else sym
+
+    def _calls(self, kind: str, n: int) -> list:
+        """One latency for n parallel calls; per call, False when it should fail."""
+        with self._lock:
+            d = max(0.0, self._rng.gauss(self.latency, self.jitter)) / 1000.0
+            ok = [self._rng.random() >= self.fail_rate for _ in range(n)]
+            st = self.stats.setdefault(kind, {"calls": 0, "failed": 0})
+            st["calls"] += n; st["failed"] += n - sum(ok)
+        if d: time.sleep(d)
+        return ok
+
+    def _call(self, kind: str) -> bool:
+        return self._calls(kind, 1)[0]
+
+    def frame(self, sym: str, start=None) -> pd.DataFrame:
+        js = self.fx.get("chart", self.base_of(sym))
+        df = bs._chart_to_df(js) if js else pd.DataFrame()
+        if start is not None and not df.empty:
+            st = pd.Timestamp(start)
+            df = df[df.index >= (st.tz_convert(None) if st.tzinfo else st)]
+        return df
+
+    # yf.download(tickers, ...) as yfinance returns it (ticker level only for lists)
+    def download(self, tickers, period=None, interval=None, start=None, group_by="column",
+                 multi_level_index=True, threads=1, **_):
+        names = [tickers] if isinstance(tickers, str) else list(tickers)
+        frames = {}
+        for k in range(0, len(names), max(1, int(threads or 1))):   # yfinance threads fetch in parallel
+            wave = names[k:k+max(1, int(threads or 1))]
+            oks = self._calls("yf.download", len(wave))
+            frames.update({s: self.frame(s, start) for s, ok in zip(wave, oks) if ok})
+        frames = {s: df for s, df in frames.items() if not df.empty}
+        if not frames:
+            return pd.DataFrame()
+        if isinstance(tickers, str) and not multi_level_index:
+            return frames[tickers]
+        return pd.concat(frames, axis=1)
+
+    def ticker(self, sym: str):
+        return ReplayTicker(self, sym)
+
+    def http(self, method, url, params=None, **_):
+        key = bs.host_key(url)
+        if not self._call(key):
+            return _response(url, 503, b'{"error":"replay failure"}')
+        parts = urlsplit(url)
+        if key == "yahoo" and "/chart/" in parts.path:
+            sym = parts.path.rsplit("/", 1)[-1]
+            js = self.fx.get("chart", self.base_of(sym.replace(".", "-"))) or self.fx.get("chart", self.base_of(sym))
+            if not js:
+                return _response(url, 404, b'{"chart":{"result":null,"error":{"code":"Not Found"}}}')
+            return _response(url, 200, json.dumps(js).encode())
+        if key == "wikipedia":
+            name = next((n for n, u in WIKI_PAGES.items() if urlsplit(u).path == parts.path), None)
+            html = self.fx.get("wiki", name, ext="html") if name else None
+            return _response(url, 200 if html else 404, (html or "").encode(), "text/html")
+        if key == "newsapi":
+            # heavy-tailed article count per OR-ed term (mostly 0–3), one title each; the page holds the first 100
+            terms = re.findall(r'"([^"]+)"', (params or {}).get("q", ""))
+            with self._lock: counts = [min(int(self._rng.paretovariate(1.2)) - 1, 80) for _ in terms]
+            arts = [{"title": f"{t} shares move on story {i}", "description": None, "content": None}
+                    for t, n in zip(terms, counts) for i in range(n)]
+            return _response(url, 200, json.dumps({"status": "ok", "totalResults": len(arts),
+                                                   "articles": arts[:bs.NEWS_PAGE]}).encode())
+        return _response(url, 404, b"{}")
+
+    def install(self):
+        """Patch yfinance and the shared HTTP client's session; uninstall() restores them."""
+        http = bs.get_http()
+        replay = self
+        class _Session:
+            headers = http.session.headers
+            def __init__(self, real): self.real = real
+            def mount(self, *a): return self.real.mount(*a)
+            def request(self, method, url, **kw):
+                if bs.host_key(url) in ("yahoo", "wikipedia", "newsapi"):
+                    return replay.http(method, url, **kw)
+                return self.real.request(method, url, **kw)
+        self._saved = (bs.yf.download, bs.yf.Ticker, http, http.session)
+        bs.yf.download, bs.yf.Ticker = self.download, self.ticker
+        http.session = _Session(http.session)
+
+    def uninstall(self):
+        if self._saved:
+            bs.yf.download, bs.yf.Ticker, http, sess = self._saved
+            http.session = sess
+            self._saved = None
+
+class ReplayTicker:
+    def __init__(self, replay: Replay, sym: str):
+        self.r, self.sym, self.base = replay, sym, replay.base_of(sym)
+        self.fast_info = {}
+
+    def _shifted(self, exp: str) -> str:
+        return (datetime.strptime(exp, "%Y-%m-%d") + timedelta(days=self.r.shift)).strftime("%Y-%m-%d")
+
+    @property
+    def options(self):
+        if not self.r._call("yf.options"): raise RuntimeError("replay failure")
+        ch = self.r.fx.get("chain", self.base) or {}
+        return tuple(self._shifted(e) for e in ch.get("expirations") or [])
+
+    def option_chain(self, exp: str):
+        if not self.r._call("yf.option_chain"): raise RuntimeError("replay failure")
+        ch = self.r.fx.get("chain", self.base) or {}
+        orig = {self._shifted(e): e for e in ch.get("chains") or {}}
+        c = (ch.get("chains") or {}).get(orig.get(exp)) or {}
+        return OptionChain(pd.DataFrame(c.get("calls") or []), pd.DataFrame(c.get("puts") or []))
+
+    def get_info(self):
+        if not self.r._call("yf.get_info"): raise RuntimeError("replay failure")
+        return dict(self.r.fx.get("info", self.base) or {})
+
+# ───────────────────── GitHub stand-in ─────────────────────
+class LocalGitHub:
+    """In-memory git data API (refs, commits, trees, blobs) for one repo on 127.0.0.1."""
+    def __init__(self, branch: str = "main"):
+        self.blobs, self.trees, self.commits, self.refs = {}, {}, {}, {}
+        self.requests = 0
+        self.refs[branch] = self._commit(self._tree({}), [], "init")
+        gh = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *a): pass
+            def do_GET(self): gh._route(self, "GET")
+            def do_POST(self): gh._route(self, "POST")
+            def do_PATCH(self): gh._route(self, "PATCH")
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown(); self.server.server_close()
+
+    def _id(self, *parts) -> str:
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def _tree(self, files: dict) -> str:
+        sha = self._id("tree", files); self.trees[sha] = dict(files); return sha
+
+    def _commit(self, tree, parents, msg) -> str:
+        sha = self._id("commit", tree, parents, msg)
+        self.commits[sha] = {"tree": tree, "parents": parents, "message": msg}
+        return sha
+
+    def _route(self, h, method):
+        self.requests += 1
+        n = int(h.headers.get("Content-Length") or 0)
+        body = json.loads(h.rfile.read(n) or b"{}") if n else {}
+        path = urlsplit(h.path).path.split("/git/", 1)[-1]
+        code, out = 404, {}
+        if path.startswith("refs/heads/"):
+            b = path[len("refs/heads/"):]
+            if method == "GET" and b in self.refs:
+                code, out = 200, {"object": {"sha": self.refs[b]}}
+            elif method == "PATCH" and b in self.refs:
+                ff = self.refs[b] in self.commits.get(body.get("sha"), {}).get("parents", [])
+                if ff or body.get("force"):
+                    self.refs[b] = body["sha"]; code, out = 200, {"object": {"sha": body["sha"]}}
+                else:
+                    code = 422
+        elif path == "refs" and method == "POST":
+            b = body["ref"][len("refs/heads/"):]
+            if b not in self.refs: self.refs[b] = body["sha"]; code = 201
+            else: code = 422
+        elif path.startswith("commits/") and method == "GET":
+            c = self.commits.get(path[len("commits/"):])
+            if c: code, out = 200, {"sha": path[len("commits/"):], "tree": {"sha": c["tree"]}}
+        elif path.startswith("trees/") and method == "GET":
+            t = self.trees.get(path[len("trees/"):])
+            if t is not None:
+                code, out = 200, {"tree": [{"path": p, "type": "blob", "sha": s} for p, s in t.items()], "truncated": False}
+        elif path == "blobs" and method == "POST":
+            data = body["content"].encode() if body.get("encoding") == "utf-8" else bs.base64.b64decode(body["content"])
+            sha = bs.git_blob_sha(data); self.blobs[sha] = data; code, out = 201, {"sha": sha}
+        elif path == "trees" and method == "POST":
+            files = dict(self.trees[body["base_tree"]])
+            for e in body.get("tree") or []:
+                if e.get("sha") is None: files.pop(e["path"], None)
+                else: files[e["path"]] = e["sha"]
+            code, out = 201, {"sha": self._tree(files)}
+        elif path == "commits" and method == "POST":
+            code, out = 201, {"sha": self._commit(body["tree"], body["parents"], body["message"])}
+        data = json.dumps(out).encode()
+        h.send_response(code)
+        h.send_header("Content-Type", "application/json"); h.send_header("Content-Length", str(len(data)))
+        h.end_headers(); h.wfile.write(data)
+
+# ───────────────────── Stage timers ─────────────────────
+# stage → builder functions whose calls are timed (summed across worker threads)
+STAGES = {
+    "fetch": ("download_batch", "sync_bars", "_fallback_bars", "try_download"),
+    "compute": ("Panel.__init__", "Panel.indicators", "add_window_grids", "add_analytics"),
+    "fundamentals": ("fetch_fundamentals",),
+    "iv": ("fetch_iv30",),
+    "news": ("fetch_news_page",),
+}
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+        self._saved = []
+
+    def add(self, stage: str, dt: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(dt)
+
+    def wrap(self, stage: str, fn):
+        def timed(*a, **kw):
+            t = time.perf_counter()
+            try: return fn(*a, **kw)
+            finally: self.add(stage, time.perf_counter() - t)
+        return timed
+
+    def install(self):
+        for stage, names in STAGES.items():
+            for name in names:
+                owner, attr = (bs.Panel, name.split(".", 1)[1]) if name.startswith("Panel.") else (bs, name)
+                fn = getattr(owner, attr)
+                self._saved.append((owner, attr, fn))
+                setattr(owner, attr, self.wrap(stage, fn))
+
+    def uninstall(self):
+        for owner, attr, fn in reversed(self._saved):
+            setattr(owner, attr, fn)
+        self._saved = []
+
+    def summary(self) -> dict:
+        out = {}
+        for stage, xs in self.samples.items():
+            a = np.array(xs)
+            out[stage] = {"calls": len(xs), "total_s": round(float(a.sum()), 4),
+                          "p50_ms": round(float(np.percentile(a, 50))*1000, 2),
+                          "p95_ms": round(float(np.percentile(a, 95))*1000, 2),
+                          "max_ms": round(float(a.max())*1000, 2)}
+        return out
+
+# ───────────────────── Runs ─────────────────────
+def _dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+
+def bench_size(replay: Replay, gh: LocalGitHub, n: int, args) -> dict:
+    shutil.rmtree(os.path.join(_SCRATCH, "iv"), ignore_errors=True)
+    out_dir = os.path.join(_SCRATCH, f"out{n}")
+    shutil.rmtree(out_dir, ignore_errors=True)
+    bs._HTTP = None                        # fresh client → per-run HTTP metrics
+    bs.IV_MAX = args.iv_max
+    timer = StageTimer()
+    replay.stats = {}
+    bs.get_metrics().reset()
+    replay.install(); timer.install()
+    try:
+        t = time.perf_counter()
+        bs.get_universe(True, ["SP500", "NAS100", "DOW30"])
+        universe_s = time.perf_counter() - t
+
+        symbols = replay.universe(n)
+        t = time.perf_counter()
+        snap, iv_path = bs.build_snapshot(symbols, news_key="bench" if args.news else None,
+                                          period=args.period, interval=args.interval,
+                                          workers=args.workers, batch_size=args.batch_size, stream=args.stream)
+        build_s = time.perf_counter() - t
+    finally:
+        timer.uninstall(); replay.uninstall()
+
+    serialize = {}
+    for fmt in ("rows", "columnar", "sharded"):
+        path = os.path.join(out_dir, fmt, "snapshot.json")
+        t = time.perf_counter()
+        bs.write_local_snapshot(snap, path=path, pretty=(fmt == "rows"), fmt=fmt)
+        serialize[fmt] = {"s": round(time.perf_counter() - t, 4), "bytes": _dir_bytes(os.path.dirname(path))}
+
+    # upload: sharded index + shards + IV history in one commit, then the no-op re-publish
+    shard_root = os.path.join(out_dir, "sharded")
+    files = {f"docs/data/{os.path.relpath(os.path.join(d, f), shard_root)}": os.path.join(d, f)
+             for d, _, fs in os.walk(shard_root) for f in fs}
+    if iv_path:
+        files["docs/data/iv_history.json"] = iv_path
+    saved = (bs.GH_API_URL, os.environ.get("GH_TOKEN"), os.environ.get("GH_REPO"))
+    bs.GH_API_URL = gh.url
+    os.environ["GH_TOKEN"], os.environ["GH_REPO"] = "bench", "bench/vtrac"
+    try:
+        req0 = gh.requests
+        t = time.perf_counter(); bs.publish_to_github(files, prune=["docs/data/hist"]); upload_s = time.perf_counter() - t
+        req1 = gh.requests
+        t = time.perf_counter(); bs.publish_to_github(files, prune=["docs/data/hist"]); noop_s = time.perf_counter() - t
+    finally:
+        bs.GH_API_URL = saved[0]
+        for k, v in (("GH_TOKEN", saved[1]), ("GH_REPO", saved[2])):
+            if v is None: os.environ.pop(k, None)
+            else: os.environ[k] = v
+
+    return {
+        "symbols": n, "rows": snap["count"], "stream": args.stream, "peak_rss_mb": _peak_rss_mb(),
+        "build_s": round(build_s, 4), "universe_s": round(universe_s, 4),
+        "stages": timer.summary(),
+        "serialize": serialize,
+        "upload": {"files": len(files), "s": round(upload_s, 4), "requests": req1 - req0,
+                   "noop_s": round(noop_s, 4), "noop_requests": gh.requests - req1},
+        "builder": bs.get_metrics().summary(),
+        "replay": replay.stats,
+        "http": bs.get_http().metrics(),
+    }
+
+def _peak_rss_mb():
+    try:
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)   # KiB on Linux
+    except (ImportError, AttributeError):
+        return None
+
+# ───────────────────────── CLI ─────────────────────────
+def parse_args():
+    ap = argparse.ArgumentParser(description="Record/replay benchmark for build_snapshot.py.")
+    ap.add_argument("-v", "--verbose", action="count", default=0)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rec = sub.add_parser("record", help="Capture live fixtures (needs network)")
+    rec.add_argument("--fixtures", default=FIXTURES_DIR)
+    rec.add_argument("--symbols", default=",".join(bs.DOW30_SEED + ["SPY", "QQQ"]))
+    rec.add_argument("--period", default="2y")
+    rec.add_argument("--interval", default="1d")
+    run = sub.add_parser("run", help="Replay fixtures and report timings as JSON")
+    run.add_argument("--fixtures", default=FIXTURES_DIR)
+    run.add_argument("--synthetic", type=int, default=50,
+        help="Base symbols to synthesize when no recorded fixtures exist")
+    run.add_argument("--sizes", default="50,500,5000")
+    run.add_argument("--latency-ms", type=float, default=0.0)
+    run.add_argument("--jitter-ms", type=float, default=0.0)
+    run.add_argument("--fail-rate", type=float, default=0.0)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--workers", type=int, default=8)
+    run.add_argument("--batch-size", type=int, default=bs.YF_BATCH_SIZE)
+    run.add_argument("--iv-max", type=int, default=bs.IV_MAX)
+    run.add_argument("--news", action="store_true", help="Include (replayed) NewsAPI calls")
+    run.add_argument("--stream", action="store_true", help="Build with the on-disk row spool (peak_rss_mb is per process)")
+    run.add_argument("--period", default="2y")
+    run.add_argument("--interval", default="1d")
+    run.add_argument("--out", default=None, help="Write the JSON report here (default stdout)")
+    return ap.parse_args()
+
+def main():
+    args = parse_args()
+    bs.setup_logger(args.verbose)
+    fx = Fixtures(args.fixtures)
+    if args.cmd == "record":
+        syms = record(fx, [s.strip() for s in args.symbols.split(",") if s.strip()], args.period, args.interval)
+        logging.warning("Recorded %d symbol(s) → %s", len(syms), fx.root)
+        return
+    if not fx.exists():
+        synthesize(fx, n=args.synthetic)
+        logging.warning("No recorded fixtures in %s; synthesized %d symbol(s).", fx.root, args.synthetic)
+
+    replay = Replay(fx, args.latency_ms, args.jitter_ms, args.fail_rate, args.seed)
+    gh = LocalGitHub()
+    try:
+        runs = [bench_size(replay, gh, int(n), args) for n in args.sizes.split(",") if n.strip()]
+    finally:
+        gh.close()
+        shutil.rmtree(_SCRATCH, ignore_errors=True)
+    report = {
+        "as_of_utc": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "fixtures": {"root": fx.root, **{k: fx.meta.get(k) for k in ("source", "recorded_on", "interval")},
+                     "symbols": len(replay.base)},
+        "params": {k: getattr(args, k) for k in ("latency_ms", "jitter_ms", "fail_rate", "seed", "workers",
+                                                 "batch_size", "iv_max", "news", "period", "interval")},
+        "env": {"python": sys.version.split()[0], "numpy": np.__version__, "pandas": pd.__version__,
+                "cpus": os.cpu_count()},
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
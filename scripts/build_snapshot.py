@@ -6,20 +6,57 @@ Snapshot builder with:
   • Intraday support (YF_INTERVAL/YF_PERIOD)
   • Technicals (RSI, momentum, volume z-score)
   • Sharpe ratio (annualized)
-  • Fundamentals (mcap, P/E, P/B, div%, beta)
+  • Fundamentals (mcap, P/E, P/B, div%)
+  • Analytics from the price panel: rolling beta vs SPY / equal weight, correlation matrix, clusters → analytics.json
   • NEW: IV30 (ATM ~30D), IV Rank (52w), IV Percentile (252d)
+  • Alerts (breakout, pullback, RSI extremes/divergences, range, IV rank, event) → row.alerts
   • GitHub upload
+  • Subcommands: run (default) | fetch | compute (offline, from the bar store) | write | upload | bench
+    heavy imports (numpy/pandas/requests/yfinance) load on first use, so write/upload skip pandas+yfinance
 
 ENV (optional)
 -------------
 UNIVERSE=SP500,NAS100,DOW30,EXTRA
 UPDATE_SYMBOLS_FROM_WEB=0|1
+UNIVERSE_CACHE_PATH=.cache/universe.json   # last good index lists + ETags + dated adds/drops ("" = memory only)
+UNIVERSE_MAX_AGE_HOURS=12     # skip revalidating the Wikipedia pages while the cached lists are younger
 YF_INTERVAL=1d
 YF_PERIOD=120d
+YF_INTERVALS=1h,4h,1d         # multi-interval build (--intervals): 1d/1wk/1mo share one daily download, intraday
+YF_INTRADAY_PERIOD=60d        # intervals share one at their common Yahoo base (4h ← 1h, 10m ← 5m) over this period
 RISK_FREE=0.02
 IV_ENABLE=1
 IV_MAX=40
-IV_HISTORY_PATH=docs/data/iv_history.json
+IV_SOURCE=mid                 # mid: solve IV from near-ATM mid prices | yahoo: impliedVolatility column
+IV_ATM_BAND=0.10              # strikes within ±10% of spot feed the ATM interpolation
+IV_TERM=0                     # 1: interpolate the two expiries bracketing 30 DTE in variance-time
+OPTION_CACHE_DIR=.cache/chains      # per-run-date option chain cache ("" disables)
+SNAPSHOT_FORMAT=rows          # rows: per-symbol dicts | columnar: shared time axis + float32 blobs
+                              # sharded: slim index + docs/data/hist/<SYM>.json loaded lazily
+SNAPSHOT_DELTA=0              # 1: write snapshot.delta.json against the last base (--delta)
+DELTA_COMPACT_HOURS=24        # rewrite the base once it is this old ...
+DELTA_COMPACT_RATIO=0.5       # ... or once the delta exceeds this fraction of it
+IV_HISTORY_PATH=docs/data/iv_history.json   # derived JSON export for the dashboard
+IV_STORE_PATH=docs/data/iv_history.npz      # dated per-symbol IV ring buffer (migrates the JSON once)
+IV_HISTORY_CAP=360            # observations kept per symbol
+WORKERS=1                     # symbols processed concurrently (--workers)
+YF_MAX_CONCURRENCY=4          # in-flight Yahoo requests across all workers
+NEWSAPI_MAX_CONCURRENCY=2     # in-flight NewsAPI requests across all workers
+HTTP_RATE_YAHOO=8             # token-bucket requests/second per host (also _NEWSAPI, _GITHUB, _WIKIPEDIA)
+HTTP_MAX_RETRIES=3            # retries on 429/5xx/connection errors (exponential backoff + jitter)
+YF_BATCH_SIZE=50              # tickers per multi-ticker yf.download (0/1 = per symbol)
+BAR_STORE_PATH=.cache/bars.sqlite   # local OHLCV store for incremental refresh ("" disables)
+FUND_CACHE_PATH=.cache/fundamentals.json   # fundamentals TTL cache ("" disables)
+FUND_TTL_DAYS=eps_ttm=7,div_yield=7  # per-field TTL overrides (shares, eps_ttm, bvps, ...)
+SNAPSHOT_STREAM=0             # 1: spool hist lists to an NDJSON temp file while building (--stream)
+SPOOL_DIR=.cache              # where that spool file lives
+NEWS_MAX_REQUESTS=40          # NewsAPI calls per run (tickers OR-ed NEWS_BATCH=20 per query, movers first)
+NEWS_TTL_HOURS=6              # reuse cached news counts this long (NEWS_CACHE_PATH=.cache/news.json)
+JOURNAL_DIR=.cache/journal    # per-run checkpoint of finished rows for --resume ("" disables)
+ANALYTICS_BENCHMARK=SPY       # rolling-beta benchmark, fetched with the universe (EW = equal-weight universe)
+ANALYTICS_BETA_WINDOW=60      # bars per beta; ANALYTICS_LOOKBACK=252 return bars behind correlations/clusters
+ANALYTICS_PATH=docs/data/analytics.json     # beta series, float32 upper-triangle correlations, cluster/sector stats
+ANALYTICS_CORR_MAX=1000       # symbols in the correlation matrix (universe order); ANALYTICS_CLUSTERS=11
 
 # GitHub upload
 GH_TOKEN=...
@@ -28,16 +65,44 @@ GH_BRANCH=main
 GH_PATH=docs/data/snapshot.json
 GH_COMMITTER_NAME=sp500-bot
 GH_COMMITTER_EMAIL=actions@users.noreply.github.com
+GH_PATH_IV=docs/data/iv_history.json
+GH_PATH_IV_STORE=docs/data/iv_history.npz
+GH_API_URL=https://api.github.com   # e.g. a local stand-in server for testing
 """
 
-import os, io, sys, json, time, base64, math, argparse, logging
+from __future__ import annotations
+
+import os, io, re, sys, json, time, base64, math, hashlib, random, argparse, logging, threading, sqlite3, tempfile, warnings, weakref, importlib
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-import numpy as np
-import pandas as pd
-import requests
-import yfinance as yf
-from ta.momentum import RSIIndicator
-from ta.trend import MACD
+
+# ───────────────────── Lazy heavy imports ─────────────────────
+class _LazyModule:
+    """
+    Stand-in for a heavy dependency. The real import happens on first attribute access
+    and replaces this object in the module globals, so later lookups go straight to the
+    module; `--help`, `write` and `upload` never pay for pandas/yfinance at all.
+    Attribute writes (e.g. a bench patching yf.download) land on the real module.
+    """
+    def __init__(self, alias: str, name: str):
+        self.__dict__.update(_alias=alias, _name=name)
+    def _load(self):
+        mod = importlib.import_module(self._name)
+        globals()[self._alias] = mod
+        return mod
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+np = _LazyModule("np", "numpy")
+pd = _LazyModule("pd", "pandas")
+requests = _LazyModule("requests", "requests")
+yf = _LazyModule("yf", "yfinance")
 
 # ───────────────────────── Logger ─────────────────────────
 def setup_logger(verbosity:int):
@@ -86,8 +151,256 @@ def periods_per_year(interval: str, symbol: str) -> float:
     if interval in {"5m"}:            return (365*288) if is_crypto else (252*78)
     if interval in {"2m"}:            return (365*720) if is_crypto else (252*195)
     if interval in {"1m"}:            return (365*1440) if is_crypto else (252*390)
+    mins = interval_minutes(interval)   # resampled bars (4h, 10m, …): session minutes per bar
+    if mins:                          return (365*1440/mins) if is_crypto else (252*390/mins)
     return 252.0
 
+def interval_minutes(interval: str):
+    """Bar length in minutes for "<n>m" / "<n>h" intervals, else None."""
+    m = re.fullmatch(r"(\d+)(m|h)", (interval or "").lower().strip())
+    return int(m.group(1)) * (60 if m.group(2) == "h" else 1) if m and int(m.group(1)) > 0 else None
+
+# ───────────────────── Concurrency ─────────────────────
+WORKERS = int(os.getenv("WORKERS", "1"))
+HOST_LIMITS = {
+    "yahoo":     int(os.getenv("YF_MAX_CONCURRENCY", "4")),
+    "newsapi":   int(os.getenv("NEWSAPI_MAX_CONCURRENCY", "2")),
+    "github":    int(os.getenv("GITHUB_MAX_CONCURRENCY", "4")),
+    "wikipedia": 2,
+}
+_HOST_SEMS = {h: threading.BoundedSemaphore(max(1, n)) for h, n in HOST_LIMITS.items()}
+# yf.download keeps its results in module-level dicts (yfinance.shared), so two
+# concurrent calls clobber each other. Serialize it regardless of WORKERS.
+_YF_DOWNLOAD_LOCK = threading.Lock()
+
+@contextmanager
+def host_slot(host: str):
+    """Hold one of the per-host concurrency slots. Never nest two slots."""
+    sem = _HOST_SEMS.get(host)
+    if sem is None:
+        yield; return
+    with sem:
+        yield
+
+# ───────────────────── Shared HTTP client ─────────────────────
+# requests/second per host key; the bucket allows short bursts of the same size
+HOST_RATES = {h: float(os.getenv(f"HTTP_RATE_{h.upper()}", d))
+              for h, d in (("yahoo","8"), ("newsapi","2"), ("github","5"), ("wikipedia","2"))}
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+def host_key(url: str) -> str:
+    """Rate-limit bucket for a URL: yahoo / newsapi / github / wikipedia, else the hostname."""
+    host = (urlsplit(url).hostname or "").lower()
+    if url.startswith(GH_API_URL):
+        return "github"
+    for key, suffix in (("yahoo","finance.yahoo.com"), ("newsapi","newsapi.org"),
+                        ("github","api.github.com"), ("wikipedia","wikipedia.org")):
+        if host == suffix or host.endswith("." + suffix):
+            return key
+    return host
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens/second, at most `burst` banked."""
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = max(rate, 1e-6)
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+                self.t = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class HttpClient:
+    """
+    One pooled requests.Session for every plain-HTTP fetcher (Yahoo query2,
+    Wikipedia, NewsAPI, GitHub). Each request holds the host's concurrency slot
+    (host_slot) and a token from its bucket; 429/5xx and connection errors are
+    retried with exponential backoff + full jitter (Retry-After wins when given).
+    metrics() reports request/retry/error counts and latency percentiles per host.
+    """
+    def __init__(self, pool_size: int = 10, max_retries: int = HTTP_MAX_RETRIES, backoff: float = 0.5):
+        self.max_retries, self.backoff = max_retries, backoff
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent":"Mozilla/5.0","Accept":"*/*","Accept-Language":"en-US,en;q=0.9"})
+        self.resize(pool_size)
+        self._buckets = {h: TokenBucket(r) for h, r in HOST_RATES.items()}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def resize(self, pool_size: int):
+        """Keep-alive pool per host sized for pool_size concurrent requests."""
+        adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=max(4, int(pool_size)))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _record(self, key, dt=None, retry=False, error=False, status=None):
+        with self._lock:
+            st = self._stats.setdefault(key, {"requests": 0, "retries": 0, "errors": 0, "status": {}, "lat": []})
+            if dt is not None:
+                st["requests"] += 1; st["lat"].append(dt)
+            if status is not None:
+                st["status"][str(status)] = st["status"].get(str(status), 0) + 1
+            if retry: st["retries"] += 1
+            if error: st["errors"] += 1
+
+    def _sleep_before_retry(self, attempt: int, resp=None):
+        delay = random.uniform(0, self.backoff * (2 ** attempt))
+        ra = resp.headers.get("Retry-After") if resp is not None else None
+        if ra and ra.isdigit():
+            delay = max(delay, min(float(ra), 60.0))
+        time.sleep(delay)
+
+    def acquire(self, host: str):
+        """Take one token from the host's bucket (no-op for hosts without a rate)."""
+        bucket = self._buckets.get(host)
+        if bucket is not None:
+            bucket.acquire()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        key = host_key(url)
+        kwargs.setdefault("timeout", 30)
+        for attempt in range(self.max_retries + 1):
+            self.acquire(key)
+            t = time.time()
+            try:
+                with host_slot(key):
+                    r = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(key, time.time()-t, error=True)
+                if attempt >= self.max_retries:
+                    raise
+                logging.debug("HTTP %s %s failed (%s); retry %d", method, key, e, attempt+1)
+                self._record(key, retry=True)
+                self._sleep_before_retry(attempt)
+                continue
+            self._record(key, time.time()-t, status=r.status_code)
+            if r.status_code in RETRY_STATUS and attempt < self.max_retries:
+                logging.debug("HTTP %s %s → %s; retry %d", method, key, r.status_code, attempt+1)
+                self._record(key, retry=True)
+                self._sleep_before_retry(attempt, r)
+                continue
+            return r
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def metrics(self) -> dict:
+        out = {}
+        with self._lock:
+            for key, st in self._stats.items():
+                lat = np.array(st["lat"]) if st["lat"] else np.array([np.nan])
+                out[key] = {
+                    "requests": st["requests"], "retries": st["retries"], "errors": st["errors"],
+                    "status": dict(st["status"]),
+                    "p50_ms": round(float(np.nanpercentile(lat, 50))*1000, 1) if st["lat"] else None,
+                    "p95_ms": round(float(np.nanpercentile(lat, 95))*1000, 1) if st["lat"] else None,
+                    "max_ms": round(float(np.nanmax(lat))*1000, 1) if st["lat"] else None,
+                }
+        return out
+
+    def log_metrics(self):
+        for key, m in sorted(self.metrics().items()):
+            logging.info("HTTP %-10s %4d req, %d retries, %d errors | p50 %s ms p95 %s ms max %s ms | %s",
+                         key, m["requests"], m["retries"], m["errors"], m["p50_ms"], m["p95_ms"], m["max_ms"],
+                         ",".join(f"{k}:{v}" for k, v in sorted(m["status"].items())))
+
+_HTTP = None
+_HTTP_LOCK = threading.Lock()
+
+def get_http(pool_size: int = None) -> HttpClient:
+    """Process-wide HttpClient; pool_size re-mounts the adapters for that many workers."""
+    global _HTTP
+    with _HTTP_LOCK:
+        if _HTTP is None:
+            _HTTP = HttpClient(pool_size or max(WORKERS, 10))
+        elif pool_size:
+            _HTTP.resize(pool_size)
+        return _HTTP
+
+@contextmanager
+def rate_slot(host: str):
+    """host_slot plus a token from the host's bucket, for calls that bypass HttpClient (yfinance)."""
+    get_http().acquire(host)
+    with host_slot(host):
+        yield
+
+# ───────────────────── Run metrics ─────────────────────
+class RunMetrics:
+    """
+    Thread-safe timing spans (stage → durations, plus per-symbol totals) and
+    counters for one build; summary() is the run summary written next to the snapshot.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.spans, self.by_symbol, self.counters = {}, {}, {}
+
+    @contextmanager
+    def span(self, stage: str, symbol: str = None):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t, symbol)
+
+    def add(self, stage: str, dt: float, symbol: str = None):
+        with self._lock:
+            self.spans.setdefault(stage, []).append(dt)
+            if symbol is not None:
+                st = self.by_symbol.setdefault(symbol, {})
+                st[stage] = st.get(stage, 0.0) + dt
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self, top: int = 10) -> dict:
+        with self._lock:
+            spans = {k: np.array(v) for k, v in self.spans.items()}
+            by_symbol, counters = dict(self.by_symbol), dict(self.counters)
+        stages = {k: {"n": len(a), "total_s": round(float(a.sum()), 3),
+                      "p50_ms": round(float(np.percentile(a, 50))*1000, 1),
+                      "p95_ms": round(float(np.percentile(a, 95))*1000, 1),
+                      "max_ms": round(float(a.max())*1000, 1)} for k, a in sorted(spans.items())}
+        slow = sorted(by_symbol.items(), key=lambda kv: -sum(kv[1].values()))[:top]
+        return {"elapsed_s": round(time.time() - self.started, 3), "stages": stages,
+                "counters": dict(sorted(counters.items())),
+                "slowest_symbols": [{"symbol": s, "total_s": round(sum(st.values()), 3),
+                                     **{k: round(v, 3) for k, v in sorted(st.items())}} for s, st in slow]}
+
+    def log(self):
+        summ = self.summary(top=5)
+        for k, m in summ["stages"].items():
+            logging.info("Stage %-18s n=%-5d total %7.2fs | p50 %7.1f ms p95 %7.1f ms max %7.1f ms",
+                         k, m["n"], m["total_s"], m["p50_ms"], m["p95_ms"], m["max_ms"])
+        if summ["counters"]:
+            logging.info("Counters: %s", ", ".join(f"{k}={v}" for k, v in summ["counters"].items()))
+        if summ["slowest_symbols"]:
+            logging.info("Slowest: %s", ", ".join(f"{x['symbol']} {x['total_s']:.2f}s" for x in summ["slowest_symbols"]))
+
+_METRICS = RunMetrics()
+
+def get_metrics() -> RunMetrics:
+    return _METRICS
+
+def span(stage: str, symbol: str = None):
+    return _METRICS.span(stage, symbol)
+
 # ───────────────────── Offline seeds (short) ─────────────────────
 SP500_SEED = [
     "AAPL","MSFT","NVDA","AMZN","META","GOOGL","GOOG","AVGO","BRK-B","LLY","JPM","TSLA","V","WMT","XOM","PG","UNH","MA",
@@ -129,10 +442,13 @@ def dedup_symbols(symbols):
             seen.add(s); out.append(s)
     return out
 
-def _from_wiki(url: str, symbol_like=("symbol","ticker")):
-    r = requests.get(url, headers=HDR, timeout=30)
-    r.raise_for_status()
-    tables = pd.read_html(io.StringIO(r.text), flavor="lxml")
+def _parse_wiki_symbols(html: str, symbol_like=("symbol","ticker")) -> list:
+    """First table with a symbol/ticker column of ≥25 entries → deduped symbols ([] if none)."""
+    pattern = "|".join(f"[{k[0].upper()}{k[0]}]{k[1:]}" for k in symbol_like)   # lxml's XPath regex drops re flags
+    try:
+        tables = pd.read_html(io.StringIO(html), flavor="lxml", match=pattern)
+    except ValueError:                                   # no table mentions a symbol column
+        return []
     for df in tables:
         cols = {str(c).lower(): c for c in df.columns}
         for key in symbol_like:
@@ -144,38 +460,139 @@ def _from_wiki(url: str, symbol_like=("symbol","ticker")):
                     return dedup_symbols(syms)
     return []
 
-def get_sp500_web(): return _from_wiki("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies", ("symbol","ticker"))
-def get_nas100_web(): return _from_wiki("https://en.wikipedia.org/wiki/NASDAQ-100", ("ticker","symbol"))
-def get_dow30_web(): return _from_wiki("https://en.wikipedia.org/wiki/Dow_Jones_Industrial_Average", ("symbol","ticker"))
+WIKI_SOURCES = {
+    "SP500": ("https://en.wikipedia.org/wiki/List_of_S%26P_500_companies", ("symbol","ticker"), SP500_SEED),
+    "NAS100": ("https://en.wikipedia.org/wiki/NASDAQ-100", ("ticker","symbol"), NAS100_SEED),
+    "DOW30": ("https://en.wikipedia.org/wiki/Dow_Jones_Industrial_Average", ("symbol","ticker"), DOW30_SEED),
+}
 
-def get_universe(update_from_web: bool, sources: list[str]):
-    universe = []
-    sources = [s.strip().upper() for s in sources if s.strip()]
-    logging.info("Universe sources: %s", ",".join(sources))
+# ───────────────────── Universe cache (conditional GETs) ─────────────────────
+UNIVERSE_CACHE_PATH = os.getenv("UNIVERSE_CACHE_PATH", ".cache/universe.json")
+UNIVERSE_MAX_AGE_HOURS = float(os.getenv("UNIVERSE_MAX_AGE_HOURS", "12"))
+UNIVERSE_HISTORY_CAP = 1000          # membership events kept per index
 
-    if update_from_web:
+class UniverseCache:
+    """
+    Last good symbol list per index, with the page's ETag / Last-Modified and a body
+    hash. refresh() skips the network while the list is younger than max_age_h, then
+    revalidates with a conditional GET and only parses the HTML when the page really
+    changed (304 and identical bodies reuse the cached list). Every membership change
+    is appended to history[index] as {"date", "added", "removed", "size"}; the first
+    observation lists the whole index under "added", so membership on any date can be
+    replayed. Network or parse failures fall back to the last good list.
+    """
+    def __init__(self, path: str = UNIVERSE_CACHE_PATH, max_age_h: float = UNIVERSE_MAX_AGE_HOURS):
+        self.path, self.max_age = path, max_age_h * 3600.0
+        self.data = {"sources": {}, "history": {}}
+        self.stats = {"fresh": 0, "not_modified": 0, "unchanged": 0, "parsed": 0, "errors": 0}
         try:
-            if "SP500" in sources:
-                syms = get_sp500_web(); universe += syms if syms else SP500_SEED
-                logging.info("SP500: %d symbols.", len(syms) if syms else len(SP500_SEED))
+            if path and os.path.exists(path):
+                with open(path, "r") as f:
+                    self.data.update(json.load(f))
         except Exception as e:
-            logging.warning("SP500 web failed: %s", e); universe += SP500_SEED
+            logging.debug("Universe cache load failed: %s", e)
+
+    def symbols(self, name: str):
+        entry = self.data["sources"].get(name)
+        return list(entry["symbols"]) if entry and entry.get("symbols") else None
+
+    def history(self, name: str) -> list:
+        return list(self.data["history"].get(name, []))
+
+    def _record(self, name: str, old, new: list, day: str):
+        added = sorted(set(new) - set(old or ()))
+        removed = sorted(set(old or ()) - set(new))
+        if not added and not removed:
+            return
+        hist = self.data["history"].setdefault(name, [])
+        hist.append({"date": day, "added": added, "removed": removed, "size": len(new)})
+        del hist[:-UNIVERSE_HISTORY_CAP]
+        if old:
+            logging.info("%s membership changed: +%s -%s", name, ",".join(added) or "-", ",".join(removed) or "-")
+
+    def refresh(self, name: str, url: str, symbol_like=("symbol","ticker"), force: bool = False):
+        """Current symbols for index `name` (None when there is neither a page nor a cached list)."""
+        entry = self.data["sources"].setdefault(name, {})
+        cached = entry.get("symbols") if entry.get("url") == url else None
+        now = time.time()
+        if cached and not force and now - float(entry.get("checked", 0)) < self.max_age:
+            self.stats["fresh"] += 1
+            return list(cached)
+        headers = dict(HDR)
+        if cached:
+            if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"): headers["If-Modified-Since"] = entry["last_modified"]
         try:
-            if "NAS100" in sources:
-                syms = get_nas100_web(); universe += syms if syms else NAS100_SEED
-                logging.info("NAS100: %d symbols.", len(syms) if syms else len(NAS100_SEED))
+            r = get_http().get(url, headers=headers, timeout=30)
+            if r.status_code == 304 and cached:
+                self.stats["not_modified"] += 1
+                entry["checked"] = now
+                return list(cached)
+            r.raise_for_status()
+            digest = hashlib.sha1(r.content).hexdigest()
+            entry.update(etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"))
+            if cached and digest == entry.get("sha1"):
+                self.stats["unchanged"] += 1
+                entry["checked"] = now
+                return list(cached)
+            syms = _parse_wiki_symbols(r.text, symbol_like)
         except Exception as e:
-            logging.warning("NAS100 web failed: %s", e); universe += NAS100_SEED
+            self.stats["errors"] += 1
+            logging.warning("%s web failed: %s%s", name, e, " (using cached list)" if cached else "")
+            return list(cached) if cached else None
+        if not syms:
+            self.stats["errors"] += 1
+            logging.warning("%s: no symbol table on %s%s", name, url, " (using cached list)" if cached else "")
+            return list(cached) if cached else None
+        self.stats["parsed"] += 1
+        self._record(name, entry.get("symbols"), syms, datetime.utcnow().strftime("%Y-%m-%d"))
+        entry.update(url=url, symbols=syms, sha1=digest, checked=now)
+        return list(syms)
+
+    def save(self):
+        if not self.path:
+            return None
         try:
-            if "DOW30" in sources:
-                syms = get_dow30_web(); universe += syms if syms else DOW30_SEED
-                logging.info("DOW30: %d symbols.", len(syms) if syms else len(DOW30_SEED))
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.data, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+            return self.path
         except Exception as e:
-            logging.warning("DOW30 web failed: %s", e); universe += DOW30_SEED
-    else:
-        if "SP500" in sources: universe += SP500_SEED
-        if "NAS100" in sources: universe += NAS100_SEED
-        if "DOW30" in sources: universe += DOW30_SEED
+            logging.debug("Universe cache save failed: %s", e)
+            return None
+
+_UNIVERSE_CACHE = None
+
+def get_universe_cache() -> UniverseCache:
+    """Process-wide UniverseCache (in-memory only when UNIVERSE_CACHE_PATH is empty)."""
+    global _UNIVERSE_CACHE
+    if _UNIVERSE_CACHE is None:
+        _UNIVERSE_CACHE = UniverseCache(UNIVERSE_CACHE_PATH)
+    return _UNIVERSE_CACHE
+
+def get_universe(update_from_web: bool, sources: list[str], force_refresh: bool = False, offline: bool = False):
+    """Deduped symbols for sources; offline uses the universe cache's last lists without revalidating."""
+    universe = []
+    sources = [s.strip().upper() for s in sources if s.strip()]
+    logging.info("Universe sources: %s", ",".join(sources))
+
+    cache = get_universe_cache() if update_from_web else None
+    for name, (url, symbol_like, seed) in WIKI_SOURCES.items():
+        if name not in sources:
+            continue
+        if cache is None:
+            syms = None
+        else:
+            syms = cache.symbols(name) if offline else cache.refresh(name, url, symbol_like, force=force_refresh)
+        universe += syms or seed
+        if cache is not None:
+            logging.info("%s: %d symbols%s.", name, len(syms or seed), "" if syms else " (seed)")
+    if cache is not None and not offline:
+        cache.save()
+        logging.info("Universe cache: %s", " ".join(f"{k}={v}" for k, v in cache.stats.items()))
     if "EXTRA" in sources: universe += EXTRA_SYMBOLS
 
     universe = dedup_symbols(universe)
@@ -202,12 +619,14 @@ def _chart_to_df(j):
     }, index=idx)
     return df.dropna(how="all")
 
-def _fetch_chart(symbol, period: str, interval: str, endpoint="query2"):
-    sess = requests.Session()
-    sess.headers.update({"User-Agent":"Mozilla/5.0","Accept":"*/*","Accept-Language":"en-US,en;q=0.9"})
+def _fetch_chart(symbol, period: str, interval: str, endpoint="query2", start=None):
     url = f"https://{endpoint}.finance.yahoo.com/v8/finance/chart/{symbol}"
     params={"range": period, "interval": interval, "includeAdjustedClose":"true", "events":"div,splits,capitalGains"}
-    r = sess.get(url, params=params, timeout=20)
+    if start is not None:
+        params.pop("range")
+        params["period1"] = int(pd.Timestamp(start).timestamp())
+        params["period2"] = int(time.time())
+    r = get_http().get(url, params=params, timeout=20)
     if r.status_code==200:
         return _chart_to_df(r.json())
     logging.debug("query2 %s %s → %s", symbol, interval, r.status_code)
@@ -224,34 +643,279 @@ def _flatten_ohlc(df: pd.DataFrame) -> pd.DataFrame:
     keep = [c for c in ("Open","High","Low","Close","Volume") if c in df.columns]
     return df[keep].dropna(how="all")
 
-def try_download(symbol, period: str, interval: str):
-    df = yf.download(
-        symbol,
-        period=period,
-        interval=interval,
-        auto_adjust=True,
-        group_by="column",
-        multi_level_index=False,
-        threads=False,
-        progress=False,
-    )
-    if isinstance(df, pd.DataFrame) and not df.empty:
-        df = _flatten_ohlc(df)
-        if len(df) >= 2:
-            return df
-
-    df = _fetch_chart(symbol, period, interval, endpoint="query2")
+def _download_fallback(symbol, period: str, interval: str, start=None):
+    """Per-symbol query2 chart, then the dash→dot alias (BRK-B → BRK.B)."""
+    with span("ohlcv.query2", symbol):
+        df = _fetch_chart(symbol, period, interval, endpoint="query2", start=start)
     if not df.empty:
+        _METRICS.count("ohlcv.query2")
         return df
 
     if "-" in symbol:
         alt = symbol.replace("-", ".")
-        df = _fetch_chart(alt, period, interval, endpoint="query2")
+        with span("ohlcv.dot_alias", symbol):
+            df = _fetch_chart(alt, period, interval, endpoint="query2", start=start)
         if not df.empty:
+            _METRICS.count("ohlcv.dot_alias")
             return df
 
+    _METRICS.count("ohlcv.miss")
     return pd.DataFrame()
 
+def try_download(symbol, period: str, interval: str):
+    with span("ohlcv.yf", symbol), rate_slot("yahoo"), _YF_DOWNLOAD_LOCK:
+        df = yf.download(
+            symbol,
+            period=period,
+            interval=interval,
+            auto_adjust=True,
+            group_by="column",
+            multi_level_index=False,
+            threads=False,
+            progress=False,
+        )
+    if isinstance(df, pd.DataFrame) and not df.empty:
+        df = _flatten_ohlc(df)
+        if len(df) >= 2:
+            _METRICS.count("ohlcv.yf")
+            return df
+
+    return _download_fallback(symbol, period, interval)
+
+YF_BATCH_SIZE = int(os.getenv("YF_BATCH_SIZE", "50"))
+
+def _split_batch_frame(data, tickers) -> dict:
+    """Split a group_by="ticker" multi-download frame into {symbol: OHLCV frame}."""
+    out = {}
+    if not isinstance(data, pd.DataFrame) or data.empty:
+        return out
+    if not isinstance(data.columns, pd.MultiIndex):
+        # yfinance collapses the ticker level when only one symbol came back
+        if len(tickers) == 1:
+            df = _flatten_ohlc(data.copy())
+            if len(df) >= 2: out[tickers[0]] = df
+        return out
+    present = set(data.columns.get_level_values(0))
+    for t in tickers:
+        if t not in present: continue
+        df = _flatten_ohlc(data[t].copy())
+        if len(df) >= 2:
+            out[t] = df
+    return out
+
+def download_batch(symbols, period: str, interval: str, batch_size: int = YF_BATCH_SIZE, start=None) -> dict:
+    """
+    Multi-ticker yf.download in chunks of batch_size. Returns {symbol: df} for the
+    symbols that came back with data; callers retry the rest via _download_fallback.
+    start: fetch bars from this timestamp on instead of the whole period.
+    """
+    frames = {}
+    batch_size = max(1, int(batch_size))
+    for k in range(0, len(symbols), batch_size):
+        chunk = symbols[k:k+batch_size]
+        t_b = time.time()
+        try:
+            with span("ohlcv.batch"), rate_slot("yahoo"), _YF_DOWNLOAD_LOCK:
+                data = yf.download(
+                    chunk,
+                    period=None if start is not None else period,
+                    start=start,
+                    interval=interval,
+                    auto_adjust=True,
+                    group_by="ticker",
+                    threads=max(1, min(len(chunk), HOST_LIMITS["yahoo"])),
+                    progress=False,
+                )
+            got = _split_batch_frame(data, chunk)
+        except Exception as e:
+            logging.debug("Batch download failed (%s…): %s", chunk[0], e)
+            got = {}
+        frames.update(got)
+        _METRICS.count("ohlcv.batch", len(got)); _METRICS.count("ohlcv.batch_miss", len(chunk) - len(got))
+        logging.info("Batch %d-%d/%d: %d/%d symbols (%.2fs)",
+                     k+1, k+len(chunk), len(symbols), len(got), len(chunk), time.time()-t_b)
+    return frames
+
+# ───────────────────── Local bar store ─────────────────────
+BAR_STORE_PATH = os.getenv("BAR_STORE_PATH", ".cache/bars.sqlite")
+BAR_OVERLAP = 3            # stored bars re-fetched to detect split/dividend re-adjustment
+BAR_ADJ_RTOL = 1e-5        # relative close mismatch on the overlap that forces a full reload
+DAILY_INTERVALS = {"1d","5d","1wk","1mo","3mo"}
+
+def _period_start(period: str, now=None):
+    """Earliest timestamp covered by a Yahoo range string ("120d", "6mo", "2y", "ytd"); None for max."""
+    now = pd.Timestamp(now or datetime.utcnow())
+    p = (period or "").lower().strip()
+    if p == "ytd":
+        return pd.Timestamp(year=now.year, month=1, day=1)
+    m = re.fullmatch(r"(\d+)(m|h|d|wk|mo|y)", p)
+    if not m:
+        return None
+    n, unit = int(m.group(1)), m.group(2)
+    delta = {"m": pd.Timedelta(minutes=n), "h": pd.Timedelta(hours=n), "d": pd.Timedelta(days=n),
+             "wk": pd.Timedelta(weeks=n), "mo": pd.DateOffset(months=n), "y": pd.DateOffset(years=n)}[unit]
+    return now - delta
+
+class BarStore:
+    """
+    SQLite OHLCV cache keyed by (symbol, interval, ts). Timestamps are stored as
+    UTC epoch seconds (daily+ intervals floored to the date). One connection per
+    thread; writes are serialized.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        c = self._conn()
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("""CREATE TABLE IF NOT EXISTS bars (
+            symbol TEXT NOT NULL, interval TEXT NOT NULL, ts INTEGER NOT NULL,
+            open REAL, high REAL, low REAL, close REAL, volume REAL,
+            PRIMARY KEY (symbol, interval, ts)) WITHOUT ROWID""")
+        c.commit()
+
+    def _conn(self):
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._local.conn = c
+        return c
+
+    @staticmethod
+    def _epoch(index, interval: str):
+        idx = pd.DatetimeIndex(index)
+        if idx.tz is not None:
+            idx = idx.tz_convert("UTC").tz_localize(None)
+        if interval in DAILY_INTERVALS:
+            idx = idx.floor("D")
+        return idx.as_unit("s").asi8.astype("int64")
+
+    def load(self, symbol: str, interval: str, since=None) -> pd.DataFrame:
+        q = "SELECT ts, open, high, low, close, volume FROM bars WHERE symbol=? AND interval=?"
+        args = [symbol, interval]
+        if since is not None:
+            q += " AND ts>=?"; args.append(int(pd.Timestamp(since).timestamp()))
+        rows = self._conn().execute(q + " ORDER BY ts", args).fetchall()
+        if not rows:
+            return pd.DataFrame()
+        a = np.array(rows, dtype="float64")
+        idx = pd.to_datetime(a[:,0].astype("int64"), unit="s")
+        return pd.DataFrame(a[:,1:], index=idx, columns=["Open","High","Low","Close","Volume"])
+
+    def tail(self, symbol: str, interval: str, n: int) -> pd.DataFrame:
+        rows = self._conn().execute(
+            "SELECT ts, close FROM bars WHERE symbol=? AND interval=? ORDER BY ts DESC LIMIT ?",
+            (symbol, interval, n)).fetchall()
+        if not rows:
+            return pd.DataFrame()
+        a = np.array(rows[::-1], dtype="float64")
+        return pd.DataFrame({"Close": a[:,1]}, index=pd.to_datetime(a[:,0].astype("int64"), unit="s"))
+
+    def write(self, symbol: str, interval: str, df: pd.DataFrame, replace: bool = False):
+        if df is None or df.empty:
+            return
+        ts = self._epoch(df.index, interval)
+        cols = [pd.to_numeric(df[c], errors="coerce").to_numpy("float64") if c in df.columns
+                else np.full(len(df), np.nan) for c in ("Open","High","Low","Close","Volume")]
+        recs = [(symbol, interval, int(t), *(None if not np.isfinite(v) else float(v) for v in vals))
+                for t, *vals in zip(ts, *cols)]
+        with self._write_lock:
+            c = self._conn()
+            if replace:
+                c.execute("DELETE FROM bars WHERE symbol=? AND interval=?", (symbol, interval))
+            c.executemany("INSERT OR REPLACE INTO bars VALUES (?,?,?,?,?,?,?,?)", recs)
+            c.commit()
+
+_BAR_STORE = None
+_BAR_STORE_LOCK = threading.Lock()
+
+def get_bar_store():
+    """Process-wide BarStore, or None when BAR_STORE_PATH is empty."""
+    global _BAR_STORE
+    if not BAR_STORE_PATH:
+        return None
+    with _BAR_STORE_LOCK:
+        if _BAR_STORE is None:
+            _BAR_STORE = BarStore(BAR_STORE_PATH)
+        return _BAR_STORE
+
+def _overlap_matches(stored: pd.DataFrame, fresh: pd.DataFrame, interval: str) -> bool:
+    """True when re-fetched overlap bars agree with the store (no new adjustment)."""
+    a = pd.Series(stored["Close"].to_numpy(), index=BarStore._epoch(stored.index, interval))
+    b = pd.Series(pd.to_numeric(fresh["Close"], errors="coerce").to_numpy(),
+                  index=BarStore._epoch(fresh.index, interval))
+    b = b[~b.index.duplicated(keep="last")]
+    common = a.index.intersection(b.index)
+    if len(common) == 0:
+        return False
+    x, y = a.loc[common].to_numpy(), b.loc[common].to_numpy()
+    ok = np.isfinite(x) & np.isfinite(y)
+    return bool(ok.any() and np.allclose(x[ok], y[ok], rtol=BAR_ADJ_RTOL, atol=0.0))
+
+def sync_bars(store: "BarStore", symbols, period: str, interval: str, batch_size: int = YF_BATCH_SIZE) -> dict:
+    """
+    Bring the store up to date for symbols and return {symbol: df} trimmed to period.
+
+    Symbols with no usable history get a full-period download. The rest only fetch
+    from their last BAR_OVERLAP stored bars onward (grouped by start so they still
+    batch); if the overlap closes moved (split/dividend re-adjustment) the symbol is
+    re-downloaded in full and its stored history replaced. Symbols Yahoo returns
+    nothing for are left out; callers use _download_fallback for those.
+    """
+    since = _period_start(period)
+    full, starts = [], {}
+    for sym in symbols:
+        tail = store.tail(sym, interval, BAR_OVERLAP)
+        if tail.empty or (since is not None and tail.index[-1] < since):
+            full.append(sym)
+        else:
+            starts.setdefault(tail.index[0], []).append(sym)
+
+    n_new = len(full)
+    for start, group in sorted(starts.items()):
+        # tz-aware so yfinance does not read the naive UTC stamp as exchange-local time
+        got = download_batch(group, period, interval, batch_size=batch_size, start=start.tz_localize("UTC"))
+        for sym in group:
+            df = got.get(sym)
+            if df is None or df.empty:
+                continue
+            if _overlap_matches(store.tail(sym, interval, BAR_OVERLAP), df, interval):
+                store.write(sym, interval, df)
+            else:
+                logging.info("Bar store: %s re-adjusted since last run; reloading full history.", sym)
+                full.append(sym)
+
+    if full:
+        got = download_batch(full, period, interval, batch_size=batch_size)
+        for sym, df in got.items():
+            store.write(sym, interval, df, replace=True)
+    logging.info("Bar store: %d symbols | %d incremental, %d new, %d re-adjusted.",
+                 len(symbols), len(symbols) - len(full), n_new, len(full) - n_new)
+    _METRICS.count("bars.incremental", len(symbols) - len(full))
+    _METRICS.count("bars.new", n_new); _METRICS.count("bars.readjusted", len(full) - n_new)
+
+    return stored_bars(store, symbols, period, interval)
+
+def stored_bars(store: "BarStore", symbols, period: str, interval: str) -> dict:
+    """{symbol: df} for symbols with at least two stored bars within period; no network."""
+    since = _period_start(period)
+    out = {}
+    for sym in symbols:
+        df = store.load(sym, interval, since=since)
+        if len(df) >= 2:
+            out[sym] = df
+    return out
+
+def _fallback_bars(symbol, period: str, interval: str):
+    """Per-symbol fallback download; also seeds the bar store when it is enabled."""
+    df = _download_fallback(symbol, period, interval)
+    store = get_bar_store()
+    if store is not None and not df.empty:
+        store.write(symbol, interval, df, replace=True)
+    return df
+
 # ───────────────────── Metrics ─────────────────────
 def _series(df: pd.DataFrame, col: str) -> pd.Series:
     s = df[col] if col in df.columns else pd.Series(index=df.index, dtype=float)
@@ -260,49 +924,181 @@ def _series(df: pd.DataFrame, col: str) -> pd.Series:
     s = pd.to_numeric(s, errors="coerce")
     return s
 
-def sharpe_ratio(close: pd.Series, interval: str, symbol: str, risk_free_annual: float) -> float | None:
-    try:
-        rets = close.pct_change().dropna()
-        if len(rets) < 30:
-            return None
-        ppy = periods_per_year(interval, symbol)
-        rf_per = risk_free_annual / ppy
-        excess = rets - rf_per
-        mu = excess.mean()
-        sig = excess.std(ddof=1)
-        if not (np.isfinite(mu) and np.isfinite(sig)) or sig <= 0:
-            return None
-        return round(float((mu / sig) * math.sqrt(ppy)), 3)
-    except Exception:
-        return None
-
-def fetch_fundamentals(symbol: str):
-    out = {"mcap": None, "pe_ttm": None, "pb": None, "div_yield": None, "beta": None}
-    try:
-        tk = yf.Ticker(symbol)
+# ───────────────────── Fundamentals (TTL cache) ─────────────────────
+FUND_CACHE_PATH = os.getenv("FUND_CACHE_PATH", ".cache/fundamentals.json")
+DAY_S = 86400
+# Seconds each raw field stays fresh. mcap/pe_ttm/pb are re-derived from the current
+# close whenever shares/eps_ttm/bvps are known, so their own TTL only matters as a fallback.
+FUND_TTL = {
+    "shares": 30*DAY_S, "eps_ttm": 7*DAY_S, "bvps": 30*DAY_S,
+    "div_yield": 7*DAY_S,
+    "mcap": 1*DAY_S, "pe_ttm": 1*DAY_S, "pb": 1*DAY_S,
+}
+for _kv in os.getenv("FUND_TTL_DAYS", "").split(","):   # e.g. FUND_TTL_DAYS=div_yield=14,eps_ttm=3
+    if "=" in _kv:
+        _k, _v = _kv.split("=", 1)
+        if _k.strip() in FUND_TTL: FUND_TTL[_k.strip()] = float(_v) * DAY_S
+DERIVED_FROM = {"mcap": "shares", "pe_ttm": "eps_ttm", "pb": "bvps"}
+
+def _fetch_fundamentals_raw(symbol: str) -> dict:
+    """One fast_info + get_info round trip → raw per-share/ratio fields (None when missing)."""
+    raw = {k: None for k in FUND_TTL}
+    tk = yf.Ticker(symbol)
+    with rate_slot("yahoo"):
         finfo = getattr(tk, "fast_info", None)
         try:
             info = tk.get_info() if hasattr(tk, "get_info") else tk.info
         except Exception:
             info = {}
-        def pick(*keys):
-            for k in keys:
-                if isinstance(finfo, dict) and k in finfo and finfo[k] is not None:
-                    return finfo[k]
-                if info and k in info and info[k] is not None:
-                    return info[k]
+    def pick(*keys):
+        for k in keys:
+            if isinstance(finfo, dict) and k in finfo and finfo[k] is not None:
+                return finfo[k]
+            if info and k in info and info[k] is not None:
+                return info[k]
+        return None
+    raw["shares"]    = pick("shares","sharesOutstanding")
+    raw["eps_ttm"]   = pick("trailingEps")
+    raw["bvps"]      = pick("bookValue")
+    raw["mcap"]      = pick("market_cap","marketCap")
+    raw["pe_ttm"]    = pick("trailing_pe","trailingPE")
+    raw["pb"]        = pick("price_to_book","priceToBook")
+    raw["div_yield"] = pick("dividend_yield","dividendYield")  # often numeric percent (e.g., 0.44)
+    for k,v in list(raw.items()):
+        if v is None: continue
+        try: raw[k] = float(v)
+        except: raw[k] = None
+    return raw
+
+def _derive_fundamentals(raw: dict, price=None) -> dict:
+    """Row fields from raw values; mcap/P/E/P/B follow the current close when possible."""
+    out = {k: raw.get(k) for k in ("mcap","pe_ttm","pb","div_yield")}
+    if price is not None and math.isfinite(price) and price > 0:
+        if raw.get("shares"):
+            out["mcap"] = float(raw["shares"]) * price
+        if raw.get("eps_ttm") and raw["eps_ttm"] > 0:
+            out["pe_ttm"] = round(price / raw["eps_ttm"], 6)
+        if raw.get("bvps") and raw["bvps"] > 0:
+            out["pb"] = round(price / raw["bvps"], 6)
+    return out
+
+class FundamentalsCache:
+    """
+    JSON-backed {symbol: {"v": raw fields, "t": {field: fetched_epoch}}} with per-field
+    TTLs (FUND_TTL). A symbol is a hit when none of its fields is stale; otherwise one
+    get_info call refreshes all of them. refresh=True treats every lookup as a miss.
+    """
+    def __init__(self, path: str = FUND_CACHE_PATH, ttl: dict = None, refresh: bool = False):
+        self.path, self.ttl, self.refresh = path, dict(ttl or FUND_TTL), refresh
+        self.data = {}
+        self.stats = {"hits": 0, "misses": 0, "new": 0, "forced": 0, "errors": 0, "stale_fields": {}}
+        self._lock = threading.Lock()
+        try:
+            if path and os.path.exists(path):
+                with open(path, "r") as f:
+                    self.data = json.load(f)
+        except Exception as e:
+            logging.debug("Fundamentals cache load failed: %s", e)
+
+    def _stale(self, entry: dict, now: float) -> list:
+        vals, ts = entry.get("v", {}), entry.get("t", {})
+        stale = []
+        for f, ttl in self.ttl.items():
+            src = DERIVED_FROM.get(f)
+            if src and vals.get(src) is not None:
+                continue
+            if now - float(ts.get(f, 0)) > ttl:
+                stale.append(f)
+        return stale
+
+    def lookup(self, symbol: str):
+        """Fresh raw fields for symbol, or None (and records why) when a fetch is needed."""
+        now = time.time()
+        with self._lock:
+            if self.refresh:
+                self.stats["misses"] += 1; self.stats["forced"] += 1
+                return None
+            entry = self.data.get(symbol)
+            if entry is None:
+                self.stats["misses"] += 1; self.stats["new"] += 1
+                return None
+            stale = self._stale(entry, now)
+            if not stale:
+                self.stats["hits"] += 1
+                return dict(entry["v"])
+            self.stats["misses"] += 1
+            for f in stale:
+                self.stats["stale_fields"][f] = self.stats["stale_fields"].get(f, 0) + 1
             return None
-        out["mcap"]     = pick("market_cap","marketCap")
-        out["pe_ttm"]   = pick("trailing_pe","trailingPE")
-        out["pb"]       = pick("price_to_book","priceToBook")
-        out["div_yield"]= pick("dividend_yield","dividendYield")  # often numeric percent (e.g., 0.44)
-        out["beta"]     = pick("beta")
-        for k,v in list(out.items()):
-            if v is None: continue
-            try: out[k] = float(v)
-            except: out[k] = None
-        return out
+
+    def peek(self, symbol: str):
+        """Cached raw fields whatever their age (offline builds), or None if never fetched."""
+        with self._lock:
+            entry = self.data.get(symbol)
+        return dict(entry.get("v", {})) if entry else None
+
+    def note_error(self):
+        with self._lock:
+            self.stats["errors"] += 1
+
+    def store(self, symbol: str, raw: dict):
+        now = time.time()
+        with self._lock:
+            self.data[symbol] = {"v": dict(raw), "t": {k: now for k in raw}}
+
+    def save(self):
+        if not self.path:
+            return None
+        try:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with self._lock, open(tmp, "w") as f:
+                json.dump(self.data, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+            return self.path
+        except Exception as e:
+            logging.debug("Fundamentals cache save failed: %s", e)
+            return None
+
+    def summary(self) -> str:
+        st = self.stats
+        total = st["hits"] + st["misses"]
+        rate = 100.0 * st["hits"] / total if total else 0.0
+        stale = ",".join(f"{k}={v}" for k, v in sorted(st["stale_fields"].items())) or "-"
+        return (f"{st['hits']} hit / {st['misses']} miss ({rate:.0f}% hit), "
+                f"new={st['new']} forced={st['forced']} errors={st['errors']} stale[{stale}]")
+
+_FUND_CACHE = None
+_FUND_CACHE_LOCK = threading.Lock()
+
+def get_fund_cache():
+    """Process-wide FundamentalsCache, or None when FUND_CACHE_PATH is empty."""
+    global _FUND_CACHE
+    if not FUND_CACHE_PATH:
+        return None
+    with _FUND_CACHE_LOCK:
+        if _FUND_CACHE is None:
+            _FUND_CACHE = FundamentalsCache(FUND_CACHE_PATH)
+        return _FUND_CACHE
+
+def fetch_fundamentals(symbol: str, price=None, cache: "FundamentalsCache" = None):
+    """
+    mcap, P/E, P/B, div% for symbol (beta comes from the analytics stage). With a cache,
+    get_info is only called when a field's TTL has expired; price (the latest close)
+    keeps mcap/P/E/P/B current.
+    """
+    out = {"mcap": None, "pe_ttm": None, "pb": None, "div_yield": None}
+    try:
+        raw = cache.lookup(symbol) if cache is not None else None
+        if raw is None:
+            raw = _fetch_fundamentals_raw(symbol)
+            if cache is not None and any(v is not None for v in raw.values()):
+                cache.store(symbol, raw)
+        return _derive_fundamentals(raw, price)
     except Exception:
+        if cache is not None:
+            cache.note_error()
         return out
 
 # ───────────────────── Options IV utils ─────────────────────
@@ -310,65 +1106,261 @@ IV_ENABLE = (os.getenv("IV_ENABLE","1").lower() in TRUE_SET)
 IV_MAX = int(os.getenv("IV_MAX","40"))
 IV_HISTORY_PATH = os.getenv("IV_HISTORY_PATH","docs/data/iv_history.json")
 NON_OPTION_UNIVERSE = {"BTC-USD","ETH-USD"}
+IV_SOURCE = os.getenv("IV_SOURCE","mid").lower().strip()
+IV_ATM_BAND = float(os.getenv("IV_ATM_BAND","0.10"))
+IV_TERM = (os.getenv("IV_TERM","0").lower() in TRUE_SET)
+IV_TARGET_DAYS = 30
+OPTION_CACHE_DIR = os.getenv("OPTION_CACHE_DIR", ".cache/chains")
+OPTION_CACHE_KEEP_DAYS = 3
+
+IV_STORE_PATH = os.getenv("IV_STORE_PATH","docs/data/iv_history.npz")
+IV_HISTORY_CAP = int(os.getenv("IV_HISTORY_CAP","360"))   # observations kept per symbol (≥ largest IV window)
+IV_RANK_WINDOW = 252                                       # window behind the iv_rank / iv_percentile columns
+
+class IvHistory:
+    """
+    Dated IV30 ring buffer: iv (float32) and day (int32, days since epoch) arrays of
+    shape (symbol, cap) plus each symbol's next slot and fill count, indexed by a
+    symbol list. An upsert for the day a symbol already has as its latest observation
+    overwrites it, so reruns are idempotent. Windows are read back right-aligned
+    (oldest → newest) for the vectorized rank/percentile kernel.
+    """
+    def __init__(self, symbols=(), cap: int = IV_HISTORY_CAP):
+        self.cap = max(1, int(cap))
+        self.symbols = list(symbols)
+        self.row = {s: i for i, s in enumerate(self.symbols)}
+        n = len(self.symbols)
+        self.iv = np.full((n, self.cap), np.nan, dtype="float32")
+        self.day = np.zeros((n, self.cap), dtype="int32")
+        self.head = np.zeros(n, dtype="int32")
+        self.count = np.zeros(n, dtype="int32")
+
+    def _rows(self, symbols) -> np.ndarray:
+        new = [s for s in dict.fromkeys(symbols) if s not in self.row]
+        if new:
+            k = len(new)
+            self.row.update({s: len(self.symbols) + i for i, s in enumerate(new)})
+            self.symbols += new
+            self.iv = np.vstack([self.iv, np.full((k, self.cap), np.nan, dtype="float32")])
+            self.day = np.vstack([self.day, np.zeros((k, self.cap), dtype="int32")])
+            self.head = np.concatenate([self.head, np.zeros(k, dtype="int32")])
+            self.count = np.concatenate([self.count, np.zeros(k, dtype="int32")])
+        return np.array([self.row[s] for s in symbols], dtype="int64")
+
+    def upsert(self, symbols, values, day) -> int:
+        """
+        Record one value per (distinct) symbol for `day`, a scalar or one day per symbol;
+        NaN/None values are skipped. Returns how many observations were appended.
+        """
+        vals = np.array([np.nan if v is None else v for v in values], dtype="float64")
+        ok = np.isfinite(vals)
+        day = np.broadcast_to(np.asarray(day, dtype="int32"), vals.shape)[ok]
+        symbols = [s for s, k in zip(symbols, ok) if k]
+        if not symbols:
+            return 0
+        r, vals = self._rows(symbols), vals[ok]
+        last = (self.head[r] - 1) % self.cap
+        same = (self.count[r] > 0) & (self.day[r, last] == day)
+        slot = np.where(same, last, self.head[r])
+        self.iv[r, slot] = vals
+        self.day[r, slot] = day
+        adv = r[~same]
+        self.head[adv] = (self.head[adv] + 1) % self.cap
+        self.count[adv] = np.minimum(self.count[adv] + 1, self.cap)
+        return len(adv)
+
+    def window(self, symbols, width: int = None):
+        """(values, days, counts) for `symbols`: (n × width) right-aligned, NaN/0 where empty or unknown."""
+        width = width or self.cap
+        n, k = len(symbols), min(width, self.cap)
+        H = np.full((n, width), np.nan); D = np.zeros((n, width), dtype="int32")
+        counts = np.zeros(n, dtype="int64")
+        idx = np.array([self.row.get(s, -1) for s in symbols], dtype="int64")
+        known = idx >= 0
+        if known.any():
+            r = idx[known]
+            slots = (self.head[r][:, None] - k + np.arange(k)) % self.cap
+            c = np.minimum(self.count[r], k)
+            empty = np.arange(k)[None, :] < (k - c)[:, None]
+            H[known, width-k:] = np.where(empty, np.nan, self.iv[r[:, None], slots])
+            D[known, width-k:] = np.where(empty, 0, self.day[r[:, None], slots])
+            counts[known] = c
+        return H, D, counts
+
+    def rank_pct(self, symbols, current, window: int, min_count: int = None):
+        """Vectorized IV rank / percentile of `current` over each symbol's last `window` observations."""
+        H, _, counts = self.window(symbols, window)
+        # at storage precision, so today's own observation ties with `current`
+        cur = np.array([np.nan if v is None else v for v in current], dtype="float32").astype("float64")
+        return iv_rank_pct_vec(H, counts, cur, window, min_count=min_count)
+
+    def to_json(self) -> dict:
+        """{symbol: [iv, ...]} oldest → newest (the dashboard's iv_history.json)."""
+        H, _, counts = self.window(self.symbols)
+        return {s: [round(float(v), 6) for v in H[i, self.cap-counts[i]:]]
+                for i, s in enumerate(self.symbols) if counts[i]}
+
+    @classmethod
+    def load(cls, path: str = IV_STORE_PATH, legacy_json: str = IV_HISTORY_PATH, cap: int = IV_HISTORY_CAP):
+        """Open the .npz store; without one, migrate iv_history.json (undated: read as consecutive past days)."""
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                old = cls(z["symbols"].tolist(), int(z["cap"]))
+                old.iv, old.day, old.head, old.count = z["iv"], z["day"], z["head"], z["count"]
+            if old.cap == cap:
+                return old
+            st, (H, D, _) = cls(old.symbols, cap), old.window(old.symbols)
+            for j in range(old.cap):   # replay oldest → newest into the new width
+                st.upsert(old.symbols, H[:, j], D[:, j])
+            return st
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning("IV store %s unreadable (%s); rebuilding.", path, e)
+        st = cls(cap=cap)
+        try:
+            with open(legacy_json, "r") as f:
+                legacy = json.load(f)
+        except (OSError, ValueError):
+            return st
+        today = int(time.time() // DAY_S)
+        for sym, vals in legacy.items():
+            vals = [float(v) for v in vals or [] if isinstance(v, (int, float)) and math.isfinite(v)][-cap:]
+            for k, v in enumerate(vals):
+                st.upsert([sym], [v], today - len(vals) + k)
+        logging.info("IV store: migrated %d symbol(s) from %s.", len(st.symbols), legacy_json)
+        return st
+
+    def save(self, path: str = IV_STORE_PATH, json_path: str = IV_HISTORY_PATH):
+        """Write the .npz store and the derived iv_history.json; returns the JSON path (None on failure)."""
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                np.savez_compressed(f, symbols=np.array(self.symbols, dtype="U"), cap=np.int32(self.cap),
+                                    iv=self.iv, day=self.day, head=self.head, count=self.count)
+            os.replace(path + ".tmp", path)
+            os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+            with open(json_path + ".tmp", "w") as f:
+                json.dump(self.to_json(), f, separators=(",", ":"))
+            os.replace(json_path + ".tmp", json_path)
+            logging.info("Saved IV history → %s (%.1f KB) + %s (%.1f KB)", path, os.path.getsize(path)/1024,
+                         json_path, os.path.getsize(json_path)/1024)
+            return json_path
+        except Exception as e:
+            logging.debug("IV history save failed: %s", e)
+            return None
 
-def _load_iv_history(path=IV_HISTORY_PATH):
-    try:
-        if os.path.exists(path):
-            with open(path,"r") as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {}
-
-# REPLACE your _save_iv_history with this version
-def _save_iv_history(hist, path=IV_HISTORY_PATH):
-    """Write iv_history.json and return the final path (or None on failure)."""
-    try:
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        tmp = path + ".tmp"
-        with open(tmp, "w") as f:
-            json.dump(hist, f, separators=(",", ":"))
-        os.replace(tmp, path)
-        logging.info("Saved IV history → %s (%.1f KB)", path, os.path.getsize(path)/1024)
-        return path
-    except Exception as e:
-        logging.debug("IV history save failed: %s", e)
+# Vectorized solver: array-in/array-out, NaN marks quotes that cannot be inverted.
+def _norm_cdf_vec(x):
+    """Standard normal CDF (Abramowitz–Stegun 26.2.17, |err| < 7.5e-8)."""
+    x = np.asarray(x, dtype="float64")
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.2316419*z)
+    poly = t*(0.319381530 + t*(-0.356563782 + t*(1.781477937 + t*(-1.821255978 + t*1.330274429))))
+    upper = 1.0 - 0.3989422804014327*np.exp(-0.5*z*z)*poly
+    return np.where(x >= 0, upper, 1.0 - upper)
+
+def _bs_price_vec(S, K, T, r, q, sigma, is_call):
+    """Black-Scholes price and vega, broadcast over all arguments."""
+    sqrtT = np.sqrt(T)
+    d1 = (np.log(S/K) + (r - q + 0.5*sigma*sigma)*T) / (sigma*sqrtT)
+    d2 = d1 - sigma*sqrtT
+    dfq, dfr = np.exp(-q*T), np.exp(-r*T)
+    call = S*dfq*_norm_cdf_vec(d1) - K*dfr*_norm_cdf_vec(d2)
+    put  = K*dfr*_norm_cdf_vec(-d2) - S*dfq*_norm_cdf_vec(-d1)
+    vega = S*dfq*0.3989422804014327*np.exp(-0.5*d1*d1)*sqrtT
+    return np.where(is_call, call, put), vega
+
+def implied_vol_vec(price, S, K, T, r=0.0, q=0.0, is_call=True, tol=1e-6, max_iter=50,
+                    lo=1e-4, hi=5.0):
+    """
+    Implied vol for whole chains at once (Newton steps inside a shrinking bisection
+    bracket; falls back to the midpoint when vega is tiny or the step leaves it).
+    All arguments broadcast; masked/NaN prices, quotes outside the no-arbitrage
+    bounds and ones that do not converge within max_iter come back as NaN.
+    """
+    price = np.ma.filled(np.ma.asarray(price, dtype="float64"), np.nan)
+    S, K, T, r, q, is_call, price = np.broadcast_arrays(
+        np.asarray(S, "float64"), np.asarray(K, "float64"), np.asarray(T, "float64"),
+        np.asarray(r, "float64"), np.asarray(q, "float64"), np.asarray(is_call, bool), price)
+    with np.errstate(all="ignore"):
+        fwd_s, fwd_k = S*np.exp(-q*T), K*np.exp(-r*T)
+        lower = np.where(is_call, np.maximum(fwd_s - fwd_k, 0.0), np.maximum(fwd_k - fwd_s, 0.0))
+        upper = np.where(is_call, fwd_s, fwd_k)
+        ok = (np.isfinite(price) & np.isfinite(S) & np.isfinite(K) & np.isfinite(T)
+              & (S > 0) & (K > 0) & (T > 0) & (price > lower) & (price < upper))
+
+        a = np.where(ok, lo, np.nan); b = np.where(ok, hi, np.nan)
+        # Brenner–Subrahmanyam ATM guess, clipped into the bracket
+        sig = np.clip(np.sqrt(2*np.pi/np.where(ok, T, 1.0)) * price/np.where(ok, S, 1.0), lo*2, hi/2)
+        done = ~ok
+        for _ in range(max_iter):
+            p, vega = _bs_price_vec(S, K, T, r, q, sig, is_call)
+            diff = p - price
+            # converged once the Newton step (diff/vega, in vol units) or the bracket is below
+            # tol; a bare |diff| < tol would accept any guess for quotes worth under tol
+            done = done | (np.abs(diff) < tol*vega) | (b - a < tol)
+            if done.all():
+                break
+            b = np.where(~done & (diff > 0), sig, b)
+            a = np.where(~done & (diff <= 0), sig, a)
+            step = sig - diff/np.where(vega > 1e-12, vega, np.nan)
+            nxt = np.where(np.isfinite(step) & (step > a) & (step < b), step, 0.5*(a + b))
+            sig = np.where(done, sig, nxt)
+        sig = np.where(ok & done & (sig > lo*1.01) & (sig < hi*0.99), sig, np.nan)
+    return sig
+
+def _midprice_vec(df):
+    """Column version of _midprice: mid when bid/ask are sane, else lastPrice, else NaN."""
+    def col(c):
+        return pd.to_numeric(df[c], errors="coerce").to_numpy("float64") if c in df.columns \
+            else np.full(len(df), np.nan)
+    b, a, lp = col("bid"), col("ask"), col("lastPrice")
+    with np.errstate(invalid="ignore"):
+        mid = np.where(np.isfinite(b) & np.isfinite(a) & (a >= b) & (a > 0), 0.5*(a + b), np.nan)
+        return np.where(np.isnan(mid) & np.isfinite(lp) & (lp > 0), lp, mid)
+
+def _atm_iv_from_chain(calls, puts, spot: float, T: float, source: str = IV_SOURCE):
+    """
+    ATM implied vol for one expiry. source="mid" inverts every strike within
+    IV_ATM_BAND of spot in one implied_vol_vec call and interpolates each side's
+    smile at the spot, averaging calls and puts. Falls back to Yahoo's
+    impliedVolatility at the nearest strike (the only path for source="yahoo").
+    """
+    sides = [(df, kind) for df, kind in ((calls, True), (puts, False)) if df is not None and not df.empty]
+    if not sides or spot is None or not math.isfinite(spot) or spot <= 0:
         return None
 
-
-
-def _iv_rank_percentile(history_vals, current):
-    vals = [v for v in (history_vals or []) if isinstance(v,(int,float)) and math.isfinite(v)]
-    if not vals: return None, None
-    mn, mx = min(vals), max(vals)
-    iv_rank = None
-    if mx > mn:
-        iv_rank = 100.0 * (current - mn) / (mx - mn)
-    below = sum(1 for v in vals if v <= current)
-    iv_pct = 100.0 * below / len(vals)
-    return (round(iv_rank,2) if iv_rank is not None else None, round(iv_pct,2))
-
-def _norm_cdf(x): return 0.5*(1.0 + math.erf(x / math.sqrt(2.0)))
-
-def _bs_price(S, K, T, r, q, sigma, kind="call"):
-    if sigma<=0 or T<=0 or S<=0 or K<=0: return None
-    d1 = (math.log(S/K) + (r - q + 0.5*sigma*sigma)*T) / (sigma*math.sqrt(T))
-    d2 = d1 - sigma*math.sqrt(T)
-    if kind=="call":
-        return S*math.exp(-q*T)*_norm_cdf(d1) - K*math.exp(-r*T)*_norm_cdf(d2)
-    else:
-        return K*math.exp(-r*T)*(1 - _norm_cdf(d2)) - S*math.exp(-q*T)*(1 - _norm_cdf(d1))
-
-def _implied_vol_bisection(price, S, K, T, r=0.00, q=0.00, kind="call", tol=1e-6, max_iter=60):
-    lo, hi = 1e-4, 5.0
-    for _ in range(max_iter):
-        mid = 0.5*(lo+hi)
-        pmid = _bs_price(S,K,T,r,q,mid,kind)
-        if pmid is None: return None
-        if abs(pmid - price) < tol: return mid
-        if pmid > price: hi = mid
-        else: lo = mid
-    return mid
+    if source == "mid":
+        parts = []
+        for df, is_call in sides:
+            k = pd.to_numeric(df["strike"], errors="coerce").to_numpy("float64")
+            near = np.isfinite(k) & (np.abs(k/spot - 1.0) <= IV_ATM_BAND)
+            if near.sum() < 2:   # thin chains: take the two closest strikes
+                near = np.zeros(len(k), bool); near[np.argsort(np.abs(k - spot))[:2]] = True
+            parts.append((k[near], _midprice_vec(df[near]), np.full(int(near.sum()), is_call)))
+        K = np.concatenate([p[0] for p in parts])
+        px = np.concatenate([p[1] for p in parts])
+        kind = np.concatenate([p[2] for p in parts])
+        iv = implied_vol_vec(px, spot, K, T, 0.0, 0.0, kind)
+        side_ivs = []
+        for is_call in (True, False):
+            m = (kind == is_call) & np.isfinite(iv)
+            if not m.any(): continue
+            order = np.argsort(K[m])
+            side_ivs.append(float(np.interp(spot, K[m][order], iv[m][order])))
+        if side_ivs:
+            return float(sum(side_ivs)/len(side_ivs))
+
+    ivs = []
+    for df, _ in sides:
+        k = pd.to_numeric(df["strike"], errors="coerce")
+        row = df.loc[(k - spot).abs().idxmin()]
+        iv = pd.to_numeric(row.get("impliedVolatility", None), errors="coerce")
+        if iv is not None and math.isfinite(iv) and 0 < iv < 5:
+            ivs.append(float(iv))
+    if not ivs: return None
+    return float(sum(ivs)/len(ivs))
 
 def _choose_30d_expirations(expiries):
     if not expiries: return None
@@ -383,6 +1375,121 @@ def _choose_30d_expirations(expiries):
             best, best_err = d, err
     return best
 
+def _bracket_30d_expirations(expiries, target: int = IV_TARGET_DAYS):
+    """(near, far) expiries with near ≤ target < far DTE; (best, None) when 30D is not bracketed."""
+    today = datetime.utcnow().date()
+    dated = []
+    for d in expiries or []:
+        try: dte = (datetime.strptime(d,"%Y-%m-%d").date() - today).days
+        except: continue
+        if dte > 1: dated.append((dte, d))
+    if not dated: return None, None
+    dated.sort()
+    below = [d for dte, d in dated if dte <= target]
+    above = [d for dte, d in dated if dte > target]
+    if below and above:
+        return below[-1], above[0]
+    return _choose_30d_expirations(expiries), None
+
+def _years_to(exp: str) -> float:
+    return max((datetime.strptime(exp,"%Y-%m-%d") - datetime.utcnow()).days, 1) / 365.0
+
+def _interp_iv_variance_time(iv1: float, T1: float, iv2: float, T2: float, T: float):
+    """Constant-maturity IV at T by linear interpolation of total variance σ²T."""
+    if T2 <= T1: return None
+    w = iv1*iv1*T1 + (iv2*iv2*T2 - iv1*iv1*T1) * (T - T1) / (T2 - T1)
+    if not (w > 0): return None
+    return math.sqrt(w / T)
+
+class ChainCache:
+    """
+    Option chains cached on disk for the run date: <dir>/<YYYY-MM-DD>/<SYMBOL>.json
+    holding the expiry list and every chain fetched today, so reruns within the day
+    (and a raised IV_MAX) do not re-download them. Older date folders are pruned.
+    """
+    def __init__(self, root: str = OPTION_CACHE_DIR, day: str = None):
+        self.day = day or datetime.utcnow().date().isoformat()
+        self.dir = os.path.join(root, self.day)
+        os.makedirs(self.dir, exist_ok=True)
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        try:
+            days = sorted(d for d in os.listdir(root) if re.fullmatch(r"\d{4}-\d{2}-\d{2}", d))
+            for old in days[:-OPTION_CACHE_KEEP_DAYS]:
+                for fn in os.listdir(os.path.join(root, old)):
+                    os.remove(os.path.join(root, old, fn))
+                os.rmdir(os.path.join(root, old))
+        except Exception as e:
+            logging.debug("Chain cache prune failed: %s", e)
+
+    def _path(self, symbol: str) -> str:
+        return os.path.join(self.dir, re.sub(r"[^A-Za-z0-9_.-]", "_", symbol) + ".json")
+
+    def _read(self, symbol: str) -> dict:
+        try:
+            with open(self._path(symbol), "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _write(self, symbol: str, entry: dict):
+        path = self._path(symbol)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit: self.hits += 1
+            else: self.misses += 1
+
+    def expiries(self, symbol: str, tk) -> list:
+        entry = self._read(symbol)
+        if "expiries" in entry:
+            self._count(True); return entry["expiries"]
+        self._count(False)
+        with rate_slot("yahoo"):
+            exps = list(getattr(tk, "options", []) or [])
+        entry["expiries"] = exps
+        self._write(symbol, entry)
+        return exps
+
+    def chain(self, symbol: str, tk, exp: str):
+        entry = self._read(symbol)
+        cached = (entry.get("chains") or {}).get(exp)
+        if cached is not None:
+            self._count(True)
+            return pd.DataFrame(cached["calls"]), pd.DataFrame(cached["puts"])
+        self._count(False)
+        with rate_slot("yahoo"):
+            ch = tk.option_chain(exp)
+        keep = ["strike","bid","ask","lastPrice","impliedVolatility"]
+        def slim(df):
+            if df is None or df.empty: return pd.DataFrame(columns=keep)
+            return df[[c for c in keep if c in df.columns]].copy()
+        calls, puts = slim(ch.calls), slim(ch.puts)
+        entry.setdefault("chains", {})[exp] = {
+            "calls": json.loads(calls.to_json(orient="records")),
+            "puts":  json.loads(puts.to_json(orient="records")),
+        }
+        self._write(symbol, entry)
+        return calls, puts
+
+_CHAIN_CACHE = None
+_CHAIN_CACHE_LOCK = threading.Lock()
+
+def get_chain_cache():
+    """Process-wide ChainCache for today, or None when OPTION_CACHE_DIR is empty."""
+    global _CHAIN_CACHE
+    if not OPTION_CACHE_DIR:
+        return None
+    with _CHAIN_CACHE_LOCK:
+        today = datetime.utcnow().date().isoformat()
+        if _CHAIN_CACHE is None or _CHAIN_CACHE.day != today:
+            _CHAIN_CACHE = ChainCache(OPTION_CACHE_DIR, today)
+        return _CHAIN_CACHE
+
 def _midprice(row):
     b = float(row.get("bid", float("nan")))
     a = float(row.get("ask", float("nan")))
@@ -391,327 +1498,1398 @@ def _midprice(row):
     if math.isfinite(lp) and lp>0: return lp
     return None
 
-def fetch_iv30(symbol: str, spot: float):
+def fetch_iv30(symbol: str, spot: float, term: bool = None):
     """
     Returns iv30 (decimal) or None.
     ^VIX → spot/100. Skips crypto.
+    term (default IV_TERM): constant-maturity 30D IV from the two bracketing expiries;
+    otherwise ATM IV of the single expiry closest to 30 DTE.
     """
+    if term is None:
+        term = IV_TERM
     try:
         if symbol in NON_OPTION_UNIVERSE: return None
         if symbol == "^VIX" and spot is not None and math.isfinite(spot):
             return max(spot, 0.0) / 100.0
 
         tk = yf.Ticker(symbol)
-        expiries = list(getattr(tk, "options", []) or [])
+        cache = get_chain_cache()
+
+        def load_chain(exp):
+            if cache is not None:
+                calls, puts = cache.chain(symbol, tk, exp)
+            else:
+                with rate_slot("yahoo"):
+                    ch = tk.option_chain(exp)
+                calls, puts = ch.calls, ch.puts
+            for df in (calls, puts):
+                if df is not None and not df.empty:
+                    for c in ("bid","ask","lastPrice","impliedVolatility","strike"):
+                        if c in df.columns: df[c] = pd.to_numeric(df[c], errors="coerce")
+            return calls, puts
+
+        if cache is not None:
+            expiries = cache.expiries(symbol, tk)
+        else:
+            with rate_slot("yahoo"):
+                expiries = list(getattr(tk, "options", []) or [])
+
+        if term:
+            near, far = _bracket_30d_expirations(expiries)
+            if near and far:
+                T1, T2 = _years_to(near), _years_to(far)
+                iv1 = _atm_iv_from_chain(*load_chain(near), spot, T1)
+                iv2 = _atm_iv_from_chain(*load_chain(far), spot, T2)
+                if iv1 and iv2:
+                    iv = _interp_iv_variance_time(iv1, T1, iv2, T2, IV_TARGET_DAYS/365.0)
+                    if iv: return iv
+                if iv1 or iv2:
+                    return iv1 if abs(T1*365 - IV_TARGET_DAYS) <= abs(T2*365 - IV_TARGET_DAYS) and iv1 else iv2
+                return None
+
         exp = _choose_30d_expirations(expiries)
         if not exp: return None
-
-        ch = tk.option_chain(exp)
-        calls, puts = ch.calls, ch.puts
-        for df in (calls, puts):
-            if df is not None and not df.empty:
-                for c in ("bid","ask","lastPrice","impliedVolatility","strike"):
-                    if c in df.columns: df[c] = pd.to_numeric(df[c], errors="coerce")
-
-        # nearest to spot
-        def nearest(df):
-            if df is None or df.empty: return None
-            d = df.copy()
-            d["dist"] = (d["strike"] - spot).abs()
-            return d.sort_values("dist").iloc[0]
-
-        c = nearest(calls); p = nearest(puts)
-        # if both IVs present, average
-        ivs = []
-        for row, kind in ((c,"call"), (p,"put")):
-            if row is None: continue
-            iv = row.get("impliedVolatility", None)
-            if isinstance(iv, (int,float)) and math.isfinite(iv) and iv>0 and iv<5:
-                ivs.append(float(iv)); continue
-            # else back out from mid
-            mp = _midprice(row)
-            if not mp: continue
-            try:
-                T = max((datetime.strptime(exp,"%Y-%m-%d") - datetime.utcnow()).days, 1) / 365.0
-                iv_b = _implied_vol_bisection(mp, S=spot, K=float(row["strike"]), T=T, r=0.0, q=0.0, kind=kind)
-                if iv_b and iv_b>0: ivs.append(float(iv_b))
-            except Exception:
-                pass
-        if not ivs: return None
-        return float(sum(ivs)/len(ivs))
+        return _atm_iv_from_chain(*load_chain(exp), spot, _years_to(exp))
     except Exception as e:
         logging.debug("IV fetch failed %s: %s", symbol, e)
         return None
 
-# ───────────────────── Indicators per symbol ─────────────────────
+# ───────────────────── Multi-interval (local resampling) ─────────────────────
+YF_INTRADAY_BASES = (1, 2, 5, 15, 30, 60, 90)     # intraday bar sizes Yahoo serves, in minutes
+DAILY_RESAMPLE = {"1d": None, "1wk": "W", "1mo": "M", "3mo": "Q"}   # target → calendar period of daily bars
+YF_INTRADAY_PERIOD = os.getenv("YF_INTRADAY_PERIOD", "60d")
+
+def plan_intervals(intervals) -> dict:
+    """
+    {fetch interval: [target intervals]} for a multi-interval build. Daily-and-coarser
+    targets come from one 1d download; intraday targets from one download at the
+    coarsest Yahoo interval dividing all of them (1h,4h → 1h; 10m,30m → 5m).
+    Intraday bars are not rolled up into days: daily bars are dividend-adjusted and
+    Yahoo keeps far less intraday history.
+    """
+    plan, intraday = {}, []
+    for iv in dict.fromkeys(i.strip().lower() for i in intervals if i.strip()):
+        if iv in DAILY_RESAMPLE:
+            plan.setdefault("1d", []).append(iv)
+        elif interval_minutes(iv):
+            intraday.append(iv)
+        else:
+            logging.warning("Interval '%s' cannot be built from Yahoo bars; skipped.", iv)
+    if intraday:
+        g = math.gcd(*[interval_minutes(iv) for iv in intraday])
+        m = max(b for b in YF_INTRADAY_BASES if g % b == 0)
+        plan["1h" if m == 60 else f"{m}m"] = intraday
+    return plan
+
+def resample_bars(df: pd.DataFrame, base: str, target: str) -> pd.DataFrame:
+    """
+    Aggregate `base` OHLCV bars into `target` bars (open first, high max, low min, close
+    last, volume sum), each labelled with its first bar's timestamp. Intraday targets
+    take k = target/base consecutive bars within each trading day, so 4h from 1h is
+    09:30–13:30 + 13:30–16:00 for equities and 00:00-aligned for crypto; 1wk/1mo/3mo
+    group daily bars by calendar week/month/quarter.
+    """
+    if target == base or df is None or df.empty:
+        return df
+    idx = df.index
+    if target in DAILY_RESAMPLE:
+        naive = idx.tz_localize(None) if getattr(idx, "tz", None) is not None else idx
+        keys = [pd.factorize(naive.to_period(DAILY_RESAMPLE[target]))[0]]
+    else:
+        day = pd.factorize(idx.normalize())[0]
+        pos = pd.Series(day).groupby(day).cumcount().to_numpy()
+        keys = [day, pos // (interval_minutes(target) // interval_minutes(base))]
+    agg = {c: f for c, f in (("Open", "first"), ("High", "max"), ("Low", "min"),
+                             ("Close", "last"), ("Volume", "sum")) if c in df.columns}
+    out = df[list(agg)].assign(_t=idx).groupby(keys, sort=False).agg({**agg, "_t": "first"})
+    return out.set_index(pd.DatetimeIndex(out.pop("_t")).rename(idx.name))
+
+def interval_output_path(path: str, interval: str, primary: str) -> str:
+    """--output for the primary interval, <root>_<interval><ext> for the others."""
+    if interval == primary:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_{interval}{ext or '.json'}"
+
+# ───────────────────── Panel engine (whole universe) ─────────────────────
 # --- add near other ENV at top ---
 HIST_MAX = int(os.getenv("HIST_MAX", "360"))  # max points embedded per symbol
+MIN_BARS = 60
 
-# ... kep other code ...
-def indicators_for(symbol, period: str, interval: str):
+class Panel:
+    """
+    Closes and volumes of many symbols as (time × symbol) float arrays, aligned
+    bar-by-bar from the most recent bar (row -1 is every symbol's last bar) and
+    NaN-padded above ragged histories. Bars without a finite close are dropped.
+    Every indicator is computed for all symbols in one vectorized pass.
+    """
+    def __init__(self, frames: dict, interval: str):
+        self.interval = interval
+        self.symbols, self.index = [], []
+        closes, vols = [], []
+        for sym, df in frames.items():
+            if df is None or df.empty:
+                continue
+            c = _series(df, "Close").to_numpy("float64")
+            v = _series(df, "Volume").to_numpy("float64")
+            ok = np.isfinite(c)
+            self.symbols.append(sym); self.index.append(df.index[ok])
+            closes.append(c[ok]); vols.append(v[ok])
+        T, N = max([len(c) for c in closes] + [1]), len(closes)
+        self.close = np.full((T, N), np.nan)
+        self.volume = np.full((T, N), np.nan)
+        self.counts = np.array([len(c) for c in closes], dtype="int64")
+        for j, (c, v) in enumerate(zip(closes, vols)):
+            if len(c):
+                self.close[T-len(c):, j] = c
+                self.volume[T-len(v):, j] = v
+        self.col = {s: j for j, s in enumerate(self.symbols)}
+
+    def _lag(self, k: int):
+        """Close k bars before the last one (NaN where the history is shorter)."""
+        if self.close.shape[0] <= k:
+            return np.full(len(self.symbols), np.nan)
+        return np.where(self.counts > k, self.close[-1-k], np.nan)
+
+    def rsi_ewm(self, window: int = 14):
+        """
+        Last RSI per symbol with ta's RSIIndicator recursion: EWM (α=1/window,
+        adjust=False) of up/down moves, seeded with a zero move on the first bar,
+        defined once a symbol has `window` bars.
+        """
+        C = self.close
+        a = 1.0 / window
+        up = np.zeros(C.shape[1]); dn = np.zeros(C.shape[1])
+        with np.errstate(invalid="ignore"):
+            for t in range(1, C.shape[0]):
+                ch = C[t] - C[t-1]
+                valid = np.isfinite(ch)
+                g = np.where(ch > 0, ch, 0.0); l = np.where(ch < 0, -ch, 0.0)
+                up = np.where(valid, (1-a)*up + a*g, up)
+                dn = np.where(valid, (1-a)*dn + a*l, dn)
+            rsi = np.where(dn == 0, 100.0, 100.0 - 100.0/(1.0 + up/dn))
+        return np.where(self.counts >= window, rsi, np.nan)
+
+    def vol_z(self, window: int = 60):
+        """z-score of the last log volume against the trailing `window` bars (incl. itself)."""
+        if self.volume.shape[0] < window:
+            return np.full(len(self.symbols), np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            L = np.log(np.where(self.volume[-window:] > 0, self.volume[-window:], np.nan))
+            full = np.isfinite(L).all(axis=0)
+            mu = L.mean(axis=0); sd = L.std(axis=0, ddof=1)
+            z = (L[-1] - mu) / sd
+        return np.where(full & np.isfinite(z), z, np.nan)
+
+    def sharpe(self, rf_annual: float = RISK_FREE, min_rets: int = 30):
+        """Annualized Sharpe of all per-bar returns (periods_per_year per symbol)."""
+        ppy = np.array([periods_per_year(self.interval, s) for s in self.symbols], dtype="float64")
+        with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            R = self.close[1:]/self.close[:-1] - 1.0 - (rf_annual/ppy)[None, :]
+            n = np.isfinite(R).sum(axis=0)
+            mu = np.nanmean(R, axis=0); sd = np.nanstd(R, axis=0, ddof=1)
+            out = np.where(sd > 0, mu/sd*np.sqrt(ppy), np.nan)
+        return np.where(n >= min_rets, out, np.nan)
+
+    def spark(self, n: int = 30):
+        """Last n closes min-max normalized per symbol, (n × symbol); NaN rows where undefined."""
+        tail = self.close[-n:]
+        with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mn, mx = np.nanmin(tail, axis=0), np.nanmax(tail, axis=0)
+            out = (tail - mn) / (mx - mn)
+        ok = (mx > mn) & (np.minimum(self.counts, n) >= 2)
+        return np.where(ok[None, :], out, np.nan)
+
+    def matrix(self, symbols, last: int = None):
+        """(symbol × time) right-aligned closes for `symbols` (tail `last` bars) + counts, as _right_align."""
+        cols = [self.col[s] for s in symbols]
+        M = self.close[:, cols].T
+        counts = self.counts[cols]
+        if last is not None:
+            M, counts = M[:, -last:], np.minimum(counts, last)
+        return M, counts
+
+    def hist(self, symbol: str, hist_max: int = HIST_MAX) -> dict:
+        """{"t","c","v"} lists of the last hist_max bars of one symbol (what rows embed as hist)."""
+        j = self.col[symbol]
+        h = min(int(self.counts[j]), hist_max)
+        idx = self.index[j][-h:] if h else []
+        # timestamps: date for daily; iso for intraday
+        t_vals = [i.date().isoformat() for i in idx] if self.interval == "1d" else [i.isoformat() for i in idx]
+        c_vals = self.close[-h:, j].tolist() if h else []
+        v_vals = [None if not np.isfinite(v) else float(v) for v in self.volume[-h:, j]] if h else []
+        return {"t": t_vals, "c": c_vals, "v": v_vals}
+
+    def indicators(self, hist_max: int = HIST_MAX, rf_annual: float = RISK_FREE, with_hist: bool = True) -> dict:
+        """
+        {symbol: feature dict} for every symbol with at least MIN_BARS bars. with_hist=False
+        leaves hist as None so the caller can build it per symbol with hist() (streaming).
+        """
+        last = self.close[-1] if self.close.shape[0] else np.full(len(self.symbols), np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ret1 = last/self._lag(1) - 1.0
+            ret5 = last/self._lag(5) - 1.0
+        rsi, volz, shp, spark = self.rsi_ewm(14), self.vol_z(MIN_BARS), self.sharpe(rf_annual), self.spark(30)
+        r = lambda x, nd: round(float(x), nd) if np.isfinite(x) else None
+
+        out = {}
+        for j, sym in enumerate(self.symbols):
+            if int(self.counts[j]) < MIN_BARS:
+                continue
+            sp = spark[:, j]
+            out[sym] = {
+                "price": round(float(last[j]), 4),
+                "ret1d": r(ret1[j], 5),
+                "ret5d": r(ret5[j], 5),
+                "rsi14": r(rsi[j], 2),
+                "vol_z": r(volz[j], 2),
+                "spark30": [round(float(v), 4) for v in sp[np.isfinite(sp)]] or None,
+                "sharpe": r(shp[j], 3),
+                "hist": self.hist(sym, hist_max) if with_hist else None,
+            }
+        return out
+
+def fetch_bars(symbol, period: str, interval: str):
+    """Bars for one symbol through the bar store when enabled, else try_download."""
+    store = get_bar_store()
+    if store is not None:
+        df = sync_bars(store, [symbol], period, interval, batch_size=1).get(symbol)
+        return df if df is not None else _fallback_bars(symbol, period, interval)
+    return try_download(symbol, period, interval)
+
+def indicators_for(symbol, period: str, interval: str, df=None):
+    """Indicators for one symbol (a one-column Panel); pass df to reuse already-fetched bars."""
     try:
-        df = try_download(symbol, period, interval)
-        if df is None or df.empty or len(df) < 60:
+        if df is None:
+            df = fetch_bars(symbol, period, interval)
+        if df is None or df.empty or len(df) < MIN_BARS:
             logging.debug("No/short data for %s (len=%s)", symbol, 0 if df is None else len(df))
             return None
-        close = _series(df,"Close")
-        volume= _series(df,"Volume")
-
-        # ----- (server-side defaults; UI will recompute client-side anyway)
-        from ta.momentum import RSIIndicator
-        rsi = RSIIndicator(close=close, window=14).rsi()
-        ret1 = close.pct_change(1)
-        ret5 = close.pct_change(5)
-
-        # Volume z-score (60)
-        volz = None
-        if volume.notna().sum() >= 60:
-            logv = np.log(volume.replace(0, np.nan))
-            volz = (logv - logv.rolling(60).mean()) / logv.rolling(60).std()
-
-        # spark (last 30, normalized)
-        spark_src = close.tail(30).dropna().to_list()
-        spark_norm = None
-        if len(spark_src) >= 2:
-            mn, mx = float(min(spark_src)), float(max(spark_src))
-            if mx > mn:
-                spark_norm = [round((float(v) - mn) / (mx - mn), 4) for v in spark_src]
-
-        # history payload (cap to HIST_MAX)
-        hist_df = df.tail(HIST_MAX).copy()
-        # timestamps: date for daily; iso for intraday
-        if interval == "1d":
-            t_vals = [idx.date().isoformat() for idx in hist_df.index]
-        else:
-            t_vals = [idx.isoformat() for idx in hist_df.index]
-        c_vals = [None if not np.isfinite(v) else float(v) for v in _series(hist_df, "Close").tolist()]
-        v_vals = [None if (v is None or (isinstance(v,float) and not np.isfinite(v))) else float(v) for v in _series(hist_df, "Volume").tolist()]
-
-        rsi_last  = float(rsi.iloc[-1])  if np.isfinite(rsi.iloc[-1])  else None
-        volz_last = float(volz.iloc[-1]) if isinstance(volz, pd.Series) and np.isfinite(volz.iloc[-1]) else None
-
-        # default server Sharpe using full tail series (UI will override)
-        shp = sharpe_ratio(close, interval, symbol, RISK_FREE)
-
-        return {
-            "price": round(float(close.iloc[-1]), 4),
-            "ret1d": round(float(ret1.iloc[-1]), 5) if np.isfinite(ret1.iloc[-1]) else None,
-            "ret5d": round(float(ret5.iloc[-1]), 5) if np.isfinite(ret5.iloc[-1]) else None,
-            "rsi14": None if rsi_last is None else round(rsi_last, 2),
-            "vol_z": None if volz_last is None else round(volz_last, 2),
-            "spark30": spark_norm,
-            "sharpe": shp,
-            "hist": {"t": t_vals, "c": c_vals, "v": v_vals},  # <── added
-        }
+        return Panel({symbol: df}, interval).indicators().get(symbol)
     except Exception as e:
         logging.debug("Error indicators %s: %s", symbol, e)
         return None
 
-# ─────────────── GitHub upload (same as before) ───────────────
+# ───────────────────── Window grids (dashboard lookups) ─────────────────────
+# Every window offered by the dropdowns in docs/index.html, computed server-side
+# so docs/app.js only indexes into rsi_w / sharpe_w / ivr_w / ivp_w.
+UI_RSI_WINDOWS    = (14, 21, 30, 50)
+UI_SHARPE_WINDOWS = (60, 120, 180, 252, 360)
+UI_IV_WINDOWS     = (90, 180, 252, 360)
+
+def _right_align(seqs, width: int = None):
+    """
+    Pack ragged sequences into an (n, width) float matrix: finite values only,
+    right-aligned (latest value in the last column), NaN-padded on the left.
+    Returns (matrix, counts).
+    """
+    arrs = []
+    for seq in seqs:
+        a = np.asarray([np.nan if v is None else v for v in (seq if seq is not None else [])], dtype="float64")
+        arrs.append(a[np.isfinite(a)])
+    W = width or max([len(a) for a in arrs] + [1])
+    M = np.full((len(arrs), W), np.nan)
+    counts = np.zeros(len(arrs), dtype="int64")
+    for i, a in enumerate(arrs):
+        a = a[-W:]
+        if len(a): M[i, W-len(a):] = a
+        counts[i] = len(a)
+    return M, counts
+
+def rsi_series_vec(M, counts, period: int):
+    """
+    Wilder RSI at every bar for every row of a right-aligned close matrix (same
+    seeding as the dashboard: simple mean of the first `period` moves), NaN until a
+    row has period+1 closes. Loops over time only.
+    """
+    n, W = M.shape
+    out = np.full((n, W), np.nan)
+    start = W - counts                     # first valid column per row
+    gain = np.zeros(n); loss = np.zeros(n)
+    with np.errstate(invalid="ignore"):
+        diff = np.diff(M, axis=1)          # diff[:, t-1] = M[:, t] - M[:, t-1]
+    for t in range(1, W):
+        k = t - start                      # 1-based index of this move within each row
+        ch = diff[:, t-1]
+        g = np.where(ch > 0, ch, 0.0); l = np.where(ch < 0, -ch, 0.0)
+        seed = (k >= 1) & (k <= period)
+        gain = np.where(seed, gain + g, gain); loss = np.where(seed, loss + l, loss)
+        at = k == period
+        gain = np.where(at, gain/period, gain); loss = np.where(at, loss/period, loss)
+        rec = k > period
+        gain = np.where(rec, (gain*(period-1) + g)/period, gain)
+        loss = np.where(rec, (loss*(period-1) + l)/period, loss)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[:, t] = np.where(k >= period, np.where(loss == 0, 100.0, 100.0 - 100.0/(1.0 + gain/loss)), np.nan)
+    return out
+
+def rsi_last_vec(M, counts, period: int):
+    """Wilder RSI at the last bar of every row (see rsi_series_vec); NaN with < period+1 closes."""
+    if M.shape[1] == 0:
+        return np.full(M.shape[0], np.nan)
+    return np.where(counts >= period + 1, rsi_series_vec(M, counts, period)[:, -1], np.nan)
+
+def sharpe_last_vec(M, counts, lookback: int, ppy, rf_annual: float):
+    """Annualized Sharpe over the last `lookback` closes of each row (NaN if too short)."""
+    n, W = M.shape
+    if lookback < 3 or W < lookback:
+        return np.full(n, np.nan)
+    tail = M[:, -lookback:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ex = tail[:, 1:]/tail[:, :-1] - 1.0 - (rf_annual/ppy)[:, None]
+        mu = ex.mean(axis=1)
+        sd = ex.std(axis=1, ddof=1)
+        out = np.where(sd > 0, mu/sd*np.sqrt(ppy), np.nan)
+    return np.where(counts >= lookback, out, np.nan)
+
+def iv_rank_pct_vec(H, counts, current, window: int, min_count: int = None):
+    """IV rank / percentile over the last `window` history values (NaN unless the history has ≥ min_count, default window)."""
+    n, W = H.shape
+    if W < window:
+        nan = np.full(n, np.nan); return nan, nan
+    tail = H[:, -window:]
+    with np.errstate(invalid="ignore", divide="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mn, mx = np.nanmin(tail, axis=1), np.nanmax(tail, axis=1)
+        rank = np.where(mx > mn, 100.0*(current - mn)/(mx - mn), np.nan)
+        pct = 100.0*(tail <= current[:, None]).sum(axis=1)/np.minimum(counts, window)
+    ok = (counts >= (max(2, window) if min_count is None else min_count)) & np.isfinite(current)
+    return np.where(ok, rank, np.nan), np.where(ok, pct, np.nan)
+
+def _grid_list(a, nd: int):
+    return [None if not np.isfinite(v) else round(float(v), nd) for v in a]
+
+def _close_matrix(rows, panel: "Panel" = None):
+    """Right-aligned closes of rows (the same bars as each row's hist): from the panel when given, else from hist."""
+    if panel is not None:
+        return panel.matrix([r["symbol"] for r in rows], last=HIST_MAX)
+    return _right_align([_hist_of(r).get("c") for r in rows])
+
+def add_window_grids(rows, iv_store: IvHistory, interval: str, rf_annual: float = RISK_FREE, panel: "Panel" = None) -> dict:
+    """
+    Attach rsi_w/sharpe_w/ivr_w/ivp_w (one value per window) to every row; returns the
+    window spec. Closes come from the panel's last HIST_MAX bars when given (the same
+    bars as each row's hist), else from the rows' hist lists.
+    """
+    spec = {"rsi": list(UI_RSI_WINDOWS), "sharpe": list(UI_SHARPE_WINDOWS), "iv": list(UI_IV_WINDOWS)}
+    if not rows:
+        return spec
+    M, counts = _close_matrix(rows, panel)
+    ppy = np.array([periods_per_year(interval, r["symbol"]) for r in rows], dtype="float64")
+    rsi = np.column_stack([rsi_last_vec(M, counts, w) for w in UI_RSI_WINDOWS])
+    shp = np.column_stack([sharpe_last_vec(M, counts, w, ppy, rf_annual) for w in UI_SHARPE_WINDOWS])
+
+    syms, cur = [r["symbol"] for r in rows], [r.get("iv30") for r in rows]
+    ivr, ivp = zip(*[iv_store.rank_pct(syms, cur, w) for w in UI_IV_WINDOWS])
+    ivr, ivp = np.column_stack(ivr), np.column_stack(ivp)
+
+    for i, r in enumerate(rows):
+        r["rsi_w"] = _grid_list(rsi[i], 2)
+        r["sharpe_w"] = _grid_list(shp[i], 3)
+        r["ivr_w"] = _grid_list(ivr[i], 2)
+        r["ivp_w"] = _grid_list(ivp[i], 2)
+    return spec
+
+# ───────────────────── Alert engine ─────────────────────
+# Each rule is data: `when` maps the feature dict F (one numpy vector per feature,
+# aligned with rows) to a boolean mask, `why` is a str.format template over F.
+# add_alerts() evaluates every rule for the whole universe at once; adding a rule is
+# one more entry here. Codes/labels match ALERT_LABELS in docs/app.js.
+ALERT_SWING_ORDER = 3        # a swing low/high is the extreme of ±3 bars
+ALERT_SWING_LOOKBACK = 40    # bars searched for the two most recent swings
+ALERT_RULES = [
+    {"code": "brk", "sev": "info", "label": "Breakout",
+     "when": lambda F: (F["close"] > F["hi20_prev"]) & (F["vol_z"] >= 1.0),
+     "why": "Close {close:.2f} cleared the prior 20-bar high {hi20_prev:.2f} on volume z {vol_z:+.1f}",
+     "opt": "Long call or bull call spread; exit on a close back under the breakout level"},
+    {"code": "pbuy", "sev": "info", "label": "Pullback Buy",
+     "when": lambda F: (F["sma20"] > F["sma50"]) & (F["close"] > F["sma50"]) & (F["close"] < F["sma20"]) & (F["rsi"] < 50),
+     "why": "Uptrend (SMA20 {sma20:.2f} > SMA50 {sma50:.2f}) pulled back under SMA20, RSI {rsi:.0f}",
+     "opt": "Cash-secured put or bull put spread below SMA50"},
+    {"code": "osb", "sev": "warn", "label": "Oversold Bounce",
+     "when": lambda F: (F["rsi_min5"] < 30) & (F["rsi"] > F["rsi_prev"]) & (F["ret1d"] > 0),
+     "why": "RSI {rsi:.0f} turning up from oversold (5-bar low {rsi_min5:.0f}), 1d {ret1d:+.1%}",
+     "opt": "Short-dated call spread; invalidated by a new low"},
+    {"code": "obf", "sev": "warn", "label": "Overbought Fade",
+     "when": lambda F: (F["rsi_max5"] > 70) & (F["rsi"] < F["rsi_prev"]) & (F["ret1d"] < 0),
+     "why": "RSI {rsi:.0f} rolling over from overbought (5-bar high {rsi_max5:.0f}), 1d {ret1d:+.1%}",
+     "opt": "Bear call spread above the recent high"},
+    {"code": "bullDiv", "sev": "info", "label": "Bullish Divergence",
+     "when": lambda F: (F["low2"] < F["low1"]) & (F["rsi_low2"] > F["rsi_low1"]) & (F["low2_age"] <= 10),
+     "why": "Lower low {low2:.2f} < {low1:.2f} while RSI made a higher low ({rsi_low2:.0f} > {rsi_low1:.0f})",
+     "opt": "Call debit spread; stop under the latest swing low"},
+    {"code": "bearDiv", "sev": "warn", "label": "Bearish Divergence",
+     "when": lambda F: (F["high2"] > F["high1"]) & (F["rsi_high2"] < F["rsi_high1"]) & (F["high2_age"] <= 10),
+     "why": "Higher high {high2:.2f} > {high1:.2f} while RSI made a lower high ({rsi_high2:.0f} < {rsi_high1:.0f})",
+     "opt": "Put debit spread or trim longs; stop over the latest swing high"},
+    {"code": "range", "sev": "info", "label": "Range Income",
+     "when": lambda F: (F["range20"] <= 0.06) & (F["rsi"] >= 40) & (F["rsi"] <= 60),
+     "why": "20-bar range {lo20:.2f}–{hi20:.2f} ({range20:.1%} wide), RSI {rsi:.0f}",
+     "opt": "Iron condor with short strikes outside the range"},
+    {"code": "ivHigh", "sev": "warn", "label": "High IV (Sell)",
+     "when": lambda F: F["iv_rank"] >= 80,
+     "why": "IV rank {iv_rank:.0f} (IV30 {iv30:.1%})",
+     "opt": "Sell premium: covered calls, cash-secured puts, credit spreads"},
+    {"code": "ivLow", "sev": "info", "label": "Low IV (Buy)",
+     "when": lambda F: F["iv_rank"] <= 20,
+     "why": "IV rank {iv_rank:.0f} (IV30 {iv30:.1%})",
+     "opt": "Buy premium: long options, calendars, debit spreads"},
+    {"code": "event", "sev": "risk", "label": "Event Spike",
+     "when": lambda F: (F["vol_z"] >= 2.5) & (np.abs(F["ret1d"]) >= 0.03),
+     "why": "Volume z {vol_z:+.1f} with a {ret1d:+.1%} move",
+     "opt": "Expect follow-through volatility; size down or wait for IV to settle"},
+]
+
+def _tail_stat(M, counts, n: int, fn, skip_last: bool = False):
+    """fn (nanmax/nanmin/nanmean) over the last n bars (excluding the last one if skip_last); NaN if shorter."""
+    end = M.shape[1] - 1 if skip_last else M.shape[1]
+    need = n + 1 if skip_last else n
+    if end < n:
+        return np.full(M.shape[0], np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        out = fn(M[:, end-n:end], axis=1)
+    return np.where(counts >= need, out, np.nan)
+
+def _last_swings(M, R, counts, low: bool, order: int = ALERT_SWING_ORDER, lookback: int = ALERT_SWING_LOOKBACK):
+    """
+    Two most recent confirmed swing lows (or highs) in the last `lookback` bars of every
+    row: (price1, price2, rsi1, rsi2, age2) with 2 the latest, age2 in bars; NaN if < 2 swings.
+    """
+    n, W = M.shape
+    nan = np.full(n, np.nan)
+    span_ = lookback + 2*order
+    if W < span_:
+        return nan, nan, nan, nan, nan
+    T = M[:, -span_:]
+    win = np.lib.stride_tricks.sliding_window_view(T, 2*order + 1, axis=1)    # (n, lookback, 2k+1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ext = np.nanmin(win, axis=2) if low else np.nanmax(win, axis=2)
+    mid = T[:, order:order+lookback]
+    swing = np.isfinite(mid) & (mid == ext)
+    swing &= (np.arange(lookback)[None, :] >= (span_ - counts)[:, None])         # whole window inside the history
+    ix = np.where(swing, np.arange(lookback)[None, :], -1)
+    i2 = ix.max(axis=1)
+    i1 = np.where(ix < i2[:, None], ix, -1).max(axis=1)
+    ok = i1 >= 0
+    rows = np.arange(n)
+    col = lambda i: W - span_ + order + np.maximum(i, 0)
+    pick = lambda A, i: np.where(ok, A[rows, col(i)], np.nan)
+    age2 = np.where(ok, W - 1 - col(i2), np.nan)
+    return pick(M, i1), pick(M, i2), pick(R, i1), pick(R, i2), age2
+
+def alert_features(rows, M, counts) -> dict:
+    """Feature vectors the rules read: price levels from the close matrix, RSI(14) series, row scalars."""
+    num = lambda k: np.array([np.nan if r.get(k) is None else float(r[k]) for r in rows], dtype="float64")
+    R = rsi_series_vec(M, counts, 14)
+    F = {k: num(k) for k in ("vol_z", "ret1d", "iv30", "iv_rank", "news_24h")}
+    F["close"] = M[:, -1] if M.shape[1] else np.full(len(rows), np.nan)
+    F["rsi"] = R[:, -1] if R.shape[1] else np.full(len(rows), np.nan)
+    F["rsi_prev"] = R[:, -2] if R.shape[1] > 1 else np.full(len(rows), np.nan)
+    F["rsi_min5"] = _tail_stat(R, counts - 14, 5, np.nanmin)
+    F["rsi_max5"] = _tail_stat(R, counts - 14, 5, np.nanmax)
+    F["hi20_prev"] = _tail_stat(M, counts, 20, np.nanmax, skip_last=True)
+    F["hi20"] = _tail_stat(M, counts, 20, np.nanmax)
+    F["lo20"] = _tail_stat(M, counts, 20, np.nanmin)
+    F["sma20"] = _tail_stat(M, counts, 20, np.nanmean)
+    F["sma50"] = _tail_stat(M, counts, 50, np.nanmean)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        F["range20"] = (F["hi20"] - F["lo20"]) / F["close"]
+    F["low1"], F["low2"], F["rsi_low1"], F["rsi_low2"], F["low2_age"] = _last_swings(M, R, counts, low=True)
+    F["high1"], F["high2"], F["rsi_high1"], F["rsi_high2"], F["high2_age"] = _last_swings(M, R, counts, low=False)
+    return F
+
+def add_alerts(rows, panel: "Panel" = None, rules=ALERT_RULES) -> dict:
+    """
+    Set row["alerts"] = [{code, sev, label, why, opt}] (rule order) for every row; returns
+    {code: hits}. Closes come from the panel when given, else from the rows' hist lists.
+    """
+    if not rows:
+        return {}
+    M, counts = _close_matrix(rows, panel)
+    F = alert_features(rows, M, counts)
+    hits = {}
+    with np.errstate(invalid="ignore"):
+        masks = [(rule, np.asarray(rule["when"](F), dtype=bool)) for rule in rules]
+    for r in rows:
+        r["alerts"] = []
+    for rule, mask in masks:
+        idx = np.flatnonzero(mask)
+        hits[rule["code"]] = len(idx)
+        for i in idx:
+            why = rule["why"].format(**{k: v[i] for k, v in F.items()})
+            rows[i]["alerts"].append({"code": rule["code"], "sev": rule["sev"], "label": rule["label"],
+                                      "why": why, "opt": rule["opt"]})
+    return hits
+
+# ───────────────────── Cross-sectional analytics ─────────────────────
+ANALYTICS_ENABLE = os.getenv("ANALYTICS_ENABLE", "1").lower() in TRUE_SET
+ANALYTICS_PATH = os.getenv("ANALYTICS_PATH", "docs/data/analytics.json")
+ANALYTICS_BENCHMARK = os.getenv("ANALYTICS_BENCHMARK", "SPY").strip() or "EW"   # ticker, or EW = equal-weight universe
+ANALYTICS_BETA_WINDOW = int(os.getenv("ANALYTICS_BETA_WINDOW", "60"))   # bars per rolling beta
+ANALYTICS_BETA_POINTS = int(os.getenv("ANALYTICS_BETA_POINTS", "60"))   # rolling-beta points kept per symbol
+ANALYTICS_LOOKBACK = int(os.getenv("ANALYTICS_LOOKBACK", "252"))        # return bars behind betas/correlations/clusters
+ANALYTICS_MIN_OBS = int(os.getenv("ANALYTICS_MIN_OBS", "20"))           # overlapping returns for a beta or correlation
+ANALYTICS_CORR_MAX = int(os.getenv("ANALYTICS_CORR_MAX", "1000"))       # symbols in the correlation matrix (universe order)
+ANALYTICS_CLUSTERS = int(os.getenv("ANALYTICS_CLUSTERS", "11"))
+ANALYTICS_FORMAT = "analytics-v1"
+
+def benchmark_symbols(symbols=()) -> list:
+    """Tickers the OHLCV fetch needs on top of symbols for the analytics benchmark."""
+    b = ANALYTICS_BENCHMARK
+    if not ANALYTICS_ENABLE or b.upper() == "EW" or b in symbols:
+        return []
+    return [b]
+
+def _price_series(symbols, rows_by: dict, panel: "Panel", interval: str) -> list:
+    """(epoch seconds, closes) per symbol: the panel's bars, else the row's hist (resumed rows)."""
+    out = []
+    for sym in symbols:
+        if panel is not None and sym in panel.col:
+            j = panel.col[sym]; k = int(panel.counts[j])
+            out.append((BarStore._epoch(panel.index[j], interval), panel.close[panel.close.shape[0]-k:, j]))
+        elif sym in rows_by:
+            h = _hist_of(rows_by[sym])
+            t, c = h.get("t") or [], np.array(h.get("c") or [], dtype="float64")
+            out.append((BarStore._epoch(pd.to_datetime(t), interval) if t else np.zeros(0, "int64"), c))
+        else:
+            out.append((np.zeros(0, "int64"), np.zeros(0)))
+    return out
+
+def aligned_returns(series: list, lookback: int = ANALYTICS_LOOKBACK) -> tuple:
+    """
+    (time axis, returns (T × N)) on the union of every symbol's timestamps, last `lookback`
+    returns. Closes are carried forward so a return spans back to the symbol's previous
+    bar (Friday → Monday, crypto weekends), and it is NaN where the symbol has no bar.
+    """
+    stamps = [ts for ts, _ in series if len(ts)]
+    if not stamps:
+        return np.zeros(0, "int64"), np.full((0, len(series)), np.nan)
+    axis = np.unique(np.concatenate(stamps))[-(lookback + 1):]
+    T, N = len(axis), len(series)
+    C = np.full((T, N), np.nan)
+    for j, (ts, c) in enumerate(series):
+        if not len(ts):
+            continue
+        pos = np.searchsorted(axis, ts)
+        ok = (pos < T) & (axis[np.minimum(pos, T-1)] == ts) & np.isfinite(c)
+        C[pos[ok], j] = c[ok]
+    have = np.isfinite(C)
+    last = np.where(have, np.arange(T)[:, None], 0)
+    np.maximum.accumulate(last, axis=0, out=last)
+    F = C[last, np.arange(N)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        R = F[1:] / F[:-1] - 1.0
+    R[~have[1:]] = np.nan
+    return axis[1:], R
+
+def rolling_beta(R, b, window: int = ANALYTICS_BETA_WINDOW, min_obs: int = ANALYTICS_MIN_OBS):
+    """
+    Beta of every column of R on benchmark returns b over each trailing `window` bars,
+    pairwise-complete, from cumulative sums → (T-window+1 × N); NaN under min_obs.
+    """
+    T = R.shape[0]
+    w = max(1, min(window, T))
+    M = np.isfinite(R) & np.isfinite(b)[:, None]
+    X = np.where(M, R, 0.0); B = np.where(M, b[:, None], 0.0)
+    def roll(A):
+        cs = np.concatenate([np.zeros((1, A.shape[1])), np.cumsum(A, axis=0)])
+        return cs[w:] - cs[:-w]
+    n, sx, sb, sxb, sbb = roll(M.astype("float64")), roll(X), roll(B), roll(X * B), roll(B * B)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sxb - sx * sb / n
+        var = sbb - sb * sb / n
+        beta = cov / var
+    return np.where((n >= min_obs) & (var > 1e-18), beta, np.nan)
+
+def corr_matrix(R, min_obs: int = ANALYTICS_MIN_OBS):
+    """Pairwise-complete Pearson correlation of R's columns (N × N) from five matrix products."""
+    M = np.isfinite(R).astype("float64")
+    X = np.where(M > 0, R, 0.0)
+    n = M.T @ M
+    sx = X.T @ M                       # Σx_i over bars where j also has a return
+    sxx = (X * X).T @ M
+    sxy = X.T @ X
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = sxy - sx * sx.T / n
+        vx = sxx - sx * sx / n
+        c = cov / np.sqrt(vx * vx.T)
+    c = np.clip(c, -1.0, 1.0)
+    c[(n < min_obs) | ~np.isfinite(c)] = np.nan
+    np.fill_diagonal(c, 1.0)
+    return c
+
+def _standardized(R, min_obs: int = ANALYTICS_MIN_OBS):
+    """Columns demeaned over their returns and scaled to unit norm (missing → 0); ok mask."""
+    ok = np.isfinite(R).sum(axis=0) >= min_obs
+    with np.errstate(invalid="ignore"):
+        Z = R - np.nanmean(np.where(ok, R, 0.0), axis=0)
+    Z = np.where(np.isfinite(Z), Z, 0.0)
+    norm = np.linalg.norm(Z, axis=0)
+    ok &= norm > 0
+    return np.where(ok, Z / np.where(norm > 0, norm, 1.0), 0.0), ok
+
+def _kmeans_cos(P, k: int, iters: int, rng) -> tuple:
+    """One spherical k-means run on unit rows P (k-means++ init on 1 - cos) → (labels, Σ max cos)."""
+    centers = [P[rng.integers(len(P))]]
+    for _ in range(1, k):
+        d = np.clip(1.0 - np.max(P @ np.array(centers).T, axis=1), 0.0, None)
+        centers.append(P[rng.choice(len(P), p=d / d.sum())] if d.sum() > 0 else P[rng.integers(len(P))])
+    C = np.array(centers)
+    lab = np.full(len(P), -1)
+    for _ in range(iters):
+        new = np.argmax(P @ C.T, axis=1)
+        if np.array_equal(new, lab):
+            break
+        lab = new
+        S = (lab == np.arange(k)[:, None]).astype(P.dtype) @ P
+        norm = np.linalg.norm(S, axis=1)
+        empty = norm == 0
+        if empty.any():                               # reseed with the worst-fitting points
+            worst = np.argsort(np.max(P @ C.T, axis=1))[:int(empty.sum())]
+            S[empty] = P[worst]; norm[empty] = 1.0
+        C = S / norm[:, None]
+    return lab, float(np.max(P @ C.T, axis=1).sum())
+
+def cluster_returns(Z, ok, k: int = ANALYTICS_CLUSTERS, iters: int = 30, restarts: int = 4, seed: int = 0):
+    """
+    Spherical k-means on standardized return columns (cosine ≈ correlation), best of
+    `restarts` seeded runs: labels (-1 where not ok) numbered by cluster size, largest
+    first. Deterministic per seed.
+    """
+    labels = np.full(Z.shape[1], -1)
+    idx = np.flatnonzero(ok)
+    k = min(k, len(idx))
+    if k < 1:
+        return labels
+    P = Z[:, idx].T                                   # points × bars, unit rows
+    rng = np.random.default_rng(seed)
+    lab, _ = max((_kmeans_cos(P, k, iters, rng) for _ in range(max(1, restarts))), key=lambda x: x[1])
+    sizes = np.bincount(lab, minlength=k)
+    rank = np.empty(k, dtype="int64"); rank[np.argsort(-sizes, kind="stable")] = np.arange(k)
+    labels[idx] = rank[lab]
+    return labels
+
+def _group_stats(rows, members: np.ndarray, Z, ok, R, beta_last, interval: str, label: str) -> dict:
+    """
+    Aggregates of one group. avg_corr only counts members with usable returns (unit Z
+    columns); vol annualizes the EW return with the members' median periods per year.
+    """
+    take = lambda f: np.array([np.nan if rows[i].get(f) is None else float(rows[i][f]) for i in members])
+    r = lambda x, nd: round(float(x), nd) if np.isfinite(x) else None
+    n = len(members)
+    live = members[ok[members]]
+    s, m = Z[:, live].sum(axis=1), len(live)
+    avg_corr = (s @ s - m) / (m * (m - 1)) if m > 1 else np.nan   # mean off-diagonal cosine of unit columns
+    ppy = float(np.median([periods_per_year(interval, rows[i]["symbol"]) for i in members])) if n else 252.0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        ew = np.nanmean(R[:, members], axis=1) if len(R) else np.zeros(0)
+        vol = np.nanstd(ew) * math.sqrt(ppy) if np.isfinite(ew).sum() > 1 else np.nan
+        return {"label": label, "n": n, "members": members.tolist(),
+                "ret1d": r(np.nanmean(take("ret1d")), 5), "ret5d": r(np.nanmean(take("ret5d")), 5),
+                "rsi14": r(np.nanmedian(take("rsi14")), 2), "beta": r(np.nanmean(beta_last[members]), 3),
+                "vol": r(vol, 4), "avg_corr": r(avg_corr, 3)}
+
+def _stamp_text(axis, interval: str) -> list:
+    idx = pd.to_datetime(axis, unit="s")
+    return [i.date().isoformat() for i in idx] if interval in DAILY_INTERVALS else [i.isoformat() for i in idx]
+
+def add_analytics(rows, panel: "Panel", interval: str, benchmark: str = None) -> dict:
+    """
+    Cross-sectional pass over the panel's closes. Sets row["beta"] (last rolling beta vs
+    benchmark, or vs the equal-weight universe when benchmark is EW or not in the panel)
+    and row["cluster"]; returns the analytics artifact:
+      beta    last value per symbol + rolling series, float32 [N, len(t)] base64
+      corr    upper triangle (k=1, row-major) of the correlation matrix of the first
+              corr.n symbols, float32 base64, NaN under ANALYTICS_MIN_OBS overlapping bars
+      groups  per cluster (and per sector when rows carry real sectors): members
+              (indices into symbols), mean ret1d/ret5d/beta, median RSI, EW vol, avg corr
+    """
+    benchmark = benchmark or ANALYTICS_BENCHMARK      # same lookup as benchmark_symbols()
+    syms = [r["symbol"] for r in rows]
+    rows_by = {r["symbol"]: r for r in rows}
+    bench = benchmark if benchmark.upper() != "EW" and panel is not None and benchmark in panel.col else None
+    if benchmark.upper() != "EW" and bench is None:
+        logging.warning("Analytics: benchmark %s not in the panel; using the equal-weight universe.", benchmark)
+    series = _price_series(syms + ([bench] if bench and bench not in rows_by else []), rows_by, panel, interval)
+    axis, R = aligned_returns(series)
+    b = R[:, syms.index(bench) if bench in rows_by else len(syms)] if bench else None
+    R = R[:, :len(syms)]
+    if b is None:                                     # equal weight over equities (no indices/crypto)
+        eq = np.array([not (s.startswith("^") or s in NON_OPTION_UNIVERSE) for s in syms], dtype=bool)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            b = np.nanmean(R[:, eq], axis=1) if eq.any() and len(R) else np.full(len(R), np.nan)
+
+    betas = rolling_beta(R, b) if len(R) else np.full((0, len(syms)), np.nan)
+    beta_last = betas[-1] if len(betas) else np.full(len(syms), np.nan)
+    n_corr = min(len(syms), ANALYTICS_CORR_MAX)
+    C = corr_matrix(R[:, :n_corr]) if n_corr else np.zeros((0, 0))
+    Z, ok = _standardized(R)
+    labels = cluster_returns(Z, ok)
+    for i, r in enumerate(rows):
+        r["beta"] = round(float(beta_last[i]), 3) if np.isfinite(beta_last[i]) else None
+        r["cluster"] = int(labels[i]) if labels[i] >= 0 else None
+
+    groups = {"cluster": []}
+    for g in range(int(labels.max()) + 1 if len(labels) else 0):
+        members = np.flatnonzero(labels == g)
+        core = members[np.argsort(-(Z[:, members].T @ Z[:, members].sum(axis=1)), kind="stable")[:3]]
+        groups["cluster"].append({"id": g, **_group_stats(rows, members, Z, ok, R, beta_last, interval,
+                                                          ", ".join(syms[i] for i in core))})
+    sectors = [r.get("sector") for r in rows]
+    named = sorted({s for s in sectors if s and s != "—"})
+    if len(named) > 1:
+        groups["sector"] = [_group_stats(rows, np.array([i for i, s in enumerate(sectors) if s == name]),
+                                         Z, ok, R, beta_last, interval, name) for name in named]
+
+    keep = betas[-ANALYTICS_BETA_POINTS:]
+    iu = np.triu_indices(n_corr, 1)
+    return {
+        "format": ANALYTICS_FORMAT, "as_of_utc": datetime.utcnow().isoformat(timespec="seconds")+"Z",
+        "interval": interval, "benchmark": bench or "EW", "window": ANALYTICS_BETA_WINDOW,
+        "lookback": int(len(R)), "min_obs": ANALYTICS_MIN_OBS, "symbols": syms,
+        "beta": {"last": [r["beta"] for r in rows], "t": _stamp_text(axis[len(axis)-len(keep):], interval),
+                 "dtype": "f4", "shape": [len(syms), len(keep)], "b64": _f32_b64(keep.T)},
+        "corr": {"n": n_corr, "dtype": "f4", "layout": "upper-k1-rowmajor", "b64": _f32_b64(C[iu])},
+        "groups": groups,
+    }
+
+def write_analytics(analytics: dict, path: str = ANALYTICS_PATH) -> str:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(analytics, f, separators=(",", ":"), ensure_ascii=False, allow_nan=False)
+    os.replace(path + ".tmp", path)
+    logging.info("Analytics → %s (%.1f KB)", path, os.path.getsize(path)/1024)
+    return path
+
+# ─────────────── GitHub upload (git data API) ───────────────
+GH_API_URL = os.getenv("GH_API_URL", "https://api.github.com").rstrip("/")   # point at a local stand-in for tests
+GH_FALLBACK_BRANCH = "bot-data"
+
 def _gh(api, token, method="GET", **kwargs):
     h = {"Authorization": f"Bearer {token}", "Accept":"application/vnd.github+json"}
-    return requests.request(method, api, headers=h, timeout=60, **kwargs)
+    return get_http().request(method, api, headers=h, timeout=60, **kwargs)
+
+def _gh_api(repo, path):
+    return f"{GH_API_URL}/repos/{repo}/{path}"
+
+def _gh_json(r, what):
+    if r.status_code in (200,201): return r.json()
+    raise RuntimeError(f"{what} failed [{r.status_code}]: {r.text[:300]}")
 
 def _gh_get_ref(repo, branch, token):
-    api = f"https://api.github.com/repos/{repo}/git/refs/heads/{branch}"
-    r = _gh(api, token)
+    r = _gh(_gh_api(repo, f"git/refs/heads/{branch}"), token)
     if r.status_code==200: return r.json()["object"]["sha"]
     raise RuntimeError(f"Cannot read ref {branch}: {r.status_code} {r.text}")
 
 def _gh_create_ref(repo, new_branch, from_sha, token):
-    api = f"https://api.github.com/repos/{repo}/git/refs"
-    r = _gh(api, token, "POST", json={"ref": f"refs/heads/{new_branch}", "sha": from_sha})
+    r = _gh(_gh_api(repo, "git/refs"), token, "POST", json={"ref": f"refs/heads/{new_branch}", "sha": from_sha})
     if r.status_code not in (200,201): raise RuntimeError(f"Create ref failed: {r.status_code} {r.text}")
 
-def upload_file_to_github(local_path, dest_path=None):
+def _gh_force_ref(repo, branch, sha, token):
+    """Point branch at sha, creating it if needed."""
+    r = _gh(_gh_api(repo, f"git/refs/heads/{branch}"), token, "PATCH", json={"sha": sha, "force": True})
+    if r.status_code != 200:
+        _gh_create_ref(repo, branch, sha, token)
+
+def git_blob_sha(data: bytes) -> str:
+    """Git object id of a blob with this content (what the trees API reports per path)."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def _gh_remote_blobs(repo, tree_sha, token) -> dict:
+    """{path: blob sha} for the whole tree; {} when GitHub truncates it (every file is then sent)."""
+    js = _gh_json(_gh(_gh_api(repo, f"git/trees/{tree_sha}"), token, params={"recursive": "1"}), "Read tree")
+    if js.get("truncated"):
+        logging.warning("Upload: remote tree listing truncated; uploading every file.")
+        return {}
+    return {e["path"]: e["sha"] for e in js.get("tree") or [] if e.get("type") == "blob"}
+
+def _gh_create_blob(repo, data: bytes, token) -> str:
+    try: body = {"content": data.decode("utf-8"), "encoding": "utf-8"}   # JSON goes up as-is, no base64
+    except UnicodeDecodeError: body = {"content": base64.b64encode(data).decode("ascii"), "encoding": "base64"}
+    return _gh_json(_gh(_gh_api(repo, "git/blobs"), token, "POST", json=body), "Create blob")["sha"]
+
+def publish_to_github(files: dict, message: str = None, branch: str = None, prune=()):
     """
-    Upload an arbitrary file to GitHub.
-    If dest_path is None, uses GH_PATH (for snapshot) or mirrors local_path.
+    Commit many files at once through the git data API: read the branch head and its
+    tree, create blobs (in parallel) only for files whose git hash differs from the
+    remote one, then one tree, one commit and one ref update. files maps repo path →
+    local path; remote blobs under a `prune` folder that are not in files are deleted.
+    A 403 on the ref update (protected branch) points GH_FALLBACK_BRANCH at the commit
+    instead; a 422 (branch moved meanwhile) retries on the new head.
+    Returns (committed, commit sha).
     """
     token = os.getenv("GH_TOKEN"); repo = os.getenv("GH_REPO")
     if not token or not repo:
-        logging.info("Upload: GH_TOKEN or GH_REPO not set; skipping %s.", local_path)
+        logging.info("Upload: GH_TOKEN or GH_REPO not set; skipping %d file(s).", len(files))
         return False, None
-
-    branch = os.getenv("GH_BRANCH","main")
-    # Choose destination
-    if dest_path:
-        dest = dest_path
-    else:
-        # fallback: if this is the snapshot, use GH_PATH; else mirror local tree
-        dest = os.getenv("GH_PATH") if os.path.basename(local_path) == "snapshot.json" else local_path
-
-    name   = os.getenv("GH_COMMITTER_NAME","sp500-bot")
-    email  = os.getenv("GH_COMMITTER_EMAIL","actions@users.noreply.github.com")
-
-    with open(local_path,"rb") as f:
-        content_b64 = base64.b64encode(f.read()).decode("ascii")
-    msg = f"upload {os.path.basename(local_path)} {datetime.utcnow().isoformat(timespec='seconds')}Z"
-
-    api_get = f"https://api.github.com/repos/{repo}/contents/{dest}"
-    r = _gh(api_get, token, params={"ref": branch})
-    sha = r.json().get("sha") if r.status_code==200 else None
-
-    api_put = f"https://api.github.com/repos/{repo}/contents/{dest}"
-    payload = {"message": msg, "content": content_b64, "branch": branch, "committer": {"name": name, "email": email}}
-    if sha: payload["sha"] = sha
-
-    r = _gh(api_put, token, "PUT", json=payload)
-    if r.status_code in (200,201):
-        commit_sha = (r.json().get("commit") or {}).get("sha")
-        logging.info("Upload: wrote %s → %s:%s (commit %s).", local_path, repo, dest, commit_sha or "unknown")
-        return True, commit_sha
-
-    if r.status_code == 403:
-        logging.warning("Upload (%s): 403 on %s — falling back to PR branch.", local_path, branch)
-        base_sha = _gh_get_ref(repo, branch, token)
-        pr_branch = "bot-data"
-        try: _gh_create_ref(repo, pr_branch, base_sha, token)
-        except Exception: pass
-        payload.pop("sha", None)
-        payload["branch"] = pr_branch
-        r2 = _gh(api_put, token, "PUT", json=payload)
-        if r2.status_code in (200,201):
-            commit_sha = (r2.json().get("commit") or {}).get("sha")
-            logging.info("Upload: pushed %s to %s. PR → https://github.com/%s/compare/%s...%s",
-                         local_path, pr_branch, repo, branch, pr_branch)
-            return True, commit_sha
-        raise RuntimeError(f"GitHub upload still failing [{r2.status_code}]: {r2.text}")
-
-    raise RuntimeError(f"GitHub upload failed [{r.status_code}]: {r.text}")
-
-
-def maybe_upload_to_github(local_path):
-    token = os.getenv("GH_TOKEN"); repo = os.getenv("GH_REPO")
-    if not token or not repo:
-        logging.info("Upload: GH_TOKEN or GH_REPO not set; skipping."); return False, None
-    branch = os.getenv("GH_BRANCH","main")
-    dest   = os.getenv("GH_PATH","docs/data/snapshot.json")
-    name   = os.getenv("GH_COMMITTER_NAME","sp500-bot")
-    email  = os.getenv("GH_COMMITTER_EMAIL","actions@users.noreply.github.com")
-
-    with open(local_path,"rb") as f:
-        content_b64 = base64.b64encode(f.read()).decode("ascii")
-    msg = f"snapshot {datetime.utcnow().isoformat(timespec='seconds')}Z"
-
-    api_get = f"https://api.github.com/repos/{repo}/contents/{dest}"
-    r = _gh(api_get, token, params={"ref": branch})
-    sha = r.json().get("sha") if r.status_code==200 else None
-
-    api_put = f"https://api.github.com/repos/{repo}/contents/{dest}"
-    payload = {"message": msg, "content": content_b64, "branch": branch, "committer": {"name": name, "email": email}}
-    if sha: payload["sha"] = sha
-    r = _gh(api_put, token, "PUT", json=payload)
-    if r.status_code in (200,201):
-        commit_sha = (r.json().get("commit") or {}).get("sha")
-        logging.info("Upload: wrote to %s:%s (commit %s).", repo, dest, commit_sha or "unknown")
-        return True, commit_sha
-
-    if r.status_code == 403:
-        logging.warning("Upload: 403 on %s — falling back to PR branch.", branch)
-        base_sha = _gh_get_ref(repo, branch, token)
-        pr_branch = "bot-data"
-        try: _gh_create_ref(repo, pr_branch, base_sha, token)
-        except Exception: pass
-        payload.pop("sha", None)
-        payload["branch"] = pr_branch
-        r2 = _gh(api_put, token, "PUT", json=payload)
-        if r2.status_code in (200,201):
-            commit_sha = (r2.json().get("commit") or {}).get("sha")
+    branch = branch or os.getenv("GH_BRANCH","main")
+    who = {"name": os.getenv("GH_COMMITTER_NAME","sp500-bot"),
+           "email": os.getenv("GH_COMMITTER_EMAIL","actions@users.noreply.github.com")}
+    msg = message or f"snapshot {datetime.utcnow().isoformat(timespec='seconds')}Z"
+
+    local = {}
+    for dest, src in files.items():
+        with open(src,"rb") as f:
+            local[dest.strip("/")] = f.read()
+    hashes = {d: git_blob_sha(data) for d, data in local.items()}
+    prefixes = [p.strip("/") + "/" for p in prune]
+    created = {}   # local git hash → blob sha, reused when the ref update is retried
+
+    for attempt in range(3):
+        head = _gh_get_ref(repo, branch, token)
+        base_tree = _gh_json(_gh(_gh_api(repo, f"git/commits/{head}"), token), "Read commit")["tree"]["sha"]
+        remote = _gh_remote_blobs(repo, base_tree, token)
+        changed = [d for d in local if remote.get(d) != hashes[d]]
+        deleted = [p for p in remote if p not in local and any(p.startswith(x) for x in prefixes)]
+        if not changed and not deleted:
+            logging.info("Upload: %d file(s) unchanged on %s:%s; nothing to commit.", len(local), repo, branch)
+            return False, head
+
+        todo = {hashes[d]: d for d in changed if hashes[d] not in created}
+        with ThreadPoolExecutor(max_workers=max(1, HOST_LIMITS["github"]), thread_name_prefix="gh") as pool:
+            for h, sha in zip(todo, pool.map(lambda h: _gh_create_blob(repo, local[todo[h]], token), todo)):
+                created[h] = sha
+        entries = [{"path": d, "mode": "100644", "type": "blob", "sha": created[hashes[d]]} for d in changed]
+        entries += [{"path": p, "mode": "100644", "type": "blob", "sha": None} for p in deleted]
+        tree = _gh_json(_gh(_gh_api(repo, "git/trees"), token, "POST",
+                            json={"base_tree": base_tree, "tree": entries}), "Create tree")["sha"]
+        commit = _gh_json(_gh(_gh_api(repo, "git/commits"), token, "POST",
+                              json={"message": msg, "tree": tree, "parents": [head], "author": who, "committer": who}),
+                          "Create commit")["sha"]
+
+        r = _gh(_gh_api(repo, f"git/refs/heads/{branch}"), token, "PATCH", json={"sha": commit, "force": False})
+        if r.status_code == 200:
+            logging.info("Upload: %d changed / %d deleted of %d file(s) → %s:%s in one commit (%s, %d new blobs).",
+                         len(changed), len(deleted), len(local), repo, branch, commit, len(todo))
+            return True, commit
+        if r.status_code == 422 and attempt < 2:
+            logging.warning("Upload: %s moved during upload; retrying on the new head.", branch)
+            continue
+        if r.status_code == 403:
+            logging.warning("Upload: 403 on %s — pointing %s at the commit instead.", branch, GH_FALLBACK_BRANCH)
+            _gh_force_ref(repo, GH_FALLBACK_BRANCH, commit, token)
             logging.info("Upload: pushed to %s. PR → https://github.com/%s/compare/%s...%s",
-                         pr_branch, repo, branch, pr_branch)
-            return True, commit_sha
-        raise RuntimeError(f"GitHub upload still failing [{r2.status_code}]: {r2.text}")
+                         GH_FALLBACK_BRANCH, repo, branch, GH_FALLBACK_BRANCH)
+            return True, commit
+        raise RuntimeError(f"GitHub ref update failed [{r.status_code}]: {r.text}")
+
+# ───────────────────── News counts (batched NewsAPI) ─────────────────────
+NEWS_URL = "https://newsapi.org/v2/everything"
+NEWS_CACHE_PATH = os.getenv("NEWS_CACHE_PATH", ".cache/news.json")
+NEWS_TTL_HOURS = float(os.getenv("NEWS_TTL_HOURS", "6"))        # reuse a count this long without asking
+NEWS_STALE_HOURS = float(os.getenv("NEWS_STALE_HOURS", "48"))   # ... and serve it this long once the budget is spent
+NEWS_MAX_REQUESTS = int(os.getenv("NEWS_MAX_REQUESTS", "40"))   # NewsAPI calls per run
+NEWS_BATCH = int(os.getenv("NEWS_BATCH", "20"))                 # tickers OR-ed into one query
+NEWS_PAGE = 100       # articles per response; counts are capped here as before
+NEWS_Q_MAX = 500      # NewsAPI's limit on the q parameter
+
+def fetch_news_page(terms, news_key):
+    """One /v2/everything call for '"A" OR "B" …' over the last 24h → (totalResults, articles)."""
+    from_dt = (datetime.utcnow() - timedelta(days=1)).isoformat(timespec="seconds")+"Z"
+    q = " OR ".join(f'"{t}"' for t in terms)
+    r = get_http().get(NEWS_URL, params={"q": q, "from": from_dt, "language": "en",
+                                         "sortBy": "publishedAt", "pageSize": NEWS_PAGE},
+                       headers={"X-Api-Key": news_key}, timeout=15)
+    data = r.json()
+    if r.status_code != 200 or data.get("status") != "ok":
+        raise RuntimeError(f"NewsAPI [{r.status_code}] {data.get('code')}: {data.get('message')}")
+    return int(data.get("totalResults", 0)), data.get("articles") or []
+
+def attribute_news(symbols, articles) -> dict:
+    """{symbol: articles whose title/description/content mention it as a whole word (optionally $-prefixed)}."""
+    texts = [" ".join(str(a.get(k) or "") for k in ("title", "description", "content")) for a in articles]
+    out = {}
+    for s in symbols:
+        pat = re.compile(r"(?<![A-Za-z0-9])\$?" + re.escape(s) + r"(?![A-Za-z0-9])")
+        out[s] = sum(1 for t in texts if pat.search(t))
+    return out
+
+def _news_batches(symbols, size: int = NEWS_BATCH) -> list:
+    """Consecutive groups of ≤ size symbols whose OR-ed query fits NEWS_Q_MAX."""
+    out, cur, qlen = [], [], 0
+    for s in symbols:
+        add = len(s) + 2 + (4 if cur else 0)
+        if cur and (len(cur) >= size or qlen + add > NEWS_Q_MAX):
+            out.append(cur); cur, qlen, add = [], 0, len(s) + 2
+        cur.append(s); qlen += add
+    if cur: out.append(cur)
+    return out
+
+class NewsCache:
+    """{symbol: {"n": count, "t": epoch}} of the last NewsAPI counts; get() takes the max age in hours."""
+    def __init__(self, path: str = NEWS_CACHE_PATH):
+        self.path, self.data = path, {}
+        try:
+            if path and os.path.exists(path):
+                with open(path, "r") as f:
+                    self.data = json.load(f)
+        except Exception as e:
+            logging.debug("News cache load failed: %s", e)
 
-    raise RuntimeError(f"GitHub upload failed [{r.status_code}]: {r.text}")
+    def get(self, symbol: str, max_age_h: float):
+        e = self.data.get(symbol)
+        if e is None or time.time() - float(e.get("t", 0)) > max_age_h * 3600:
+            return None
+        return e.get("n")
+
+    def put(self, symbol: str, n: int):
+        self.data[symbol] = {"n": int(n), "t": time.time()}
+
+    def save(self):
+        if not self.path:
+            return None
+        try:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.data, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+            return self.path
+        except Exception as e:
+            logging.debug("News cache save failed: %s", e)
+            return None
+
+def fetch_news_counts(symbols, feats: dict, news_key: str, budget: int = NEWS_MAX_REQUESTS, cache: NewsCache = None) -> dict:
+    """
+    news_24h for every symbol within `budget` NewsAPI requests. Fresh cached counts are
+    reused; the rest are queried NEWS_BATCH tickers at a time, biggest movers first
+    (|ret1d| in % plus positive vol_z), and each returned article is attributed to the
+    tickers it mentions. A batch whose totalResults exceeds the page is split in half
+    and re-asked; a single ticker is counted on its (capped) page the same way, so a
+    ticker that is also a word (ALL, IT, ON) gets the same count however its batch was
+    split. Symbols left when the budget runs out get their last count up to
+    NEWS_STALE_HOURS old.
+    """
+    cache = cache if cache is not None else NewsCache("")
+    out, todo = {}, []
+    for s in symbols:
+        n = cache.get(s, NEWS_TTL_HOURS)
+        if n is None: todo.append(s)
+        else: out[s] = n
+    cached = len(out)
+
+    def score(s):
+        f = feats.get(s) or {}
+        return abs(f.get("ret1d") or 0.0) * 100.0 + max(f.get("vol_z") or 0.0, 0.0)
+    todo.sort(key=score, reverse=True)
+    queue, used, splits = _news_batches(todo), 0, 0
+    while queue and used < budget:
+        batch = queue.pop(0)
+        used += 1
+        try:
+            total, arts = fetch_news_page(batch, news_key)
+        except Exception as e:
+            logging.warning("News: stopping after %d request(s): %s", used, e)
+            break
+        if total <= len(arts) or len(batch) == 1:   # every match on this page, or nothing left to split
+            counts = attribute_news(batch, arts)
+        elif used < budget:                       # page saturated: ask again per half, in priority order
+            h = len(batch) // 2
+            queue[:0] = [batch[:h], batch[h:]]
+            splits += 1
+            continue
+        else:                                     # last request: a lower bound, not cached
+            out.update(attribute_news(batch, arts))
+            continue
+        for s, n in counts.items():
+            out[s] = min(n, NEWS_PAGE); cache.put(s, out[s])
+    fetched = len(out) - cached
+    stale = 0
+    for s in todo:
+        if s not in out:
+            out[s] = cache.get(s, NEWS_STALE_HOURS)
+            stale += out[s] is not None
+    _METRICS.count("news.requests", used)
+    logging.info("News: %d cached, %d fetched in %d/%d request(s) (%d split), %d stale, %d without a count.",
+                 cached, fetched, used, budget, splits, stale, sum(1 for s in symbols if out.get(s) is None))
+    return out
+
+# ───────────────────── Checkpoint journal ─────────────────────
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", ".cache/journal")
+
+class RunJournal:
+    """
+    Append-only JSONL checkpoint of finished rows for one (UTC run date, interval,
+    period), one {"symbol", "row"} per line. A torn last line (killed mid-write) is
+    ignored on load.
+    """
+    def __init__(self, interval: str, period: str, root: str = JOURNAL_DIR, day: str = None):
+        self.day = day or datetime.utcnow().strftime("%Y-%m-%d")
+        self.path = os.path.join(root, f"{self.day}_{re.sub(r'[^A-Za-z0-9]+', '', interval)}_{re.sub(r'[^A-Za-z0-9]+', '', period)}.jsonl")
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """{symbol: row} of every journaled row (last write wins)."""
+        rows = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try: rec = json.loads(line)
+                    except ValueError: continue
+                    if rec.get("symbol") and rec.get("row"): rows[rec["symbol"]] = rec["row"]
+        except FileNotFoundError:
+            pass
+        return rows
+
+    def reset(self):
+        with self._lock:
+            try: os.remove(self.path)
+            except FileNotFoundError: pass
+
+    def append(self, row: dict):
+        rec = {"symbol": row["symbol"], "row": row}
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, separators=(",", ":"), allow_nan=False, default=_json_default) + "\n")
+                f.flush(); os.fsync(f.fileno())
+
+def get_journal(interval: str, period: str):
+    """Checkpoint journal for this run, or None when JOURNAL_DIR is empty."""
+    return RunJournal(interval, period) if JOURNAL_DIR else None
+
+# ───────────────────── Row spool (streaming output) ─────────────────────
+SNAPSHOT_STREAM = os.getenv("SNAPSHOT_STREAM", "0").lower() in TRUE_SET
+SPOOL_DIR = os.getenv("SPOOL_DIR", ".cache")
+
+class SpooledHist:
+    """A row's hist parked in a RowSpool; _hist_of() and _json_default read it back."""
+    __slots__ = ("spool", "offset", "length")
+    def __init__(self, spool: "RowSpool", offset: int, length: int):
+        self.spool, self.offset, self.length = spool, offset, length
+    def load(self) -> dict:
+        return self.spool.read(self.offset, self.length)
+
+class RowSpool:
+    """
+    NDJSON spill file for the bulky part of each row: put(hist) appends one line as
+    the row completes and returns a SpooledHist handle that stays in the row, so the
+    build holds only scalars while the final json.dump (default=_json_default) pulls
+    each hist back in turn. The file is removed once the spool is garbage-collected.
+    """
+    def __init__(self, root: str = SPOOL_DIR):
+        if root:
+            os.makedirs(root, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix="snapshot-rows-", suffix=".ndjson", dir=root or None)
+        self._f = os.fdopen(fd, "w+b")
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, RowSpool._remove, self._f, self.path)
+
+    @staticmethod
+    def _remove(f, path):
+        f.close()
+        try: os.remove(path)
+        except OSError: pass
+
+    def put(self, hist) -> SpooledHist:
+        if hist is None or isinstance(hist, SpooledHist):
+            return hist
+        line = json.dumps(hist, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n"
+        with self._lock:
+            self._f.seek(0, os.SEEK_END)
+            offset = self._f.tell()
+            self._f.write(line)
+        return SpooledHist(self, offset, len(line))
+
+    def read(self, offset: int, length: int) -> dict:
+        with self._lock:
+            self._f.seek(offset)
+            return json.loads(self._f.read(length))
+
+    def size(self) -> int:
+        with self._lock:
+            self._f.seek(0, os.SEEK_END)
+            return self._f.tell()
+
+def _hist_of(row: dict) -> dict:
+    h = row.get("hist") or {}
+    return h.load() if isinstance(h, SpooledHist) else h
+
+def _json_default(o):
+    if isinstance(o, SpooledHist):
+        return o.load()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
 
 # ───────────────────── Build + write ─────────────────────
-def build_snapshot(symbols, news_key=None, period="120d", interval="1d", limit=None):
+class _IvBudget:
+    """Thread-safe IV_MAX counter: reserve a slot before fetching, refund it on failure."""
+    def __init__(self, limit: int):
+        self.left = limit
+        self._lock = threading.Lock()
+    def take(self) -> bool:
+        with self._lock:
+            if self.left <= 0: return False
+            self.left -= 1; return True
+    def refund(self):
+        with self._lock:
+            self.left += 1
+
+def _process_symbol(sym, feat, news_ct, iv_budget, memo=None, offline=False):
+    """
+    Per-symbol network enrichment (fundamentals, IV) on top of the panel indicators in
+    feat; news_ct comes from the batched news stage. With memo, a symbol already enriched by
+    another interval's build reuses those results. offline: cached fundamentals whatever
+    their age, no IV. Returns (partial row or None, seconds).
+    """
+    t_sym = time.time()
+    if not feat:
+        return None, time.time()-t_sym
+
+    # fundamentals
+    fund = {"mcap": None, "pe_ttm": None, "pb": None, "div_yield": None}
+    if memo is not None and sym in memo["fund"]:
+        fund = memo["fund"][sym]
+    elif offline:
+        cache = get_fund_cache()
+        raw = cache.peek(sym) if cache is not None else None
+        if raw:
+            fund = _derive_fundamentals(raw, feat["price"])
+    elif sym not in {"^VIX","BTC-USD","ETH-USD"}:
+        with span("fundamentals", sym):
+            fund = fetch_fundamentals(sym, price=feat["price"], cache=get_fund_cache())
+
+    # options IV (rank/percentile are filled in by the caller, in universe order)
+    iv30 = None
+    if memo is not None and sym in memo["iv"]:
+        iv30 = memo["iv"][sym]
+    elif IV_ENABLE and not offline and sym not in {"BTC-USD","ETH-USD"} and iv_budget.take():
+        with span("iv", sym):
+            iv30 = fetch_iv30(sym, feat["price"])
+        _METRICS.count("iv.ok" if iv30 and iv30 > 0 else "iv.none")
+        if not (iv30 and iv30 > 0):
+            iv30 = None
+            iv_budget.refund()
+
+    row = {
+        "symbol": sym, "name": sym, "sector": "—",
+        "price": feat["price"], "ret1d": feat["ret1d"], "ret5d": feat["ret5d"],
+        "rsi14": feat["rsi14"], "vol_z": feat["vol_z"], "sharpe": feat["sharpe"],
+        "iv30": iv30, "iv_rank": None, "iv_percentile": None,
+        "mcap": fund["mcap"], "pe_ttm": fund["pe_ttm"], "pb": fund["pb"],
+        "div_yield": fund["div_yield"], "beta": None,   # filled by add_analytics from the panel
+        "news_24h": news_ct,
+        "spark30": feat["spark30"],
+        "hist": feat.get("hist"),  # keep history for client-side windows
+    }
+    if memo is not None and not offline and sym not in memo["fund"]:
+        memo["fund"][sym], memo["iv"][sym] = fund, iv30
+    return row, time.time()-t_sym
+
+def _run_pool(fn, items, workers: int, on_done):
+    """fn(item) for every item on up to `workers` threads; on_done(i, done, result) as each finishes."""
+    if workers <= 1:
+        for i, item in enumerate(items):
+            try: res = fn(item)
+            except Exception as e:
+                logging.debug("Worker error %s: %s", item, e); res = None
+            on_done(i, i+1, res)
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snap") as pool:
+        futs = {pool.submit(fn, item): i for i, item in enumerate(items)}
+        for done, fut in enumerate(as_completed(futs), start=1):
+            i = futs[fut]
+            try: res = fut.result()
+            except Exception as e:
+                logging.debug("Worker error %s: %s", items[i], e); res = None
+            on_done(i, done, res)
+
+def fetch_ohlcv(symbols, period: str, interval: str, workers: int = 1, batch_size: int = YF_BATCH_SIZE) -> dict:
+    """{symbol: bars}: bar store / batched download, then per-symbol fallback for the rest."""
+    ohlcv = {}
+    store = get_bar_store()
+    if store is not None:
+        ohlcv = sync_bars(store, symbols, period, interval, batch_size=max(1, batch_size or 1))
+    elif batch_size and batch_size > 1:
+        ohlcv = download_batch(symbols, period, interval, batch_size=batch_size)
+    missing = [s for s in symbols if s not in ohlcv]
+    logging.info("OHLCV: %d/%d symbols in bulk; %d left for per-symbol download.", len(ohlcv), len(symbols), len(missing))
+    if store is not None or (batch_size and batch_size > 1):
+        fetch_one = lambda s: _fallback_bars(s, period, interval)
+    else:
+        fetch_one = lambda s: try_download(s, period, interval)
+    def fetched(i, done, df):
+        if df is not None and not df.empty:
+            ohlcv[missing[i]] = df
+    _run_pool(fetch_one, missing, max(1, int(workers or 1)), fetched)
+    return ohlcv
+
+def build_snapshot(symbols, news_key=None, period="120d", interval="1d", limit=None, workers=1,
+                   batch_size=YF_BATCH_SIZE, refresh_fundamentals=False, resume=False, stream=SNAPSHOT_STREAM,
+                   ohlcv=None, memo=None, offline=False, analytics_path=ANALYTICS_PATH):
+    """
+    Rows for symbols at one interval → (snapshot, IV history JSON path). ohlcv: bars to
+    use instead of downloading; memo: {"news","fund","iv"} dicts shared by the builds
+    of one multi-interval run so news/fundamentals/IV are fetched once per symbol.
+    offline (compute): no requests at all; ohlcv must be given, news and IV are left
+    empty, fundamentals come from the cache and the IV store is read, not saved.
+    The benchmark (ANALYTICS_BENCHMARK) rides along in the OHLCV fetch but gets no row;
+    the analytics artifact goes to analytics_path ("" skips writing it).
+    """
     if limit:
         symbols = symbols[:limit]
         logging.info("Limiting to first %d symbols.", limit)
 
-    rows, n = [], len(symbols)
+    workers = max(1, int(workers or 1))
     t0 = time.time()
-    logging.info("Start fetch (%s, %s): %d symbols.", period, interval, n)
-
-    iv_hist = _load_iv_history() if IV_ENABLE else {}
-    iv_count = 0
-
-    for i, sym in enumerate(symbols, start=1):
-        t_sym = time.time()
-        feat = indicators_for(sym, period, interval)
-        if not feat:
-            logging.warning("[%d/%d] %s: no data (skipped).", i, n, sym)
+    http = get_http(pool_size=workers)
+    iv_on = IV_ENABLE and not offline
+    if offline:
+        news_key = None
+
+    iv_store = IvHistory.load() if IV_ENABLE else IvHistory()
+    iv_budget = _IvBudget(IV_MAX)
+    fund_cache = get_fund_cache()
+    if fund_cache is not None:
+        fund_cache.refresh = refresh_fundamentals and not offline
+
+    # checkpoint: --resume keeps today's journaled rows, a fresh run starts a new journal
+    journal = get_journal(interval, period)
+    done_rows = {}
+    if journal is not None:
+        if resume:
+            done_rows = journal.load()
+            logging.info("Resume: %d journaled row(s) in %s.", len(done_rows), journal.path)
+        else:
+            journal.reset()
+    elif resume:
+        logging.warning("Resume requested but JOURNAL_DIR is empty; building from scratch.")
+    # streaming: each row's hist goes to an NDJSON spool as it completes; rows keep a handle
+    spool = RowSpool() if stream else None
+    if spool is not None:
+        for r in done_rows.values():
+            r["hist"] = spool.put(r.get("hist"))
+    pos = {s: i for i, s in enumerate(symbols)}
+    results = [done_rows.get(s) for s in symbols]   # indexed by universe position → deterministic output order
+    iv_budget.left -= sum(1 for r in results if r and r.get("iv30") is not None)
+    symbols = [s for s in symbols if s not in done_rows]
+
+    n = len(symbols)
+    logging.info("Start fetch (%s, %s): %d symbols, %d worker(s), host limits %s.",
+                 period, interval, n, workers, HOST_LIMITS)
+
+    # 1) OHLCV: given (multi-interval builds resample one shared download) or fetched here
+    extra = benchmark_symbols(symbols + list(done_rows))
+    with span("build.ohlcv"):
+        if ohlcv is None:
+            ohlcv = fetch_ohlcv(symbols + extra, period, interval, workers, batch_size)
+        else:
+            ohlcv = {s: ohlcv[s] for s in symbols + extra
+                     if s in ohlcv and ohlcv[s] is not None and not ohlcv[s].empty}
+
+    # 2) indicators for the whole universe in one panel pass
+    with span("build.panel"):
+        t_c = time.time()
+        panel = Panel({s: ohlcv[s] for s in symbols + extra if s in ohlcv}, interval)
+        feats = panel.indicators(with_hist=spool is None)
+        logging.info("Panel: %d symbols × %d bars → %d with indicators (%.2fs).",
+                     len(panel.symbols), panel.close.shape[0], len(feats), time.time()-t_c)
+
+    # 3) news counts: a few batched NewsAPI queries for the whole universe
+    news = {}
+    if news_key:
+        with span("build.news"):
+            news = dict(memo["news"]) if memo is not None else {}
+            todo = [s for s in symbols if s in feats and s not in news]
+            if todo:
+                news_cache = NewsCache()
+                news.update(fetch_news_counts(todo, feats, news_key, cache=news_cache))
+                news_cache.save()
+            if memo is not None:
+                memo["news"].update(news)
+
+    # 4) per-symbol enrichment (fundamentals, IV)
+    def collect(i, done, res):
+        sym = symbols[i]
+        row, dt = res if res else (None, 0.0)
+        if row is not None and spool is not None:
+            row["hist"] = spool.put(panel.hist(sym))
+        results[pos[sym]] = row
+        _METRICS.add("enrich", dt)
+        if row is not None and journal is not None:
+            journal.append(row)
+        if row is None:
+            logging.warning("[%d/%d] %s: no data (skipped).", done, n, sym)
         else:
-            # optional: news count
-            news_ct = None
-            if news_key:
-                try:
-                    from_dt = (datetime.utcnow() - timedelta(days=1)).isoformat(timespec="seconds")+"Z"
-                    url = "https://newsapi.org/v2/everything"
-                    q = f'"{sym}"'
-                    r = requests.get(url, params={"q": q, "from": from_dt, "language": "en",
-                                                  "sortBy": "publishedAt", "pageSize": 100},
-                                     headers={"X-Api-Key": news_key}, timeout=15)
-                    data = r.json(); news_ct = min(int(data.get("totalResults", 0)), 100)
-                except Exception:
-                    news_ct = None
-
-            # fundamentals
-            fund = {"mcap": None, "pe_ttm": None, "pb": None, "div_yield": None, "beta": None}
-            if sym not in {"^VIX","BTC-USD","ETH-USD"}:
-                fund = fetch_fundamentals(sym)
-
-            # options IV
-            iv30 = None; iv_rank = None; iv_pct = None
-            if IV_ENABLE and iv_count < IV_MAX and sym not in {"BTC-USD","ETH-USD"}:
-                iv30 = fetch_iv30(sym, feat["price"])
-                if iv30 and iv30 > 0:
-                    iv_count += 1
-                    vals = iv_hist.get(sym, [])
-                    vals = [v for v in vals if isinstance(v, (int,float)) and math.isfinite(v)]
-                    vals.append(round(float(iv30), 6))
-                    if len(vals) > 252:
-                        vals = vals[-252:]
-                    iv_hist[sym] = vals
-                    iv_rank, iv_pct = _iv_rank_percentile(vals, iv30)
-
-            rows.append({
-                "symbol": sym, "name": sym, "sector": "—",
-                "price": feat["price"], "ret1d": feat["ret1d"], "ret5d": feat["ret5d"],
-                "rsi14": feat["rsi14"], "vol_z": feat["vol_z"], "sharpe": feat["sharpe"],
-                "iv30": iv30, "iv_rank": iv_rank, "iv_percentile": iv_pct,
-                "mcap": fund["mcap"], "pe_ttm": fund["pe_ttm"], "pb": fund["pb"],
-                "div_yield": fund["div_yield"], "beta": fund["beta"],
-                "news_24h": news_ct,
-                "spark30": feat["spark30"],
-                "hist": feat.get("hist"),  # keep history for client-side windows
-            })
             logging.info("[%d/%d] %s: ok (%.2fs) price=%.4f rsi=%s volz=%s sharpe=%s iv30=%s",
-                         i, n, sym, time.time()-t_sym, feat["price"], feat["rsi14"],
-                         feat["vol_z"], feat["sharpe"], (None if iv30 is None else round(iv30,4)))
+                         done, n, sym, dt, row["price"], row["rsi14"],
+                         row["vol_z"], row["sharpe"], (None if row["iv30"] is None else round(row["iv30"],4)))
 
         # periodic progress
-        if (i % 10 == 0) or (i == n):
-            done = len(rows)
+        if (done % 10 == 0) or (done == n):
+            kept = sum(1 for r in results if r)
             elapsed = time.time() - t0
-            avg = elapsed / max(i, 1)
-            eta = avg * (n - i)
+            avg = elapsed / max(done, 1)
+            eta = avg * (n - done)
             logging.info("Progress: %d/%d processed, %d kept | elapsed %.1fs, ETA %.1fs",
-                         i, n, done, elapsed, max(0.0, eta))
-        time.sleep(0.05)
+                         done, n, kept, elapsed, max(0.0, eta))
+
+    with span("build.enrich"):
+        _run_pool(lambda s: _process_symbol(s, feats.get(s), news.get(s), iv_budget, memo, offline),
+                  symbols, workers, collect)
+
+    rows = [r for r in results if r]
+
+    # IV history: one dated upsert per symbol (a same-day rerun or --resume overwrites), then rank
+    with span("build.iv_history"):
+        iv_rows = [r for r in rows if r["iv30"] is not None]
+        if iv_rows:
+            syms, cur = [r["symbol"] for r in iv_rows], [r["iv30"] for r in iv_rows]
+            iv_store.upsert(syms, cur, int(time.time() // DAY_S))
+            rank, pct = iv_store.rank_pct(syms, cur, IV_RANK_WINDOW, min_count=1)
+            for r, rk, pc in zip(iv_rows, rank, pct):
+                r["iv_rank"] = round(float(rk), 2) if np.isfinite(rk) else None
+                r["iv_percentile"] = round(float(pc), 2) if np.isfinite(pc) else None
+
+    # journaled rows are not in the panel; their hist lists hold the same closes
+    with span("build.grids"):
+        windows = add_window_grids(rows, iv_store, interval, panel=None if done_rows else panel)
+
+    with span("build.alerts"):
+        hits = add_alerts(rows, panel=None if done_rows else panel)
+        for code, k in hits.items():
+            if k: _METRICS.count(f"alert.{code}", k)
+        logging.info("Alerts: %s", ", ".join(f"{c}={k}" for c, k in hits.items() if k) or "none")
+
+    # beta, correlations and clusters from the same closes (journaled rows fall back to hist)
+    if ANALYTICS_ENABLE and rows:
+        with span("build.analytics"):
+            analytics = add_analytics(rows, panel, interval)
+            logging.info("Analytics: beta vs %s for %d/%d rows, %d×%d correlations, %d clusters.",
+                         analytics["benchmark"], sum(r["beta"] is not None for r in rows), len(rows),
+                         analytics["corr"]["n"], analytics["corr"]["n"], len(analytics["groups"]["cluster"]))
+            if analytics_path:
+                write_analytics(analytics, analytics_path)
+            del analytics
+
+    if fund_cache is not None and not offline:
+        fund_cache.save()
+        logging.info("Fundamentals cache: %s", fund_cache.summary())
+    if iv_on and _CHAIN_CACHE is not None:
+        logging.info("Option chain cache (%s): %d hit / %d miss.",
+                     _CHAIN_CACHE.day, _CHAIN_CACHE.hits, _CHAIN_CACHE.misses)
+    http.log_metrics()
+    if spool is not None:
+        logging.info("Row spool: %d hist lists, %.1f MB → %s", len(rows), spool.size()/1e6, spool.path)
 
     # ←←← moved OUTSIDE the loop
     iv_hist_path = None
-    if IV_ENABLE:
-        iv_hist_path = _save_iv_history(iv_hist)
+    if iv_on:
+        with span("build.iv_save"):
+            iv_hist_path = iv_store.save()
 
     out = {
         "as_of_utc": datetime.utcnow().isoformat(timespec="seconds")+"Z",
         "interval": interval,
         "period": period,
         "risk_free": RISK_FREE,
+        "windows": windows,
         "count": len(rows),
         "data": rows
     }
@@ -720,71 +2898,657 @@ def build_snapshot(symbols, news_key=None, period="120d", interval="1d", limit=N
 
 
 
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "rows").lower().strip()
+COLUMNAR_FORMAT = "columnar-v1"
+
+def _f32_b64(a) -> str:
+    return base64.b64encode(np.ascontiguousarray(a, dtype="<f4").tobytes()).decode("ascii")
+
+def to_columnar(snapshot: dict) -> dict:
+    """
+    Columnar form of a row snapshot (docs/app.js decodes it in load()):
+      t       shared, sorted time axis (union of every row's hist.t)
+      cols    {field: [value per symbol]} for every scalar/JSON field
+      hist    closes/volumes as base64 little-endian float32, shape [count, len(t)],
+              NaN where a symbol has no bar on that timestamp
+      spark30 base64 float32 [count, len], right-aligned, NaN-padded (all NaN = null)
+    """
+    rows = snapshot.get("data") or []
+    n = len(rows)
+    axis = sorted({t for r in rows for t in (_hist_of(r).get("t") or [])})
+    pos = {t: j for j, t in enumerate(axis)}
+    closes = np.full((n, len(axis)), np.nan, dtype="float32")
+    vols = np.full((n, len(axis)), np.nan, dtype="float32")
+    spark_len = max([len(r.get("spark30") or []) for r in rows] + [0])
+    spark = np.full((n, spark_len), np.nan, dtype="float32")
+
+    keys = []
+    for r in rows:
+        for k in r:
+            if k not in ("hist", "spark30") and k not in keys:
+                keys.append(k)
+    cols = {k: [] for k in keys}
+    for i, r in enumerate(rows):
+        for k in keys:
+            cols[k].append(r.get(k))
+        h = _hist_of(r)
+        ix = [pos[t] for t in (h.get("t") or [])]
+        if ix:
+            closes[i, ix] = np.array(h.get("c") or [], dtype="float64")
+            vols[i, ix] = np.array(h.get("v") or [], dtype="float64")
+        sp = r.get("spark30") or []
+        if sp:
+            spark[i, spark_len-len(sp):] = np.array(sp, dtype="float64")
+
+    head = {k: v for k, v in snapshot.items() if k != "data"}
+    return {
+        "format": COLUMNAR_FORMAT, **head, "count": n,
+        "t": axis,
+        "cols": cols,
+        "hist": {"dtype": "f4", "shape": [n, len(axis)], "c": _f32_b64(closes), "v": _f32_b64(vols)},
+        "spark30": {"dtype": "f4", "shape": [n, spark_len], "b64": _f32_b64(spark)},
+    }
+
+HIST_SHARD_DIR = "hist"   # relative to the snapshot's folder
+
+def _shard_name(symbol: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", symbol) + ".json"
+
+def write_hist_shards(snapshot: dict, path: str, shard_name: str = HIST_SHARD_DIR) -> dict:
+    """
+    Move every row's hist into <dirname(path)>/<shard_name>/<SYM>.json and return the
+    slim index snapshot (scalars + spark30, plus hist_file/hist_n per row). Shards for
+    symbols no longer in the snapshot are removed.
+    """
+    shard_dir = os.path.join(os.path.dirname(path), shard_name)
+    os.makedirs(shard_dir, exist_ok=True)
+    slim, names, total = [], set(), 0
+    for r in snapshot.get("data") or []:
+        r = dict(r)
+        h = _hist_of(r); r.pop("hist", None)
+        name = _shard_name(r["symbol"])
+        with open(os.path.join(shard_dir, name), "w", encoding="utf-8") as f:
+            json.dump({"symbol": r["symbol"], "t": h.get("t") or [], "c": h.get("c") or [], "v": h.get("v") or []},
+                      f, separators=(",", ":"), ensure_ascii=False)
+        total += os.path.getsize(os.path.join(shard_dir, name))
+        names.add(name)
+        r["hist_file"] = f"{shard_name}/{name}"
+        r["hist_n"] = len(h.get("t") or [])
+        slim.append(r)
+    for fn in os.listdir(shard_dir):
+        if fn.endswith(".json") and fn not in names:
+            os.remove(os.path.join(shard_dir, fn))
+    logging.info("Saved %d history shards → %s (%.1f KB)", len(names), shard_dir, total/1024)
+    return {**{k: v for k, v in snapshot.items() if k != "data"}, "data": slim}
+
+# delta mode: the base snapshot.json is rewritten only on compaction; every other run
+# writes <base>.delta.json with the changes since that base (docs/app.js applies it).
+# A base written this way carries "delta": true; readers only look for a delta then.
+SNAPSHOT_DELTA = os.getenv("SNAPSHOT_DELTA", "0").lower() in TRUE_SET
+DELTA_FORMAT = "delta-v1"
+DELTA_COMPACT_HOURS = float(os.getenv("DELTA_COMPACT_HOURS", "24"))   # base age that forces compaction
+DELTA_COMPACT_RATIO = float(os.getenv("DELTA_COMPACT_RATIO", "0.5"))  # delta/base size that forces compaction
+DELTA_META = ("interval", "period", "risk_free", "windows")
+
+def delta_path(path: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.delta{ext or '.json'}"
+
+def _same(a, b) -> bool:
+    return a == b or (isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b))
+
+def _hist_delta(old: dict, new: dict):
+    """
+    Bar edit turning hist old into new: drop bars from the front, trim revised bars
+    from the end, append the rest. {} when unchanged, None when new does not start
+    inside old (caller replaces the whole row).
+    """
+    ot, nt = old.get("t") or [], new.get("t") or []
+    if not ot and not nt:
+        return {}
+    try: off = ot.index(nt[0]) if nt else None
+    except ValueError: off = None
+    if off is None:
+        return None
+    oc, ov, nc, nv = old.get("c") or [], old.get("v") or [], new.get("c") or [], new.get("v") or []
+    keep, m = 0, min(len(ot) - off, len(nt))
+    while (keep < m and ot[off+keep] == nt[keep]
+           and _same(oc[off+keep], nc[keep]) and _same(ov[off+keep], nv[keep])):
+        keep += 1
+    trim = len(ot) - off - keep
+    if off == 0 and trim == 0 and keep == len(nt):
+        return {}
+    return {"drop": off, "trim": trim, "t": nt[keep:], "c": nc[keep:], "v": nv[keep:]}
+
+def _json_row(row: dict) -> dict:
+    """One row in JSON terms (tuples → lists, spooled hist loaded)."""
+    return json.loads(json.dumps(row, default=_json_default))
+
+def _delta_head(base_as_of, new: dict, count: int) -> dict:
+    return {"format": DELTA_FORMAT, "base_as_of": base_as_of, "as_of_utc": new.get("as_of_utc"),
+            **{k: new.get(k) for k in DELTA_META}, "count": count,
+            "rows": {}, "bars": {}, "replace": [], "removed": []}
+
+def diff_snapshot(base: dict, new: dict) -> dict:
+    """
+    Delta from rows snapshot base to new: changed scalars per symbol ("rows"),
+    appended/revised bars ("bars"), whole rows that are new or cannot be expressed as
+    a bar edit ("replace"), dropped symbols ("removed") and "order" when it changed.
+    New rows are compared one at a time in JSON terms, so a spooled hist is only in
+    memory while its own row is diffed.
+    """
+    brows = {r["symbol"]: r for r in base.get("data") or []}
+    rows, bars, replace = {}, {}, []
+    for r in map(_json_row, new.get("data") or []):
+        sym, b = r["symbol"], brows.get(r["symbol"])
+        hd = None if b is None else _hist_delta(b.get("hist") or {}, r.get("hist") or {})
+        if hd is None:
+            replace.append(r); continue
+        ch = {k: v for k, v in r.items() if k != "hist" and (k not in b or not _same(v, b[k]))}
+        ch.update({k: None for k in b if k not in r})
+        if ch: rows[sym] = ch
+        if hd: bars[sym] = hd
+    order = [r["symbol"] for r in new.get("data") or []]
+    out = {**_delta_head(base.get("as_of_utc"), new, len(order)), "rows": rows, "bars": bars,
+           "replace": replace, "removed": [s for s in brows if s not in set(order)]}
+    if order != list(brows):
+        out["order"] = order
+    return out
+
+def apply_delta(base: dict, delta: dict) -> dict:
+    """Inverse of diff_snapshot (same steps as applyDelta in docs/app.js); base is not modified."""
+    by = {r["symbol"]: r for r in base.get("data") or []}
+    for s in delta.get("removed") or []:
+        by.pop(s, None)
+    for r in delta.get("replace") or []:
+        by[r["symbol"]] = r
+    for s, ch in (delta.get("rows") or {}).items():
+        if s in by: by[s] = {**by[s], **ch}
+    for s, b in (delta.get("bars") or {}).items():
+        if s not in by: continue
+        h = by[s].get("hist") or {}
+        cut = lambda k: list((h.get(k) or [])[b.get("drop", 0):len(h.get(k) or []) - b.get("trim", 0)]) + list(b.get(k) or [])
+        by[s] = {**by[s], "hist": {"t": cut("t"), "c": cut("c"), "v": cut("v")}}
+    order = delta.get("order") or [r["symbol"] for r in base.get("data") or []]
+    data = [by[s] for s in order if s in by]
+    return {**base, "as_of_utc": delta.get("as_of_utc"), **{k: delta.get(k) for k in DELTA_META},
+            "count": len(data), "data": data}
+
+def _compaction_reason(base, snapshot):
+    if not base:
+        return "no base"
+    if base.get("format"):
+        return f"base is {base['format']}, not rows"
+    if not base.get("delta"):
+        return "base not written in delta mode"
+    if any(base.get(k) != snapshot.get(k) for k in ("interval", "period")):
+        return "interval/period changed"
+    try:
+        age = datetime.utcnow() - datetime.strptime(base.get("as_of_utc", ""), "%Y-%m-%dT%H:%M:%SZ")
+    except ValueError:
+        return "base has no as_of_utc"
+    if age.total_seconds() > DELTA_COMPACT_HOURS * 3600:
+        return f"base older than {DELTA_COMPACT_HOURS:g}h"
+    return None
+
+def write_delta_snapshot(snapshot: dict, path: str = "docs/data/snapshot.json", pretty: bool = True) -> list:
+    """
+    Delta-mode write: diff against the base at `path` and write delta_path(path), or
+    compact (rewrite the base, empty delta) when the base is missing, stale or the
+    delta has grown past DELTA_COMPACT_RATIO of it. Returns the paths written.
+    """
+    dpath = delta_path(path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            base = json.load(f)
+    except (OSError, ValueError):
+        base = None
+    reason = _compaction_reason(base, snapshot)
+    delta = None
+    if reason is None:
+        delta = diff_snapshot(base, snapshot)
+        size = len(json.dumps(delta, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+        if size > DELTA_COMPACT_RATIO * os.path.getsize(path):
+            reason = f"delta {size/1024:.1f} KB > {DELTA_COMPACT_RATIO:g} × base"
+    written = []
+    if reason is not None:
+        logging.info("Delta: compacting into a new base (%s).", reason)
+        written.append(write_local_snapshot({**snapshot, "delta": True}, path, pretty=pretty))
+        delta = _delta_head(snapshot.get("as_of_utc"), snapshot, len(snapshot.get("data") or []))
+    os.makedirs(os.path.dirname(dpath) or ".", exist_ok=True)
+    tmp = dpath + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(delta, f, separators=(",", ":"), ensure_ascii=False)
+    os.replace(tmp, dpath)
+    logging.info("Saved delta → %s (%.1f KB: %d changed, %d bar edits, %d replaced, %d removed; base %s)",
+                 dpath, os.path.getsize(dpath)/1024, len(delta["rows"]), len(delta["bars"]),
+                 len(delta["replace"]), len(delta["removed"]), delta["base_as_of"])
+    written.append(dpath)
+    return written
+
 # REPLACE your existing write_local_snapshot with this version
-def write_local_snapshot(snapshot, path="docs/data/snapshot.json", pretty: bool = True):
-    """Write snapshot JSON (pretty or compact)."""
+def write_local_snapshot(snapshot, path="docs/data/snapshot.json", pretty: bool = True, fmt: str = "rows",
+                         shard_name: str = HIST_SHARD_DIR):
+    """
+    Write snapshot JSON (pretty or compact). fmt="columnar" writes to_columnar(snapshot),
+    always compact; fmt="sharded" writes the slim index and per-symbol hist shards.
+    json.dump encodes incrementally into <path>.tmp, pulling spooled hist lists back one
+    row at a time, and the finished file replaces path atomically.
+    """
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
+    if fmt == "columnar":
+        snapshot, pretty = to_columnar(snapshot), False
+    elif fmt == "sharded":
+        snapshot = write_hist_shards(snapshot, path, shard_name)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         if pretty:
-            json.dump(snapshot, f, indent=2, ensure_ascii=False)
+            json.dump(snapshot, f, indent=2, ensure_ascii=False, default=_json_default)
             f.write("\n")
         else:
-            json.dump(snapshot, f, separators=(",", ":"), ensure_ascii=False)
+            json.dump(snapshot, f, separators=(",", ":"), ensure_ascii=False, default=_json_default)
+    os.replace(tmp, path)
     logging.info("Saved → %s (%.1f KB)", path, os.path.getsize(path)/1024)
     return path
 
 
-# ───────────────────────── CLI ─────────────────────────
-def parse_args():
-    ap = argparse.ArgumentParser(description="Build snapshot with techs, Sharpe, fundamentals, IV.")
-    ap.add_argument("--limit", type=int, default=None)
-    ap.add_argument("-v","--verbose", action="count", default=0)
-    ap.add_argument("--update-symbols-from-web", action="store_true",
-        default=os.getenv("UPDATE_SYMBOLS_FROM_WEB","0").lower() in TRUE_SET)
-    ap.add_argument("--universe", default=os.getenv("UNIVERSE","SP500,NAS100,DOW30,EXTRA"),
-        help="Comma-separated: SP500,NAS100,DOW30,EXTRA")
-    ap.add_argument("--interval", default=YF_INTERVAL)
-    ap.add_argument("--period", default=YF_PERIOD)
-    ap.add_argument("--output", default="docs/data/snapshot.json")
-    # In parse_args(), add this:
-    ap.add_argument("--no-pretty", action="store_true", help="Write compact JSON (no indentation)")
+# ───────────────────── Run summary ─────────────────────
+PROFILE_PATH = ".cache/snapshot.prof"
+
+def run_summary_path(snapshot_path: str) -> str:
+    root, _ = os.path.splitext(snapshot_path)
+    return f"{root}.run.json"
+
+def write_run_summary(path: str, **extra) -> str:
+    """Stage p50/p95/max, counters, slowest symbols, HTTP and cache stats for this run."""
+    summ = {"as_of_utc": datetime.utcnow().isoformat(timespec="seconds")+"Z", **extra,
+            **_METRICS.summary(), "http": get_http().metrics()}
+    fund_cache = get_fund_cache()
+    if fund_cache is not None:
+        summ["fundamentals_cache"] = dict(fund_cache.stats)
+    if _UNIVERSE_CACHE is not None:
+        summ["universe_cache"] = dict(_UNIVERSE_CACHE.stats)
+    if _CHAIN_CACHE is not None:
+        summ["option_chain_cache"] = {"day": _CHAIN_CACHE.day, "hits": _CHAIN_CACHE.hits, "misses": _CHAIN_CACHE.misses}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(summ, f, indent=2)
+        f.write("\n")
+    os.replace(path + ".tmp", path)
+    logging.info("Run summary → %s", path)
+    return path
 
-    return ap.parse_args()
 
-def main():
-    args = parse_args()
-    setup_logger(args.verbose)
+# ───────────────────────── CLI ─────────────────────────
+COMMANDS = ("run", "fetch", "compute", "write", "upload", "bench")
 
-    interval = norm_interval(args.interval)
-    period   = args.period
+def parse_args(argv=None):
+    """
+    Subcommands; bare flags (the workflow's `build_snapshot.py -v --workers 8`) mean `run`.
+      run      universe → fetch → compute → write → upload (the full build)
+      fetch    universe + OHLCV into the bar store, nothing written
+      compute  build from the bar store with no network (cached fundamentals, no news/IV), write locally
+      write    re-serialize an existing rows snapshot (--format/--delta/--no-pretty); no pandas/yfinance
+      upload   publish what a previous run wrote (requests only)
+      bench    cold-start import time per subcommand
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS + ("-h", "--help"):
+        argv.insert(0, "run")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-v","--verbose", action="count", default=0)
+    common.add_argument("--profile", nargs="?", const="", default=None, metavar="PATH",
+        help=f"Run under cProfile and write pstats to PATH (default {PROFILE_PATH}); "
+             "covers the main thread, so pair with --workers 1 for per-symbol detail")
+
+    universe = argparse.ArgumentParser(add_help=False)
+    universe.add_argument("--limit", type=int, default=None)
+    universe.add_argument("--update-symbols-from-web", action="store_true",
+        default=os.getenv("UPDATE_SYMBOLS_FROM_WEB","0").lower() in TRUE_SET)
+    universe.add_argument("--refresh-universe", action="store_true",
+        default=os.getenv("UNIVERSE_REFRESH","0").lower() in TRUE_SET,
+        help="Revalidate the Wikipedia index pages even if the universe cache is fresh")
+    universe.add_argument("--universe", default=os.getenv("UNIVERSE","SP500,NAS100,DOW30,EXTRA"),
+        help="Comma-separated: SP500,NAS100,DOW30,EXTRA")
 
-    logging.info("=== Snapshot builder ===")
-    logging.info("Interval=%s Period=%s | RF=%s | IV_ENABLE=%s IV_MAX=%s | update_symbols_from_web=%s | universe=%s",
-                 interval, period, RISK_FREE, IV_ENABLE, IV_MAX, args.update_symbols_from_web, args.universe)
+    bars = argparse.ArgumentParser(add_help=False)
+    bars.add_argument("--interval", default=YF_INTERVAL)
+    bars.add_argument("--period", default=YF_PERIOD)
+    bars.add_argument("--intervals", default=os.getenv("YF_INTERVALS", ""),
+        help="Comma-separated intervals built from shared downloads, e.g. 1h,4h,1d (4h/10m are resampled "
+             "locally); --interval keeps --output, the others write <output>_<interval>.json")
+    bars.add_argument("--intraday-period", default=YF_INTRADAY_PERIOD,
+        help="Download period for the intraday part of --intervals (--period covers 1d/1wk/1mo)")
+    bars.add_argument("--workers", type=int, default=WORKERS,
+        help="Symbols fetched concurrently (per-host limits still apply)")
+    bars.add_argument("--batch-size", type=int, default=YF_BATCH_SIZE,
+        help="Tickers per multi-ticker OHLCV download; 0 or 1 downloads per symbol")
+
+    build = argparse.ArgumentParser(add_help=False)
+    build.add_argument("--refresh-fundamentals", action="store_true",
+        default=os.getenv("FUND_REFRESH","0").lower() in TRUE_SET,
+        help="Ignore fundamentals cache TTLs and re-fetch get_info for every symbol")
+    build.add_argument("--stream", action="store_true", default=SNAPSHOT_STREAM,
+        help="Spool each row's hist to disk as it completes instead of holding every row in memory "
+             "(output is byte-identical)")
+    build.add_argument("--resume", action="store_true",
+        default=os.getenv("RESUME","0").lower() in TRUE_SET,
+        help="Skip symbols already in today's checkpoint journal and finalize from it")
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--output", default="docs/data/snapshot.json")
+    output.add_argument("--no-pretty", action="store_true", help="Write compact JSON (no indentation)")
+    output.add_argument("--format", choices=["rows","columnar","sharded"], default=SNAPSHOT_FORMAT,
+        help="rows: per-symbol dicts (default) | columnar: shared time axis + float32 blobs | "
+             "sharded: slim index + per-symbol hist/<SYM>.json")
+    output.add_argument("--delta", action="store_true", default=SNAPSHOT_DELTA,
+        help="Write only <output>.delta.json against the existing base (rows format); "
+             "the base is rewritten on compaction")
 
+    ap = argparse.ArgumentParser(description="Build snapshot with techs, Sharpe, fundamentals, IV.")
+    sub = ap.add_subparsers(dest="command", metavar="{" + ",".join(COMMANDS) + "}")
+    sub.add_parser("run", parents=[common, universe, bars, build, output],
+                   help="Full build: universe, OHLCV, indicators, news, fundamentals, IV, write, upload (default)")
+    sub.add_parser("fetch", parents=[common, universe, bars],
+                   help="Bring the bar store (BAR_STORE_PATH) up to date; writes no snapshot")
+    sub.add_parser("compute", parents=[common, universe, bars, build, output],
+                   help="Build and write from the bar store without network access (no news/IV, cached fundamentals)")
+    wr = sub.add_parser("write", parents=[common, output],
+                        help="Re-serialize an existing rows snapshot to --format/--delta/--no-pretty")
+    wr.add_argument("--input", default=None, help="Rows snapshot to read (default: --output)")
+    sub.add_parser("upload", parents=[common, bars, output],
+                   help="Publish the snapshot files a previous run wrote (GH_TOKEN/GH_REPO)")
+    bn = sub.add_parser("bench", parents=[common], help="Cold-start import time per subcommand")
+    bn.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per measurement (median is reported)")
+    bn.add_argument("--out", default=None, help="Also write the JSON report here")
+    return ap.parse_args(argv)
+
+def _output_files(path: str, args, written, shard_name: str = HIST_SHARD_DIR) -> tuple:
+    """{repo path: local path} to publish for one written snapshot, and repo dirs to prune."""
+    # repo paths mirror the local ones relative to --output / GH_PATH
+    gh_path = os.getenv("GH_PATH", "docs/data/snapshot.json")
+    dest_snap = os.path.join(os.path.dirname(gh_path), os.path.basename(path)) if path != args.output else gh_path
+    files, prune = {}, []
+    if path in written:                # in delta mode only when compacted
+        files[dest_snap] = path
+    if delta_path(path) in written:
+        files[delta_path(dest_snap)] = delta_path(path)
+    if args.format == "sharded":
+        shard_dir = os.path.join(os.path.dirname(path), shard_name)
+        dest_dir = os.path.join(os.path.dirname(dest_snap), shard_name)
+        if os.path.isdir(shard_dir):
+            files.update({f"{dest_dir}/{fn}": os.path.join(shard_dir, fn)
+                          for fn in sorted(os.listdir(shard_dir)) if fn.endswith(".json")})
+            prune.append(dest_dir)
+    return files, prune
+
+def _write_output(snap, path: str, args, shard_name: str = HIST_SHARD_DIR) -> tuple:
+    """Write one snapshot per the CLI flags → (paths written, {repo path: local path} to publish, dirs to prune)."""
+    pretty = not args.no_pretty if hasattr(args, "no_pretty") else True
+    written = [path]
+    if args.delta and args.format != "rows":
+        logging.warning("Delta mode needs --format rows; writing a full %s snapshot.", args.format)
+    if args.delta and args.format == "rows":
+        written = write_delta_snapshot(snap, path=path, pretty=pretty)
+    else:
+        snap = {k: v for k, v in snap.items() if k != "delta"}   # a full snapshot has no delta to look for
+        write_local_snapshot(snap, path=path, pretty=pretty, fmt=args.format, shard_name=shard_name)
+    files, prune = _output_files(path, args, written, shard_name)
+    return written, files, prune
+
+def _interval_plan(args) -> tuple:
+    """({fetch interval: [target intervals]}, primary interval) from --interval/--intervals."""
+    if args.intervals:
+        plan = plan_intervals(args.intervals.split(","))
+        targets = [iv for ivs in plan.values() for iv in ivs]
+        return plan, norm_interval(args.interval) if norm_interval(args.interval) in targets else targets[0]
+    return {norm_interval(args.interval): [norm_interval(args.interval)]}, norm_interval(args.interval)
+
+def _period_for(args, base: str) -> str:
+    return args.period if (not args.intervals or base in DAILY_INTERVALS) else args.intraday_period
+
+def _universe(args, offline: bool = False) -> list:
     sources = [s.strip() for s in args.universe.split(",") if s.strip()]
-    symbols = get_universe(args.update_symbols_from_web, sources)
+    with span("universe"):
+        symbols = get_universe(args.update_symbols_from_web, sources, force_refresh=args.refresh_universe,
+                               offline=offline)
     logging.info("Universe: %d symbols.", len(symbols))
+    return symbols
 
-    news_key = os.getenv("NEWSAPI_KEY") or None
-    logging.info("News: %s.", "enabled" if news_key else "disabled (no NEWSAPI_KEY)")
+def _with_benchmark(symbols, limit=None) -> list:
+    """The (limited) universe plus the analytics benchmark, for fetches that feed a build."""
+    symbols = symbols[:limit] if limit else symbols
+    return symbols + benchmark_symbols(symbols)
 
-    snap, iv_hist_path = build_snapshot(symbols, news_key=news_key, period=period, interval=interval, limit=args.limit)
-    local_path = write_local_snapshot(snap, path=args.output, pretty=not args.no_pretty if hasattr(args, "no_pretty") else True)
+def _analytics_path(iv: str, primary: str) -> str:
+    return interval_output_path(ANALYTICS_PATH, iv, primary) if ANALYTICS_ENABLE and ANALYTICS_PATH else ""
 
-    if os.getenv("GH_TOKEN") and os.getenv("GH_REPO"):
-        try:
-            # 1) snapshot.json (existing path logic)
-            maybe_upload_to_github(local_path)
-            # 2) iv_history.json (new)
-            # allow override destination via GH_PATH_IV, else mirror local path
-            if iv_hist_path and os.path.exists(iv_hist_path):
-                dest_iv = os.getenv("GH_PATH_IV", iv_hist_path)  # e.g., docs/data/iv_history.json
-                upload_file_to_github(iv_hist_path, dest_path=dest_iv)
-        except Exception as e:
-            logging.error("Upload failed: %s", e)
-    else:
+def _analytics_files(iv: str, primary: str) -> dict:
+    """{repo path: local path} for one interval's analytics artifact (mirrors the local path)."""
+    path = _analytics_path(iv, primary)
+    return {path: path} if path and os.path.exists(path) else {}
+
+def _upload(files: dict, prune, iv_hist_path=None):
+    """One commit for everything written; IV history files ride along when present."""
+    if not (os.getenv("GH_TOKEN") and os.getenv("GH_REPO")):
         logging.info("Upload: skipped (GH_TOKEN or GH_REPO not set).")
+        return
+    try:
+        # unchanged files are skipped; GH_PATH_IV / GH_PATH_IV_STORE override the mirrored local paths
+        if iv_hist_path and os.path.exists(iv_hist_path):
+            files[os.getenv("GH_PATH_IV", iv_hist_path)] = iv_hist_path   # e.g., docs/data/iv_history.json
+            if os.path.exists(IV_STORE_PATH):
+                files[os.getenv("GH_PATH_IV_STORE", IV_STORE_PATH)] = IV_STORE_PATH
+        with span("upload"):
+            publish_to_github(files, prune=prune)
+    except Exception as e:
+        logging.error("Upload failed: %s", e)
+
+def run(args):
+    """
+    One run from parsed CLI args: universe → build → write → upload → run summary.
+    With --intervals, each download (see plan_intervals) is shared by every interval
+    resampled from it, and each interval writes its own snapshot. `compute` runs the
+    same steps offline: bars come from the bar store and nothing is uploaded.
+    """
+    _METRICS.reset()
+    offline = getattr(args, "command", "run") == "compute"
+    plan, primary = _interval_plan(args)
+    logging.info("=== Snapshot builder%s ===", " (offline compute)" if offline else "")
+    logging.info("Interval=%s Period=%s | RF=%s | IV_ENABLE=%s IV_MAX=%s | update_symbols_from_web=%s | universe=%s",
+                 ",".join(iv for ivs in plan.values() for iv in ivs), args.period, RISK_FREE, IV_ENABLE, IV_MAX,
+                 args.update_symbols_from_web, args.universe)
+
+    symbols = _universe(args, offline)
+    store = get_bar_store() if offline else None
+    if offline and store is None:
+        raise SystemExit("compute reads bars from the bar store; set BAR_STORE_PATH and run `fetch` first.")
+
+    news_key = None if offline else (os.getenv("NEWSAPI_KEY") or None)
+    logging.info("News: %s.", "enabled" if news_key else "disabled (offline)" if offline else "disabled (no NEWSAPI_KEY)")
+
+    memo = {"news": {}, "fund": {}, "iv": {}}
+    outputs, files, prune, iv_hist_path = [], {}, [], None
+    for base, ivs in plan.items():
+        period = _period_for(args, base)
+        bars = None
+        if offline:
+            with span(f"load.{base}"):
+                bars = stored_bars(store, _with_benchmark(symbols, args.limit), period, base)
+            logging.info("Bar store: %d/%d symbols at %s/%s.", len(bars), len(symbols), base, period)
+        elif args.intervals:
+            with span(f"fetch.{base}"):
+                bars = fetch_ohlcv(_with_benchmark(symbols, args.limit), period, base, args.workers, args.batch_size)
+            logging.info("Fetched %s/%s once for %s.", base, period, ",".join(ivs))
+        for iv in ivs:
+            frames = bars
+            if bars is not None and iv != base:
+                with span("resample"):
+                    frames = {s: resample_bars(df, base, iv) for s, df in bars.items()}
+            snap, path_iv = build_snapshot(symbols, news_key=news_key, period=period, interval=iv,
+                                           limit=args.limit, workers=args.workers, batch_size=args.batch_size,
+                                           refresh_fundamentals=args.refresh_fundamentals, resume=args.resume,
+                                           stream=args.stream, ohlcv=frames, memo=memo, offline=offline,
+                                           analytics_path=_analytics_path(iv, primary))
+            iv_hist_path = path_iv or iv_hist_path
+            files.update(_analytics_files(iv, primary))
+            path = interval_output_path(args.output, iv, primary)
+            with span("write"):
+                _, f, p = _write_output(snap, path, args, HIST_SHARD_DIR if iv == primary else f"{HIST_SHARD_DIR}_{iv}")
+            files.update(f); prune += p
+            outputs.append({"interval": iv, "period": period, "path": path, "rows": snap["count"]})
+            del snap, frames
+    local_path = args.output
+
+    if offline:
+        logging.info("Upload: skipped (compute); publish with `upload`.")
+    else:
+        _upload(files, prune, iv_hist_path)
+
+    _METRICS.log()
+    first = next((o for o in outputs if o["interval"] == primary), outputs[0])
+    write_run_summary(run_summary_path(local_path), symbols=len(symbols), rows=first["rows"],
+                      interval=first["interval"], period=first["period"], workers=args.workers, format=args.format,
+                      **({"outputs": outputs} if args.intervals else {}), **({"command": "compute"} if offline else {}))
+
+def fetch(args):
+    """`fetch`: universe + OHLCV for every download in the interval plan, into the bar store only."""
+    store = get_bar_store()
+    if store is None:
+        raise SystemExit("fetch fills the bar store; BAR_STORE_PATH is empty.")
+    _METRICS.reset()
+    plan, _ = _interval_plan(args)
+    symbols = _with_benchmark(_universe(args), args.limit)
+    for base, ivs in plan.items():
+        period = _period_for(args, base)
+        with span(f"fetch.{base}"):
+            got = fetch_ohlcv(symbols, period, base, args.workers, args.batch_size)
+        logging.info("Fetched %s/%s for %s: %d/%d symbols → %s", base, period, ",".join(ivs),
+                     len(got), len(symbols), store.path)
+    get_http().log_metrics()
+    _METRICS.log()
+
+def rewrite(args):
+    """`write`: re-serialize a rows snapshot from disk (json only; numpy just for --format columnar)."""
+    src = args.input or args.output
+    with open(src, "r", encoding="utf-8") as f:
+        snap = json.load(f)
+    if snap.get("format"):
+        raise SystemExit(f"write needs a rows snapshot; {src} is {snap['format']}.")
+    for r in snap.get("data") or []:
+        if r.get("hist_file"):
+            raise SystemExit(f"write needs a rows snapshot; {src} is a sharded index.")
+    written, _, _ = _write_output(snap, args.output, args)
+    logging.info("Rewrote %s (%d rows) → %s", src, len(snap.get("data") or []), ", ".join(written))
+
+def upload(args):
+    """`upload`: publish the snapshot(s), delta, shards and IV history a previous run left on disk."""
+    plan, primary = _interval_plan(args)
+    files, prune = {}, []
+    for iv in [iv for ivs in plan.values() for iv in ivs]:
+        path = interval_output_path(args.output, iv, primary)
+        written = [p for p in (path, delta_path(path)) if os.path.exists(p)]
+        if not written:
+            logging.warning("Upload: %s not found; run `run`/`compute`/`write` first.", path)
+            continue
+        f, p = _output_files(path, args, written, HIST_SHARD_DIR if iv == primary else f"{HIST_SHARD_DIR}_{iv}")
+        files.update(f); files.update(_analytics_files(iv, primary)); prune += p
+    if files:
+        _upload(files, prune, IV_HISTORY_PATH if IV_ENABLE else None)
+
+# ───────────────────── Import-time benchmark ─────────────────────
+# modules each subcommand ends up importing (lazily, on first use)
+COMMAND_MODULES = {
+    "run":     ("numpy", "pandas", "requests", "yfinance"),
+    "fetch":   ("numpy", "pandas", "requests", "yfinance"),
+    "compute": ("numpy", "pandas"),
+    "write":   (),
+    "upload":  ("requests",),
+    "bench":   (),
+}
+
+def _import_probe(command: str):
+    """Child side of import_benchmark: import what `command` needs, report modules and wall time."""
+    t = time.perf_counter()
+    for name in COMMAND_MODULES[command]:
+        __import__(name)                 # importlib.import_module would bypass -X importtime for name itself
+    heavy = sorted({m for ms in COMMAND_MODULES.values() for m in ms} & set(sys.modules))
+    print(json.dumps({"import_ms": round((time.perf_counter() - t) * 1e3, 1), "heavy": heavy}))
+
+def import_benchmark(repeat: int = 5) -> dict:
+    """
+    Cold start per subcommand, each measured in `repeat` fresh interpreters: wall time
+    from exec to `import build_snapshot` + that command's dependencies, the share spent
+    in those dependencies, and the heaviest top-level imports (python -X importtime).
+    "eager" is the old all-up-front import set, "python" the bare interpreter.
+    """
+    import subprocess, statistics
+    here = os.path.dirname(os.path.abspath(__file__))
+    def spawn(code):
+        t = time.perf_counter()
+        p = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                           cwd=here, check=True)
+        return (time.perf_counter() - t) * 1e3, p.stdout, p.stderr
+    def top_imports(stderr, n=6):
+        cum = {}
+        for line in stderr.splitlines():
+            parts = line.split("|")
+            # "import time: self | cumulative | name", nested imports indented under their parent
+            if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2][1:].startswith(" "):
+                name = parts[2].strip()
+                cum[name] = max(cum.get(name, 0), int(parts[1]))
+        return {k: round(v / 1e3, 1) for k, v in sorted(cum.items(), key=lambda kv: -kv[1])[:n]}
+    cases = {"python": "pass",
+             "eager": "import build_snapshot, numpy, pandas, requests, yfinance",
+             **{c: f"import build_snapshot as b; b._import_probe({c!r})" for c in COMMANDS}}
+    report = {"python": sys.version.split()[0], "repeat": repeat, "commands": {}}
+    for name, code in cases.items():
+        walls, deps, last = [], [], ("", "")
+        for _ in range(max(1, repeat)):
+            wall, out, err = spawn(code)
+            walls.append(wall); last = (out, err)
+            if out.strip():
+                deps.append(json.loads(out.strip().splitlines()[-1])["import_ms"])
+        entry = {"wall_ms": round(statistics.median(walls), 1), "min_ms": round(min(walls), 1),
+                 "top_imports_ms": top_imports(last[1])}
+        if deps:
+            entry["deps_ms"] = round(statistics.median(deps), 1)
+            entry["heavy"] = json.loads(last[0].strip().splitlines()[-1])["heavy"]
+        report["commands"][name] = entry
+        logging.info("bench %-8s %8.1f ms (min %.1f)", name, entry["wall_ms"], entry["min_ms"])
+    return report
+
+def bench(args):
+    report = import_benchmark(args.repeat)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out + ".tmp", "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        os.replace(args.out + ".tmp", args.out)
+
+COMMAND_FUNCS = {"run": run, "fetch": fetch, "compute": run, "write": rewrite, "upload": upload, "bench": bench}
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logger(args.verbose)
+    cmd = COMMAND_FUNCS[args.command]
+    if args.profile is None:
+        return cmd(args)
+    import cProfile, pstats
+    prof = cProfile.Profile()
+    try:
+        prof.runcall(cmd, args)
+    finally:
+        path = args.profile or PROFILE_PATH
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        prof.dump_stats(path)
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(25)
+        logging.info("Profile → %s (main thread; top 25 by cumulative time)\n%s", path, buf.getvalue())
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,557 @@
+# scripts/snapshot_query.py
+#!/usr/bin/env python3
+"""
+Screening queries over snapshot.json without rescanning rows.
+
+  • Loads a rows, columnar or sharded snapshot (plus snapshot.delta.json when it
+    applies to the base) into a columnar NumPy store: float64 per numeric field,
+    object arrays for text, one column per window-grid element (rsi_w[0], …) and an
+    inverted index for list fields such as alerts
+  • One sorted index per numeric field, built on first use; comparisons are
+    searchsorted range scans over it
+  • Top-N walks the sort field's index in blocks and stops once N matches are in
+    hand, so a screen never sorts the universe
+  • Results cached per normalized query (LRU), dropped when the snapshot file changes
+  • Local HTTP endpoint with CORS for the dashboard and other tools
+
+Query language
+--------------
+  rsi14 < 30 and iv_rank > 80 and mcap > 10B sort by vol_z desc limit 20
+  (sector = Energy or sector = "Real Estate") and not alerts has brk
+  symbol ~ aa                 # case-insensitive substring (text fields)
+  rsi_w[1] <= 35              # window-grid element
+  sector in (Energy, Utilities)
+
+Numbers take K/M/B/T suffixes. A null field never satisfies a comparison (so
+`not` keeps it) and nulls sort last in either direction.
+
+ENV (optional)
+-------------
+SNAPSHOT_PATH=docs/data/snapshot.json
+QUERY_CACHE_SIZE=256          # cached results (LRU per normalized query + sort/limit/fields)
+QUERY_HOST=127.0.0.1
+QUERY_PORT=8765
+QUERY_CORS_ORIGIN=*           # Access-Control-Allow-Origin of the HTTP endpoint
+
+  python scripts/snapshot_query.py "rsi14<30 and mcap>10B sort by vol_z desc" --limit 10
+  python scripts/snapshot_query.py --serve    # GET /query?q=…&sort=…&limit=…&fields=…, /fields, /health
+"""
+
+import os, re, sys, json, time, argparse, logging, threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+from build_snapshot import COLUMNAR_FORMAT, apply_delta, delta_path, setup_logger
+
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "docs/data/snapshot.json")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+QUERY_HOST = os.getenv("QUERY_HOST", "127.0.0.1")
+QUERY_PORT = int(os.getenv("QUERY_PORT", "8765"))
+QUERY_CORS_ORIGIN = os.getenv("QUERY_CORS_ORIGIN", "*")
+DEFAULT_FIELDS = ("symbol", "name", "sector", "price")
+SKIP_FIELDS = {"hist", "spark30"}       # per-bar payloads; screens never look at them
+
+class QueryError(ValueError):
+    pass
+
+# ───────────────────── Snapshot loading ─────────────────────
+def load_snapshot(path: str) -> dict:
+    """Snapshot at path, with <path>.delta.json applied when the base is marked "delta" and the delta is against it."""
+    with open(path, "r", encoding="utf-8") as f:
+        snap = json.load(f)
+    dpath = delta_path(path)
+    if snap.get("delta") and not snap.get("format") and os.path.exists(dpath):
+        try:
+            with open(dpath, "r", encoding="utf-8") as f:
+                delta = json.load(f)
+            if delta.get("base_as_of") == snap.get("as_of_utc"):
+                snap = apply_delta(snap, delta)
+            else:
+                logging.warning("Query: %s is against base %s, not %s; ignored.",
+                                dpath, delta.get("base_as_of"), snap.get("as_of_utc"))
+        except (OSError, ValueError) as e:
+            logging.warning("Query: delta %s unreadable (%s); using the base.", dpath, e)
+    return snap
+
+def _columns(snap: dict) -> dict:
+    """{field: [value per symbol]} from a rows/sharded snapshot or a columnar one."""
+    if snap.get("format") == COLUMNAR_FORMAT:
+        return {k: list(v) for k, v in (snap.get("cols") or {}).items() if k not in SKIP_FIELDS}
+    rows = snap.get("data") or []
+    keys = list(dict.fromkeys(k for r in rows for k in r if k not in SKIP_FIELDS))
+    return {k: [r.get(k) for r in rows] for k in keys}
+
+def _obj_array(vals) -> np.ndarray:
+    out = np.empty(len(vals), dtype=object)
+    for i, v in enumerate(vals):     # element-wise so equal-length lists stay list objects
+        out[i] = v
+    return out
+
+def _is_num(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+# ───────────────────── Columnar store + indexes ─────────────────────
+class SnapshotStore:
+    """
+    Column arrays for one snapshot. num: float64 (NaN = null); text: object arrays;
+    tags: {field: {tag: row ids}} for list fields (alert codes, plain strings); raw:
+    every column as loaded, for output. Sorted indexes are built lazily per field.
+    """
+    def __init__(self, snap: dict):
+        self.meta = {k: v for k, v in snap.items() if k not in ("data", "cols", "t", "hist", "spark30")}
+        cols = _columns(snap)
+        self.n = len(cols.get("symbol") or [])
+        self.raw, self.num, self.text, self.tags, self.ints = {}, {}, {}, {}, set()
+        for k, vals in cols.items():
+            vals = (vals + [None] * self.n)[:self.n]
+            self.raw[k] = _obj_array(vals)
+            present = [v for v in vals if v is not None]
+            if all(_is_num(v) or isinstance(v, bool) for v in present):
+                self.num[k] = np.array([np.nan if v is None else float(v) for v in vals], dtype="float64")
+                if present and all(isinstance(v, int) for v in present):
+                    self.ints.add(k)
+            elif all(isinstance(v, str) for v in present):
+                self.text[k] = self.raw[k]
+            elif all(isinstance(v, list) for v in present):
+                if all(_is_num(x) or x is None for v in present for x in v):
+                    width = max((len(v) for v in present), default=0)
+                    for j in range(width):   # window grids: one numeric column per element
+                        self.num[f"{k}[{j}]"] = np.array(
+                            [np.nan if v is None or j >= len(v) or v[j] is None else float(v[j]) for v in vals],
+                            dtype="float64")
+                else:
+                    inv = {}
+                    for i, v in enumerate(vals):
+                        for x in v or []:
+                            tag = x.get("code") if isinstance(x, dict) else x
+                            if isinstance(tag, str):
+                                inv.setdefault(tag, []).append(i)
+                    self.tags[k] = {t: np.array(sorted(set(ids)), dtype="int64") for t, ids in inv.items()}
+        self._index, self._text_order = {}, {}
+        self._lock = threading.Lock()
+
+    def fields(self) -> dict:
+        return {"numeric": sorted(self.num), "text": sorted(self.text),
+                "tags": {k: sorted(v) for k, v in self.tags.items()}}
+
+    def index(self, field: str) -> tuple:
+        """(ascending row ids of non-null values, those values sorted, descending ids, null ids)."""
+        ix = self._index.get(field)
+        if ix is None:
+            v = self.num[field]
+            ok = np.flatnonzero(~np.isnan(v))
+            asc = ok[np.argsort(v[ok], kind="stable")]
+            desc = ok[np.argsort(-v[ok], kind="stable")]   # ties keep universe order both ways
+            ix = (asc, v[asc], desc, np.flatnonzero(np.isnan(v)))
+            with self._lock:
+                self._index[field] = ix
+        return ix
+
+    def text_order(self, field: str, desc: bool) -> np.ndarray:
+        key = (field, desc)
+        order = self._text_order.get(key)
+        if order is None:
+            vals = self.text[field]
+            ok = np.array([v is not None for v in vals], dtype=bool)
+            ids = np.flatnonzero(ok)
+            _, rank = np.unique(np.array([vals[i].casefold() for i in ids], dtype=str), return_inverse=True)
+            srt = ids[np.argsort(-rank if desc else rank, kind="stable")]   # ties keep universe order
+            order = np.concatenate([srt, np.flatnonzero(~ok)])
+            with self._lock:
+                self._text_order[key] = order
+        return order
+
+    def _ids(self, ids) -> np.ndarray:
+        m = np.zeros(self.n, dtype=bool)
+        m[ids] = True
+        return m
+
+    def range_mask(self, field: str, op: str, x: float) -> np.ndarray:
+        """Rows where field <op> x, from one or two searchsorted cuts of the field's index."""
+        asc, sv, _, _ = self.index(field)
+        lo, hi = np.searchsorted(sv, x, "left"), np.searchsorted(sv, x, "right")
+        if op == "<":    ids = asc[:lo]
+        elif op == "<=": ids = asc[:hi]
+        elif op == ">":  ids = asc[hi:]
+        elif op == ">=": ids = asc[lo:]
+        elif op == "=":  ids = asc[lo:hi]
+        else:            ids = np.concatenate([asc[:lo], asc[hi:]])   # !=
+        return self._ids(ids)
+
+# ───────────────────── Query language ─────────────────────
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<num>[-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?[kmbt]?)(?![\w.\[])
+  | (?P<str>"[^"]*"|'[^']*')
+  | (?P<op><=|>=|!=|==|=|<|>|~|\(|\)|,)
+  | (?P<word>[A-Za-z_^][\w.\-^]*(?:\[\d+\])?)
+)""", re.X | re.I)
+_SUFFIX = {"k": 1e3, "m": 1e6, "b": 1e9, "t": 1e12}
+_KEYWORDS = {"and", "or", "not", "in", "has", "sort", "order", "by", "asc", "desc", "limit"}
+
+def tokenize(q: str) -> list:
+    out, pos, q = [], 0, q.strip()
+    while pos < len(q):
+        m = _TOKEN.match(q, pos)
+        if not m or m.end() == pos:
+            raise QueryError(f"cannot parse at {q[pos:pos+20]!r}")
+        kind = m.lastgroup; tok = m.group(kind)
+        if kind == "num":
+            mult = _SUFFIX.get(tok[-1].lower(), 1.0)
+            out.append(("num", float(tok[:-1] if mult != 1.0 else tok) * mult))
+        elif kind == "str":
+            out.append(("str", tok[1:-1]))
+        elif kind == "word" and tok.lower() in _KEYWORDS:
+            out.append(("kw", tok.lower()))
+        else:
+            out.append((kind, tok))
+        pos = m.end()
+    return out
+
+class _Parser:
+    """
+    Recursive descent over tokens → (AST, sort field, descending, limit). AST nodes:
+    ("cmp", field, op, value) ("in", field, values) ("has", field, tag)
+    ("and", a, b) ("or", a, b) ("not", a) ("all",) for an empty filter.
+    """
+    def __init__(self, tokens):
+        self.t, self.i = tokens, 0
+
+    def peek(self, *want):
+        if self.i < len(self.t) and (not want or self.t[self.i][1] in want):
+            return self.t[self.i]
+        return None
+
+    def take(self, *want):
+        tok = self.peek(*want)
+        if tok is None:
+            got = self.t[self.i][1] if self.i < len(self.t) else "end of query"
+            raise QueryError(f"expected {' or '.join(map(str, want)) or 'a term'}, got {got!r}")
+        self.i += 1
+        return tok
+
+    def parse(self):
+        ast = ("all",) if self.peek("sort", "order", "limit") or self.i >= len(self.t) else self.expr()
+        sort, desc, limit = None, False, None
+        if self.peek("sort", "order"):
+            self.take(); self.peek("by") and self.take()
+            sort = self.field()
+            if self.peek("asc", "desc"):
+                desc = self.take()[1] == "desc"
+        if self.peek("limit"):
+            self.take()
+            kind, v = self.take()
+            if kind != "num" or v < 0 or v != int(v):
+                raise QueryError(f"limit needs a whole number, got {v!r}")
+            limit = int(v)
+        if self.i < len(self.t):
+            raise QueryError(f"unexpected {self.t[self.i][1]!r}")
+        return ast, sort, desc, limit
+
+    def expr(self):
+        node = self.term()
+        while self.peek("or"):
+            self.take(); node = ("or", node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek("and"):
+            self.take(); node = ("and", node, self.factor())
+        return node
+
+    def factor(self):
+        if self.peek("not"):
+            self.take(); return ("not", self.factor())
+        if self.peek("("):
+            self.take(); node = self.expr(); self.take(")"); return node
+        f = self.field()
+        if self.peek("in"):
+            self.take(); self.take("(")
+            vals = [self.value()]
+            while self.peek(","):
+                self.take(); vals.append(self.value())
+            self.take(")")
+            return ("in", f, tuple(vals))
+        if self.peek("has"):
+            self.take(); return ("has", f, self.value())
+        op = self.take("<", "<=", ">", ">=", "=", "==", "!=", "~")[1]
+        return ("cmp", f, "=" if op == "==" else op, self.value())
+
+    def field(self) -> str:
+        kind, v = self.take()
+        if kind != "word":
+            raise QueryError(f"expected a field name, got {v!r}")
+        return v
+
+    def value(self):
+        kind, v = self.take()
+        if kind not in ("num", "str", "word"):
+            raise QueryError(f"expected a value, got {v!r}")
+        return v
+
+def parse_query(q: str) -> tuple:
+    """(AST, sort field or None, descending, limit or None) for a query string."""
+    return _Parser(tokenize(q or "")).parse()
+
+def _fields_of(ast) -> list:
+    if ast[0] in ("cmp", "in", "has"):
+        return [ast[1]]
+    return [f for a in ast[1:] if isinstance(a, tuple) for f in _fields_of(a)]
+
+def evaluate(store: SnapshotStore, ast) -> np.ndarray:
+    """Boolean row mask for an AST."""
+    op = ast[0]
+    if op == "all":
+        return np.ones(store.n, dtype=bool)
+    if op == "and":
+        return evaluate(store, ast[1]) & evaluate(store, ast[2])
+    if op == "or":
+        return evaluate(store, ast[1]) | evaluate(store, ast[2])
+    if op == "not":
+        return ~evaluate(store, ast[1])
+    field = ast[1]
+    if op == "has":
+        if field not in store.tags:
+            raise QueryError(f"{field!r} is not a list field; have {sorted(store.tags)}")
+        m = np.zeros(store.n, dtype=bool)
+        m[store.tags[field].get(str(ast[2]), [])] = True
+        return m
+    if field in store.num:
+        vals = ast[2] if op == "in" else (ast[3],)
+        if any(not isinstance(v, float) for v in vals):
+            raise QueryError(f"{field} is numeric; got {vals!r}")
+        if op == "in":
+            m = np.zeros(store.n, dtype=bool)
+            for v in vals:
+                m |= store.range_mask(field, "=", v)
+            return m
+        if ast[2] == "~":
+            raise QueryError(f"~ needs a text field; {field} is numeric")
+        return store.range_mask(field, ast[2], ast[3])
+    if field in store.text:
+        col = store.text[field]
+        if op == "in":
+            want = {str(v).casefold() for v in ast[2]}
+            return np.array([v is not None and v.casefold() in want for v in col], dtype=bool)
+        o, x = ast[2], str(ast[3]).casefold()
+        if o == "~":
+            return np.array([v is not None and x in v.casefold() for v in col], dtype=bool)
+        cmp = {"=": lambda a: a == x, "!=": lambda a: a != x, "<": lambda a: a < x, "<=": lambda a: a <= x,
+               ">": lambda a: a > x, ">=": lambda a: a >= x}[o]
+        return np.array([v is not None and cmp(v.casefold()) for v in col], dtype=bool)
+    raise QueryError(f"unknown field {field!r}")
+
+_TOP_N_BLOCK = 1024
+
+def _first_matches(seq: np.ndarray, mask: np.ndarray, limit=None) -> np.ndarray:
+    """seq entries whose mask is set, in order; with a limit, stops at the block holding the limit-th."""
+    if limit is None:
+        return seq[mask[seq]]
+    out, got, step = [], 0, max(_TOP_N_BLOCK, 4 * limit)
+    for i in range(0, len(seq), step):
+        if got >= limit:
+            break
+        blk = seq[i:i + step]
+        blk = blk[mask[blk]]
+        out.append(blk); got += len(blk)
+    return np.concatenate(out)[:limit] if out else seq[:0]
+
+def top_n(store: SnapshotStore, mask: np.ndarray, sort=None, desc=False, limit=None) -> np.ndarray:
+    """Matching row ids in sort order (universe order without sort), first `limit` of them."""
+    if sort is None:
+        ids = np.flatnonzero(mask)
+    elif sort in store.num:
+        asc, _, dsc, nulls = store.index(sort)
+        ids = _first_matches(dsc if desc else asc, mask, limit)
+        if limit is None or len(ids) < limit:
+            ids = np.concatenate([ids, _first_matches(nulls, mask, None if limit is None else limit - len(ids))])
+    elif sort in store.text:
+        ids = _first_matches(store.text_order(sort, desc), mask, limit)
+    else:
+        raise QueryError(f"cannot sort by {sort!r}")
+    return ids if limit is None else ids[:limit]
+
+# ───────────────────── Engine (reload + cache) ─────────────────────
+class QueryEngine:
+    """
+    SnapshotStore for a snapshot path plus an LRU of query results. The store is rebuilt
+    (and the cache cleared) when the snapshot or its delta changes on disk.
+    """
+    def __init__(self, path: str = SNAPSHOT_PATH, cache_size: int = QUERY_CACHE_SIZE):
+        self.path, self.cache_size = path, cache_size
+        self.store, self._stamp = None, None
+        self.cache = OrderedDict()
+        self.stats = {"queries": 0, "hits": 0, "reloads": 0}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _disk_stamp(self):
+        return tuple((os.stat(p).st_mtime_ns, os.stat(p).st_size) if os.path.exists(p) else None
+                     for p in (self.path, delta_path(self.path)))
+
+    def refresh(self) -> SnapshotStore:
+        stamp = self._disk_stamp()
+        with self._lock:
+            if self.store is None or stamp != self._stamp:
+                t = time.perf_counter()
+                self.store, self._stamp = SnapshotStore(load_snapshot(self.path)), stamp
+                self.cache.clear(); self.stats["reloads"] += 1
+                logging.info("Query: loaded %s (%d rows, %d numeric fields) in %.0f ms.", self.path,
+                             self.store.n, len(self.store.num), (time.perf_counter() - t) * 1e3)
+            return self.store
+
+    def query(self, q: str = "", sort: str = None, limit: int = None, fields=None) -> dict:
+        """
+        Run a query → {"as_of_utc","query","matched","count","rows","cached","ms"}. sort/limit
+        override the ones in q; fields picks the output columns (default: DEFAULT_FIELDS +
+        every field the query mentions).
+        """
+        t = time.perf_counter()
+        store = self.refresh()
+        ast, q_sort, desc, q_limit = parse_query(q)
+        if sort:
+            sort, desc = (sort[1:], True) if sort.startswith("-") else (sort, False if sort != q_sort else desc)
+        sort = sort or q_sort
+        limit = q_limit if limit is None else limit
+        if limit is not None and limit < 0:
+            raise QueryError(f"limit must be >= 0, got {limit}")
+        fields = tuple(fields or dict.fromkeys([*DEFAULT_FIELDS, *_fields_of(ast), *([sort] if sort else [])]))
+        key = (repr(ast), sort, desc, limit, fields)
+        with self._lock:
+            self.stats["queries"] += 1
+            hit = self.cache.get(key)
+            if hit is not None:
+                self.cache.move_to_end(key); self.stats["hits"] += 1
+        if hit is None:
+            mask = evaluate(store, ast)
+            ids = top_n(store, mask, sort, desc, limit)
+            hit = {"as_of_utc": store.meta.get("as_of_utc"), "interval": store.meta.get("interval"),
+                   "query": _unparse(ast, sort, desc, limit), "matched": int(mask.sum()), "count": len(ids),
+                   "rows": [{f: _value(store, f, i) for f in fields} for i in ids.tolist()]}
+            with self._lock:
+                self.cache[key] = hit
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            cached = False
+        else:
+            cached = True
+        return {**hit, "cached": cached, "ms": round((time.perf_counter() - t) * 1e3, 3)}
+
+def _value(store: SnapshotStore, field: str, i: int):
+    if field in store.raw:
+        return store.raw[field][i]
+    if field in store.num:           # window-grid element
+        v = store.num[field][i]
+        return None if np.isnan(v) else float(v)
+    return None
+
+def _unparse(ast, sort=None, desc=False, limit=None) -> str:
+    """Canonical text of a parsed query (what the cache is keyed on)."""
+    def val(v):
+        return repr(v) if isinstance(v, str) else f"{v:g}"
+    def node(a, top=False):
+        op = a[0]
+        if op == "all": return ""
+        if op == "cmp": return f"{a[1]} {a[2]} {val(a[3])}"
+        if op == "in":  return f"{a[1]} in ({', '.join(val(v) for v in a[2])})"
+        if op == "has": return f"{a[1]} has {val(a[2])}"
+        if op == "not": return f"not {node(a[1])}"
+        s = f" {op} ".join(node(x) for x in a[1:])
+        return s if top else f"({s})"
+    out = node(ast, top=True)
+    if sort: out += f" sort by {sort} {'desc' if desc else 'asc'}"
+    if limit is not None: out += f" limit {limit}"
+    return out.strip()
+
+# ───────────────────── HTTP endpoint ─────────────────────
+def make_server(engine: QueryEngine, host: str = QUERY_HOST, port: int = QUERY_PORT) -> ThreadingHTTPServer:
+    """
+    GET /query?q=…&sort=[-]field&limit=N&fields=a,b → query JSON (400 + {"error"} on a bad query)
+    GET /fields → column names by kind and row count;  GET /health → as_of_utc, rows, cache stats.
+    Every response carries Access-Control-Allow-Origin: QUERY_CORS_ORIGIN.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *a): logging.debug("query http: " + fmt, *a)
+
+        def _send(self, code: int, obj=None):
+            data = b"" if obj is None else json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+            self.send_response(code)
+            self.send_header("Access-Control-Allow-Origin", QUERY_CORS_ORIGIN)
+            self.send_header("Access-Control-Allow-Methods", "GET, OPTIONS")
+            self.send_header("Access-Control-Allow-Headers", "Content-Type")
+            self.send_header("Cache-Control", "no-store")
+            if obj is not None:
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers(); self.wfile.write(data)
+
+        def do_OPTIONS(self):
+            self._send(204)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            args = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            try:
+                if url.path in ("/query", "/query/"):
+                    limit = int(args["limit"]) if args.get("limit") else None
+                    fields = [f for f in (args.get("fields") or "").split(",") if f] or None
+                    return self._send(200, engine.query(args.get("q", ""), args.get("sort"), limit, fields))
+                if url.path == "/fields":
+                    store = engine.refresh()
+                    return self._send(200, {"count": store.n, **store.fields()})
+                if url.path == "/health":
+                    store = engine.refresh()
+                    return self._send(200, {"ok": True, "as_of_utc": store.meta.get("as_of_utc"),
+                                            "rows": store.n, **engine.stats, "cached": len(engine.cache)})
+                self._send(404, {"error": f"no route {url.path}; use /query, /fields or /health"})
+            except (QueryError, ValueError) as e:
+                self._send(400, {"error": str(e)})
+            except OSError as e:
+                self._send(503, {"error": f"snapshot unavailable: {e}"})
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+# ───────────────────────── CLI ─────────────────────────
+def parse_args():
+    ap = argparse.ArgumentParser(description="Screen a snapshot with indexed filter/sort queries.")
+    ap.add_argument("query", nargs="?", default="", help='e.g. "rsi14<30 and mcap>10B sort by vol_z desc"')
+    ap.add_argument("--snapshot", default=SNAPSHOT_PATH, help="rows, columnar or sharded snapshot.json")
+    ap.add_argument("--sort", default=None, help="Sort field (prefix - for descending); overrides the query's")
+    ap.add_argument("--limit", type=int, default=None, help="Top N (overrides the query's limit)")
+    ap.add_argument("--fields", default=None, help="Comma-separated output columns")
+    ap.add_argument("--list-fields", action="store_true", help="Print the queryable fields and exit")
+    ap.add_argument("--serve", action="store_true", help="Serve /query, /fields and /health over HTTP")
+    ap.add_argument("--host", default=QUERY_HOST)
+    ap.add_argument("--port", type=int, default=QUERY_PORT)
+    ap.add_argument("-v","--verbose", action="count", default=0)
+    return ap.parse_args()
+
+def main():
+    args = parse_args()
+    setup_logger(args.verbose)
+    engine = QueryEngine(args.snapshot)
+    if args.list_fields:
+        print(json.dumps({"count": engine.store.n, **engine.store.fields()}, indent=2))
+        return
+    if args.serve:
+        server = make_server(engine, args.host, args.port)
+        logging.warning("Query endpoint on http://%s:%d/query (snapshot %s, %d rows)",
+                        args.host, server.server_port, args.snapshot, engine.store.n)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+    try:
+        res = engine.query(args.query, args.sort, args.limit,
+                           [f for f in (args.fields or "").split(",") if f] or None)
+    except QueryError as e:
+        sys.exit(f"query error: {e}")
+    print(json.dumps(res, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()